@@ -0,0 +1,174 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import pygame
+from pygame import Surface
+from pathlib import Path
+
+from typing import Any, Dict, List, Optional as Opt, Tuple
+from typing_extensions import Final as Fin
+
+# The shooter's images as one texture atlas.
+# source_images() loads every image the game draws from the separate files in
+# img/, with the scaled variants (ship, explosions) already made. build_atlas()
+# packs them into one image, atlas.pix, and writes where each one went to
+# atlas.json. At startup load_images() reads just atlas.pix and slices
+# subsurfaces out of it. The atlas is a build product (not in git): when there
+# is none, or it is stale, load_images() uses the separate files and writes the
+# atlas from them for the next run. It can also be made or refreshed with
+#   python -m games.shooterGame.atlas
+# atlas.pix is the raw RGBX pixels, uncompressed, rather than a PNG: PNG
+# decoding costs about the same per pixel whether it is one file or many, and
+# so does inflating zlib compressed pixels. Raw pixels are a plain file read,
+# which releases the GIL, so read_atlas() can run on a loader thread without
+# stalling the game loop (pygame holds the GIL while it decodes a PNG).
+
+img_dir = Path(__file__).resolve().parent / 'img'
+
+ATLAS_IMAGE: Fin[str] = 'atlas.pix'
+ATLAS_INDEX: Fin[str] = 'atlas.json'
+ATLAS_VERSION: Fin[int] = 1
+ATLAS_WIDTH: Fin[int] = 1024
+COLORKEY: Fin[Tuple[int, int, int]] = (0, 0, 0)  # set on every image but the background
+
+BACKGROUND: Fin[str] = 'starfield'
+METEORS: Fin[List[str]] = ['meteorBrown_big1', 'meteorBrown_med1', 'meteorBrown_med1', 'meteorBrown_med3',
+                           'meteorBrown_small1', 'meteorBrown_small2', 'meteorBrown_tiny1']  # med1 is twice as likely
+EXPLOSION_FRAMES: Fin[int] = 9
+EXPLOSION_SIZES: Fin[Dict[str, Opt[Tuple[int, int]]]] = {'lg': (75, 75), 'sm': (32, 32), 'player': None}
+
+_rectT = Tuple[int, int, int, int]
+
+
+def explosion_name(size: str, frame: int) -> str:
+    return f'explosion_{size}{frame}'
+
+
+def source_files() -> List[str]:
+    # the separate image files the game's images are made from, without .png
+    files = [BACKGROUND, 'laserRed16', 'plyrShip1_orange']
+    files += sorted(set(METEORS))
+    files += [f'{kind}Explosion0{i}' for kind in ('regular', 'sonic') for i in range(EXPLOSION_FRAMES)]
+    return files
+
+
+def assemble(files: Dict[str, Surface]) -> Dict[str, Surface]:
+    # every image the game uses by name, made from the (converted) source_files()
+    images = {BACKGROUND: files[BACKGROUND], 'laserRed16': files['laserRed16']}
+    ship = files['plyrShip1_orange']
+    images['player'] = pygame.transform.scale(ship, (50, 38))
+    images['player_mini'] = pygame.transform.scale(ship, (25, 19))
+    for name in METEORS:
+        images[name] = files[name]
+    for i in range(EXPLOSION_FRAMES):
+        regular = files[f'regularExplosion0{i}']
+        for size, scaled in EXPLOSION_SIZES.items():
+            if scaled is not None:
+                images[explosion_name(size, i)] = pygame.transform.scale(regular, scaled)
+        images[explosion_name('player', i)] = files[f'sonicExplosion0{i}']
+    return images
+
+
+def source_images(src_dir: Path = img_dir) -> Dict[str, Surface]:
+    # every image the game uses by name, from the separate files. Needs a display mode for convert().
+    return assemble({name: pygame.image.load(str(src_dir / f'{name}.png')).convert() for name in source_files()})
+
+
+def pack(sizes: Dict[str, Tuple[int, int]], width: int = ATLAS_WIDTH) -> Tuple[Dict[str, _rectT], int]:
+    # Shelf packing: tallest first, left to right along shelves as high as their first image.
+    # Returns the rect of each name and the atlas height.
+    rects: Dict[str, _rectT] = {}
+    x = y = shelf = 0
+    for name in sorted(sizes, key=lambda name: (-sizes[name][1], -sizes[name][0], name)):
+        w, h = sizes[name]
+        if w > width:
+            raise ValueError(f'{name} is {w} px wide, wider than the {width} px atlas')
+        if x + w > width:
+            x, y, shelf = 0, y + shelf, 0
+        rects[name] = (x, y, w, h)
+        x += w
+        shelf = max(shelf, h)
+    return rects, y + shelf
+
+
+def write_atlas(images: Dict[str, Surface], out_dir: Path) -> Dict[str, _rectT]:
+    # pack images into atlas.pix and atlas.json in out_dir, returns the index
+    rects, height = pack({name: img.get_size() for name, img in images.items()})
+    atlas = Surface((ATLAS_WIDTH, height))
+    atlas.fill(COLORKEY)
+    for name, (x, y, _, _) in rects.items():
+        atlas.blit(images[name], (x, y))
+    with open(out_dir / ATLAS_IMAGE, 'wb') as f:
+        f.write(pygame.image.tostring(atlas, 'RGBX'))
+    index = {'version': ATLAS_VERSION, 'image': ATLAS_IMAGE, 'size': [ATLAS_WIDTH, height],
+             'sprites': {name: list(rect) for name, rect in sorted(rects.items())}}
+    with open(out_dir / ATLAS_INDEX, 'w') as f:
+        json.dump(index, f, indent=1)
+    return rects
+
+
+def build_atlas(src_dir: Path = img_dir, out_dir: Opt[Path] = None) -> Dict[str, _rectT]:
+    # write atlas.pix and atlas.json to out_dir (src_dir by default), returns the index
+    return write_atlas(source_images(src_dir), out_dir or src_dir)
+
+
+def read_index(atlas_dir: Path = img_dir) -> Opt[Dict[str, Any]]:
+    # the atlas index, None if there is no (current) atlas
+    try:
+        with open(atlas_dir / ATLAS_INDEX) as f:
+            index: Dict[str, Any] = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if index.get('version') != ATLAS_VERSION or not (atlas_dir / index['image']).exists():
+        return None
+    return index
+
+
+def read_atlas(atlas_dir: Path, index: Dict[str, Any]) -> Surface:
+    # the atlas image, not yet convert()ed, safe to call on any thread
+    with open(atlas_dir / index['image'], 'rb') as f:
+        pixels = f.read()
+    return pygame.image.frombuffer(pixels, tuple(index['size']), 'RGBX')
+
+
+def slice_atlas(atlas: Surface, index: Dict[str, Any]) -> Dict[str, Surface]:
+    return {name: atlas.subsurface(rect) for name, rect in index['sprites'].items()}
+
+
+def set_colorkeys(images: Dict[str, Surface]) -> Dict[str, Surface]:
+    for name, img in images.items():
+        if name != BACKGROUND:
+            img.set_colorkey(COLORKEY)
+    return images
+
+
+def load_images(atlas_dir: Path = img_dir) -> Dict[str, Surface]:
+    # every image the game uses by name, colour keyed, from the atlas if there is one.
+    # Otherwise from the separate files, and the atlas is written for next time if atlas_dir is writable.
+    index = read_index(atlas_dir)
+    if index is not None:
+        return set_colorkeys(slice_atlas(read_atlas(atlas_dir, index).convert(), index))
+    images = source_images(atlas_dir)
+    try:
+        write_atlas(images, atlas_dir)
+    except OSError:
+        pass  # e.g. a read-only install, keep loading the separate files
+    return set_colorkeys(images)
+
+
+def main(argv: Opt[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Pack the shooter's images into a texture atlas.")
+    parser.add_argument('--src', type=Path, default=img_dir, help='directory of the separate images')
+    parser.add_argument('--out', type=Path, help='where to write atlas.pix and atlas.json, --src by default')
+    args = parser.parse_args(argv)
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+    rects = build_atlas(args.src, args.out)
+    print(f'packed {len(rects)} images into {(args.out or args.src) / ATLAS_IMAGE}')
+    pygame.display.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+from __future__ import annotations
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import pygame
+from pygame import Surface, mixer
+from pathlib import Path
+
+from typing import Any, Callable, Generic, Iterable, List, Optional as Opt, Tuple, TypeVar
+from typing_extensions import Final as Fin
+
+# Background loading of the shooter's images and sounds.
+# An AssetLoader decodes files on a small thread pool and hands out a Handle
+# for each straight away. handle.get() waits for its value the first time it
+# is used; images are decoded off the main thread but convert()ed on first
+# get(), which must be called on the thread that owns the display. The game
+# loop keeps drawing a loading screen and calls poll() every frame, which
+# converts the images that finished decoding since, so startup shows a first
+# frame at once however many assets there are.
+
+LOADER_THREADS: Fin[int] = 4
+
+T = TypeVar('T')
+
+
+class Handle(Generic[T]):
+    # a value loading on the pool; finish, if given, runs on the thread that first calls get()
+    def __init__(self, future: Future, finish: Opt[Callable[[Any], T]] = None) -> None:
+        self.future = future
+        self.finish = finish
+        self.resolved = False
+        self.value: Any = None
+
+    def ready(self) -> bool:
+        return self.resolved or self.future.done()
+
+    def get(self) -> T:
+        if not self.resolved:
+            value = self.future.result()
+            self.value = self.finish(value) if self.finish is not None else value
+            self.resolved = True
+        return self.value  # type: ignore
+
+
+class SoundHandle(Handle[Any]):
+    # a mixer.Sound that can be played before it has finished loading, the first play() waits for it
+    def play(self, *args: Any, **kwargs: Any) -> Any:
+        return self.get().play(*args, **kwargs)
+
+
+class AssetLoader():
+    def __init__(self, workers: int = LOADER_THREADS) -> None:
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='shooter-assets')
+        self.display_thread = threading.current_thread()
+        self.images: List[Handle[Surface]] = []
+
+    def task(self, fn: Callable[..., T], *args: Any) -> Handle[T]:
+        return Handle(self.pool.submit(fn, *args))
+
+    def image(self, path: Path, decode: Opt[Callable[[Path], Surface]] = None) -> Handle[Surface]:
+        # decode(path) on the pool, pygame.image.load() by default, then convert() on first get()
+        future = self.pool.submit(decode, path) if decode is not None else self.pool.submit(pygame.image.load, str(path))
+        handle: Handle[Surface] = Handle(future, self.convert)
+        self.images.append(handle)
+        return handle
+
+    def sound(self, path: Path) -> SoundHandle:
+        return SoundHandle(self.pool.submit(mixer.Sound, str(path)))
+
+    def convert(self, surf: Surface) -> Surface:
+        if threading.current_thread() is not self.display_thread:
+            raise RuntimeError('images must be converted on the display thread')
+        return surf.convert()
+
+    def poll(self) -> None:
+        # convert the images that finished decoding, call once per loading screen frame
+        for handle in self.images:
+            if not handle.resolved and handle.future.done():
+                handle.get()
+
+    def progress(self, handles: Opt[Iterable[Handle[Any]]] = None) -> Tuple[int, int]:
+        # (ready, total) of these handles, all images by default
+        handles = list(self.images if handles is None else handles)
+        return sum(handle.ready() for handle in handles), len(handles)
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=True)
@@ -1,26 +1,65 @@
 # Pygame template - skeleton for a new pygame project
 from __future__ import annotations
+import argparse
+import functools
+import os
 import pygame
-from pygame import sprite, image, Surface, mixer, Rect
+from pygame import sprite, Surface, mixer, Rect
 import random
+from collections import defaultdict, OrderedDict
 from dataclasses import dataclass
 from pathlib import Path
 
-from typing import Dict, Tuple, List
-from typing import Any, ClassVar
+from typing import Dict, Tuple, List, Optional as Opt, Union
+from typing import Any, Callable, ClassVar
 from typing_extensions import Final as Fin, Literal as Lit
 
-curr_dir = Path.cwd()
-img_dir = curr_dir / 'img'
-snd_dir = curr_dir / 'snd'
+from .atlas import (assemble, explosion_name, read_atlas, read_index, set_colorkeys, slice_atlas, source_files,
+                    write_atlas, ATLAS_IMAGE, BACKGROUND, EXPLOSION_FRAMES, EXPLOSION_SIZES, METEORS)
+from .loader import AssetLoader, Handle
+from .pool import SpritePool
+from .spatial import SpatialHash
+from .swarm import Swarm
+
+# Shmup! The game lives in a Game object: init() opens the window (or a dummy
+# one when headless) and loads the assets, step() advances one frame, render()
+# draws it and shutdown() closes pygame, so the module can be imported, tested,
+# profiled and played more than once per process. Game time is frames * 1000 / FPS
+# milliseconds rather than the wall clock, so headless games run as fast as the
+# CPU allows and the same seed plays the same game. run() steps the game at that
+# fixed rate whatever the display runs at: a FixedStep accumulates the time
+# between rendered frames and says how many steps are due, and render() draws
+# the sprites between their positions before and after the last step.
+# With layered=True the sprites and the HUD are DirtySprites in one LayeredDirty
+# group drawn over the background, which redraws and updates on the display only
+# the rects where something changed; the HUD is repainted when its values change.
+
+game_dir = Path(__file__).resolve().parent
+img_dir = game_dir / 'img'
+snd_dir = game_dir / 'snd'
 
 WIDTH: Fin[int] = 480
 HEIGHT: Fin[int] = 600
-FPS: Fin[int] = 60
+FPS: Fin[int] = 60  # simulation steps per second, every speed is in px per step
+MAX_STEPS: Fin[int] = 5  # most steps per rendered frame, a slower machine plays in slow motion rather than stall
+SNAP_DISTANCE: Fin[int] = 32  # px, a sprite that moved further in one step jumped and isn't interpolated
+
+# layers of the layered renderer, below them is the background, the LayeredDirty's clear() surface
+LAYER_MOBS: Fin[int] = 1
+LAYER_BULLETS: Fin[int] = 2
+LAYER_PLAYER: Fin[int] = 3
+LAYER_EFFECTS: Fin[int] = 4
+LAYER_HUD: Fin[int] = 5
+ROT_STEP: Fin[int] = 3  # degrees between the cached rotation frames of a mob
+BULLET_POOL: Fin[int] = 1024  # most free sprites kept for reuse, per pool
+MOB_POOL: Fin[int] = 256
+EXPLOSION_POOL: Fin[int] = 128
 
 # define colorstbh
 
 _colorT = Tuple[int, int, int]
+_keysT = Any  # pressed state by key code, from pygame.key.get_pressed() or keys_down()
+_spriteT = Union['Player', 'Mob', 'Bullet', 'Explosion', 'HudSprite']  # the game's sprites, all with a rect
 
 
 @dataclass
@@ -35,6 +74,45 @@ class color():
     BLUE: ClassVar[_colorT] = (0, 0, 255)
 
 
+class TextRenderer():
+    # Fonts and rendered text for draw_text(). Font files are looked up once per name, Font objects are
+    # kept by (name, size) and rendered surfaces by (text, name, size, colour), least recently used
+    # dropped first. Fonts don't survive pygame.quit(), Game.shutdown() clear()s the cache.
+
+    def __init__(self, max_texts: int = 64) -> None:
+        self.paths: Dict[str, Opt[str]] = {}
+        self.fonts: Dict[Tuple[str, int], pygame.font.Font] = {}
+        self.max_texts = max_texts
+        self.texts: OrderedDict[Tuple[str, str, int, _colorT], Surface] = OrderedDict()
+
+    def font(self, font_name: str, size: int) -> pygame.font.Font:
+        font = self.fonts.get((font_name, size))
+        if font is None:
+            if font_name not in self.paths:
+                self.paths[font_name] = pygame.font.match_font(font_name)  # None for pygame's default font
+            font = self.fonts[font_name, size] = pygame.font.Font(self.paths[font_name], size)
+        return font
+
+    def render(self, text: str, size: int, color: _colorT, font_name: str = 'arial') -> Surface:
+        key = (text, font_name, size, color)
+        surf = self.texts.get(key)
+        if surf is None:
+            surf = self.font(font_name, size).render(text, True, color)
+            self.texts[key] = surf
+            if len(self.texts) > self.max_texts:
+                self.texts.popitem(last=False)
+        else:
+            self.texts.move_to_end(key)
+        return surf
+
+    def clear(self) -> None:
+        self.fonts.clear()
+        self.texts.clear()
+
+
+text_renderer = TextRenderer()
+
+
 def draw_text(surf: Surface,
               # /,  # py3.8
               text: str,
@@ -44,20 +122,12 @@ def draw_text(surf: Surface,
               font_name: str = 'arial',
               color: _colorT = color.YELLOW,
               ) -> None:
-    font_name_match = pygame.font.match_font(font_name)
-    font = pygame.font.Font(font_name_match, size)
-    text_surface = font.render(text, True, color)
+    text_surface = text_renderer.render(text, size, color, font_name)
     text_rect = text_surface.get_rect()
     text_rect.midtop = (x, y)
     surf.blit(text_surface, text_rect)
 
 
-def newmob() -> None:
-    m = Mob()
-    all_sprites.add(m)
-    mobs.add(m)
-
-
 def draw_shield_bar(surf: Surface,
                     x: int,
                     y: int,
@@ -106,21 +176,206 @@ def draw_lives(surf: Surface, x: int, y: int, lives: int, img: Surface) -> None:
         surf.blit(img, img_rect)
 
 
-# initialize pygame and create window
-pygame.init()
-mixer.init()
-screen: Surface = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Shmup!")
-clock: pygame.time.Clock = pygame.time.Clock()
+def score_image(score: int) -> Surface:
+    # the score changes too often for the text cache, it is rendered when it changes instead
+    return text_renderer.font('arial', 28).render(str(score), True, color.YELLOW)
+
+
+def shield_bar_image(shield: float) -> Surface:
+    surf = Surface((100, 10))
+    surf.set_colorkey(color.BLACK)
+    draw_shield_bar(surf, 0, 0, shield)
+    return surf
+
+
+def lives_image(lives: int, img: Surface) -> Opt[Surface]:
+    if lives <= 0:
+        return None
+    surf = Surface((30 * (lives - 1) + img.get_width(), img.get_height()))
+    surf.set_colorkey(color.BLACK)
+    draw_lives(surf, 0, 0, lives, img)
+    return surf
+
 
+def keys_down(*keys: int) -> _keysT:
+    # a keystate for Game.step() with just these keys held, for bots and tests
+    return defaultdict(bool, dict.fromkeys(keys, True))
 
-class Player(sprite.Sprite):
-    def __init__(self) -> None:
+
+class FixedStep():
+    # Fixed timestep accumulator: advance() by the wall clock ms of each rendered frame returns the number
+    # of steps to simulate, rate a second, alpha() is how far the frame is between the last two steps. At
+    # most max_steps are due at once, the time beyond that is dropped. Time is kept in ms * rate, so whole
+    # ms (from Clock.tick()) add up exactly and 60 steps a second never drift into 59.
+
+    def __init__(self, rate: int = FPS, max_steps: int = MAX_STEPS) -> None:
+        self.rate = rate
+        self.max_steps = max_steps
+        self.lag = 0  # ms * rate not simulated yet, a step is 1000
+
+    def advance(self, elapsed_ms: int) -> int:
+        self.lag = min(self.lag + elapsed_ms * self.rate, self.max_steps * 1000)
+        steps = int(self.lag // 1000)
+        self.lag -= steps * 1000
+        return steps
+
+    def alpha(self) -> float:
+        return self.lag / 1000
+
+
+class HudSprite(sprite.DirtySprite):
+    # A part of the HUD for the layered renderer. show(value) repaints it with paint(value), only when the
+    # value changed; a paint() of None hides it. anchor places the image, e.g. midtop=(x, y).
+    _layer = LAYER_HUD
+
+    def __init__(self, paint: Callable[[Any], Opt[Surface]], **anchor: Tuple[int, int]) -> None:
+        super().__init__()
+        self.paint = paint
+        self.anchor = anchor
+        self.value: Any = None
+        self.painted = 0  # times repainted
+        self.image = Surface((0, 0))
+        self.rect = self.image.get_rect()
+        self.visible = 0
+
+    def show(self, value: Any) -> None:
+        if self.painted and value == self.value:
+            return
+        self.value = value
+        self.painted += 1
+        image = self.paint(value)
+        if image is None:
+            self.visible = 0
+        else:
+            self.image = image
+            self.rect = image.get_rect(**self.anchor)
+            self.visible = 1
+            self.dirty = 1
+
+
+class SilentSound():
+    # stands in for a mixer.Sound when there is no audio (headless or no sound device)
+    def play(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+
+class RotationCache():
+    # Rotated frames of source images, shared by every sprite showing them. A frame is keyed by
+    # (source image, angle quantised to ROT_STEP) and rendered the first time it is needed, so memory
+    # is bounded by 360 / ROT_STEP frames per image. Masks for pixel perfect collisions are cached the same way.
+
+    def __init__(self, step: int = ROT_STEP) -> None:
+        self.step = step
+        self.frames: Dict[Tuple[Surface, int], Tuple[Surface, Tuple[int, int]]] = {}
+        self.masks: Dict[Tuple[Surface, int], pygame.mask.Mask] = {}
+
+    def key(self, img: Surface, angle: float) -> Tuple[Surface, int]:
+        return img, round(angle / self.step) % (360 // self.step)
+
+    def frame(self, img: Surface, angle: float) -> Tuple[Surface, Tuple[int, int]]:
+        # the rotated image and its size
+        key = self.key(img, angle)
+        frame = self.frames.get(key)
+        if frame is None:
+            rotated = pygame.transform.rotate(img, key[1] * self.step)
+            frame = self.frames[key] = (rotated, rotated.get_size())
+        return frame
+
+    def mask(self, img: Surface, angle: float) -> pygame.mask.Mask:
+        key = self.key(img, angle)
+        mask = self.masks.get(key)
+        if mask is None:
+            mask = self.masks[key] = pygame.mask.from_surface(self.frame(img, angle)[0])
+        return mask
+
+    def prebuild(self, images: List[Surface]) -> None:
+        # render every frame of these images up front, e.g. behind a loading screen
+        for img in images:
+            for i in range(360 // self.step):
+                self.frame(img, i * self.step)
+
+
+class Assets():
+    # every image and sound the game uses, loaded from the package directory on the loader's threads
+    expl_sounds_fnl: ClassVar[List[str]] = ['expl3.wav', 'expl6.wav']
+    music_fn: ClassVar[str] = 'tgfcoder-FrozenJam-SeamlessLoop.ogg'
+
+    def __init__(self, audio: bool, loader: AssetLoader) -> None:
+        # Start loading. The images can be used after resolve(), sounds play as soon as they have loaded.
+        self.audio = audio
+        self.index = read_index(img_dir)
+        if self.index is not None:
+            self.image_files = {ATLAS_IMAGE: loader.image(img_dir, functools.partial(read_atlas, index=self.index))}
+        else:
+            self.image_files = {name: loader.image(img_dir / f'{name}.png') for name in source_files()}
+
+        # Load all game sounds
+        self.shoot_sound = self.sound(loader, 'pew.wav')
+        self.player_die_sound = self.sound(loader, 'rumble1.ogg')
+        self.expl_sounds = [self.sound(loader, fn) for fn in self.expl_sounds_fnl]
+        self.has_music: Handle[bool] = loader.task(self.load_music)
+        self.sound_files = [handle for handle in (self.shoot_sound, self.player_die_sound, *self.expl_sounds,
+                                                  self.has_music) if isinstance(handle, Handle)]
+        self.resolved = False
+
+    def ready(self) -> bool:
+        # whether resolve() would not have to wait
+        return all(handle.ready() for handle in self.image_files.values())
+
+    def resolve(self) -> None:
+        # Load all game graphics, from the atlas (see atlas.py), on the display thread as they are convert()ed
+        if self.resolved:
+            return
+        for handle in self.sound_files:
+            handle.get()  # a missing sound or music file raises here rather than on first play
+        files = {name: handle.get() for name, handle in self.image_files.items()}
+        if self.index is not None:
+            images = set_colorkeys(slice_atlas(files[ATLAS_IMAGE], self.index))
+        else:
+            images = assemble(files)
+            try:
+                write_atlas(images, img_dir)  # the first run, load the atlas next time
+            except OSError:
+                pass  # e.g. a read-only install, keep loading the separate files
+            images = set_colorkeys(images)
+        self.background = images[BACKGROUND]
+        self.background_rect = self.background.get_rect()
+
+        self.player_img: Surface = images['player']
+        self.player_mini_img = images['player_mini']
+        self.bullet_img: Surface = images['laserRed16']
+
+        self.meteor_images = [images[name] for name in METEORS]
+        self.meteor_frames = RotationCache()
+
+        self.explosion_anim: Dict[str, List[Surface]] = {size: [images[explosion_name(size, i)]
+                                                                for i in range(EXPLOSION_FRAMES)]
+                                                         for size in EXPLOSION_SIZES}
+        self.resolved = True
+
+    def load_music(self) -> bool:
+        # on a loader thread, whether there is music
+        if not self.audio:
+            return False
+        mixer.music.load(str(snd_dir / self.music_fn))
+        mixer.music.set_volume(0.4)
+        return True
+
+    def sound(self, loader: AssetLoader, filename: str) -> Any:
+        if not self.audio:
+            return SilentSound()
+        return loader.sound(snd_dir / filename)
+
+
+class Player(sprite.DirtySprite):
+    _layer = LAYER_PLAYER
+
+    def __init__(self, game: Game) -> None:
         super().__init__()
+        self.game = game
         # self.image = pygame.Surface((50, 40))
         # self.image.fill(color.GREEN)
-        self.image = pygame.transform.scale(player_img, (50, 38))
-        self.image.set_colorkey(color.BLACK)
+        self.image = game.assets.player_img
         self.rect = self.image.get_rect()
         self.radius = 20
         # pygame.draw.circle(self.image, color.RED, self.rect.center, self.radius)
@@ -133,19 +388,18 @@ class Player(sprite.Sprite):
         self.hidden = False
         self.shield = 100.0
         self.shoot_delay = 200
-        self.last_shot = pygame.time.get_ticks()
-        self.hide_timer = pygame.time.get_ticks()
+        self.last_shot = game.now
+        self.hide_timer = game.now
 
-    def update(self) -> None:
+    def update(self, keystate: _keysT) -> None:
         # unhide if hidden
-        if self.hidden and pygame.time.get_ticks() - self.hide_timer > 1000:
+        if self.hidden and self.game.now - self.hide_timer > 1000:
             self.hidden = False
             self.rect.centerx = WIDTH / 2
             self.rect.bottom = HEIGHT - 10
 
         self.speedx = 0
         self.speedy = 0  # if not set, continuous move
-        keystate = pygame.key.get_pressed()
         if keystate[pygame.K_SPACE]:
             self.shoot()
         elif keystate[pygame.K_LEFT]:
@@ -171,221 +425,531 @@ class Player(sprite.Sprite):
             self.rect.left = 0
 
     def shoot(self) -> None:
-        # global bullets
-        now = pygame.time.get_ticks()
+        now = self.game.now
         if now - self.last_shot > self.shoot_delay:
             self.last_shot = now
-            bullet = Bullet(self.rect.centerx, self.rect.top)
-            all_sprites.add(bullet)
-            bullets.add(bullet)
-            shoot_sound.play()
+            self.game.add_bullet(self.rect.centerx, self.rect.top)
+            self.game.assets.shoot_sound.play()
 
     def hide(self) -> None:
         # hide the player temporarily
         self.hidden = True
-        self.hide_timer = pygame.time.get_ticks()
+        self.hide_timer = self.game.now
         self.rect.center = (WIDTH / 2, HEIGHT + 200)
 
 
-class Mob(sprite.Sprite):
-    def __init__(self) -> None:
+class Mob(sprite.DirtySprite):
+    # pooled: Game.newmob() takes one from Game.mob_pool and reset()s it, kill() hands it back
+    _layer = LAYER_MOBS
+
+    def __init__(self, game: Game) -> None:
         super().__init__()
+        self.game = game
+        self.rect: Rect = Rect(0, 0, 0, 0)
+        self.dirty = 2  # always moving, redrawn every frame
+
+    def reset(self) -> None:
+        game = self.game
+        rng = game.rng
         # self.image = meteor_img
         # self.image.set_colorkey(color.BLACK)
-        self.image_orig = random.choice(meteor_images)
-        self.image_orig.set_colorkey(color.BLACK)
-        self.image = self.image_orig.copy()
-        self.rect: Rect = self.image.get_rect()
+        self.image_orig = rng.choice(game.assets.meteor_images)
+        self.image, size = game.assets.meteor_frames.frame(self.image_orig, 0)
+        self.rect.topleft = (0, 0)
+        self.rect.size = size
         # self.image = pygame.Surface((30, 40))
         # self.image.fill(color.RED)
         self.radius: int = int(self.rect.width * 0.85 / 2)
         # pygame.draw.circle(self.image, color.RED, self.rect.center, self.radius)
-        self.rect.x = random.randrange(WIDTH - self.rect.width)
-        self.rect.bottom = random.randrange(-80, -20)
-        self.speedy = random.randrange(1, 5)
-        self.speedx = random.randrange(-3, 3)
+        self.rect.x = rng.randrange(WIDTH - self.rect.width)
+        self.rect.bottom = rng.randrange(-80, -20)
+        self.speedy = rng.randrange(1, 5)
+        self.speedx = rng.randrange(-3, 3)
         self.rot = 0
-        self.rot_speed = random.randrange(-8, 8)
-        self.last_update = pygame.time.get_ticks()
+        self.rot_speed = rng.randrange(-8, 8)
+        self.last_update = game.now
+
+    def kill(self) -> None:
+        if self.alive():
+            super().kill()
+            self.game.mob_pool.release(self)
 
     def rotate(self) -> None:
-        now = pygame.time.get_ticks()
+        now = self.game.now
         if now - self.last_update > 50:
             self.last_update = now
             self.rot = (self.rot + self.rot_speed) % 360
-            new_image = pygame.transform.rotate(self.image_orig, self.rot)
-            old_center = self.rect.center
-            self.image = new_image
-            self.rect = self.image.get_rect()
-            self.rect.center = old_center
+            rect = self.rect
+            old_center = rect.center
+            self.image, rect.size = self.game.assets.meteor_frames.frame(self.image_orig, self.rot)
+            rect.center = old_center
+
+    @property
+    def mask(self) -> pygame.mask.Mask:
+        # for sprite.collide_mask()
+        return self.game.assets.meteor_frames.mask(self.image_orig, self.rot)
 
-    def update(self) -> None:
+    def update(self, *args: Any) -> None:
         self.rotate()
         self.rect.x += self.speedx
         self.rect.y += self.speedy
         if self.rect.top > HEIGHT + 10 or self.rect.left < -100 or self.rect.right > WIDTH + 100:
-            self.rect.x = random.randrange(WIDTH - self.rect.width)
-            self.rect.y = random.randrange(-100, -40)
-            self.speedy = random.randrange(1, 5)
+            rng = self.game.rng
+            self.rect.x = rng.randrange(WIDTH - self.rect.width)
+            self.rect.y = rng.randrange(-100, -40)
+            self.speedy = rng.randrange(1, 5)
 
 
-class Bullet(sprite.Sprite):
-    def __init__(self, x: int, y: int) -> None:
+class Bullet(sprite.DirtySprite):
+    # pooled: Game.add_bullet() takes one from Game.bullet_pool and reset()s it, kill() hands it back
+    _layer = LAYER_BULLETS
+
+    def __init__(self, game: Game) -> None:
         super().__init__()
+        self.game = game
+        self.dirty = 2
         # self.image = pygame.Surface((10, 20))
         # self.image.fill(color.YELLOW)
-        self.image = bullet_img
-        self.image.set_colorkey(color.BLACK)
+        self.image = game.assets.bullet_img
         self.rect = self.image.get_rect()
+        self.speedy = -10
+
+    def reset(self, x: int, y: int) -> None:
         self.rect.bottom = y
         self.rect.centerx = x
-        self.speedy = -10
 
-    def update(self) -> None:
+    def kill(self) -> None:
+        if self.alive():
+            super().kill()
+            self.game.bullet_pool.release(self)
+
+    def update(self, *args: Any) -> None:
         self.rect.y += self.speedy
         # kill if it moves off the top of the screen
         if self.rect.bottom < 0:
             self.kill()
 
 
-class Explosion(pygame.sprite.Sprite):
-    def __init__(self, center: Tuple[int, int], size: Lit['sm', 'med', 'lg', 'player']) -> None:
+class Explosion(sprite.DirtySprite):
+    # pooled: Game.add_explosion() takes one from Game.explosion_pool and reset()s it, kill() hands it back
+    _layer = LAYER_EFFECTS
+
+    def __init__(self, game: Game) -> None:
         super().__init__()
+        self.game = game
+        self.dirty = 2
+        self.rect = Rect(0, 0, 0, 0)
+        self.frame_rate = 75
+
+    def reset(self, center: Tuple[int, int], size: Lit['sm', 'med', 'lg', 'player']) -> None:
         self.size = size
-        self.image = explosion_anim[self.size][0]
-        self.rect = self.image.get_rect()
+        self.anim = self.game.assets.explosion_anim[self.size]
+        self.image = self.anim[0]
+        self.rect.size = self.image.get_size()
         self.rect.center = center
         self.frame = 0
-        self.last_update = pygame.time.get_ticks()
-        self.frame_rate = 75
+        self.last_update = self.game.now
+
+    def kill(self) -> None:
+        if self.alive():
+            super().kill()
+            self.game.explosion_pool.release(self)
 
-    def update(self) -> None:
-        now = pygame.time.get_ticks()
+    def update(self, *args: Any) -> None:
+        now = self.game.now
         if now - self.last_update > self.frame_rate:
             self.last_update = now
             self.frame += 1
-            if self.frame == len(explosion_anim[self.size]):
+            if self.frame == len(self.anim):
                 self.kill()
             else:
-                center = self.rect.center
-                self.image = explosion_anim[self.size][self.frame]
-                self.rect = self.image.get_rect()
-                self.rect.center = center
-
-
-# Load all game graphics
-background = image.load(str(img_dir / "starfield.png")).convert()
-background_rect = background.get_rect()
-
-player_img: Surface = image.load(str(img_dir / "plyrShip1_orange.png")).convert()
-player_mini_img = pygame.transform.scale(player_img, (25, 19))
-player_mini_img.set_colorkey(color.BLACK)
-bullet_img: Surface = image.load(str(img_dir / "laserRed16.png")).convert()
-
-meteor_fnl = ['meteorBrown_big1.png', 'meteorBrown_med1.png', 'meteorBrown_med1.png',
-              'meteorBrown_med3.png', 'meteorBrown_small1.png', 'meteorBrown_small2.png',
-              'meteorBrown_tiny1.png']
-meteor_images = [image.load(str(img_dir / fn)).convert() for fn in meteor_fnl]
-
-explosion_anim: Dict[str, List[Surface]] = {}
-explosion_anim['lg'] = []
-explosion_anim['sm'] = []
-explosion_anim['player'] = []
-
-for i in range(9):
-    filename = f'regularExplosion0{i}.png'
-    img = pygame.image.load(str(img_dir / filename)).convert()
-    img.set_colorkey(color.BLACK)
-    img_lg = pygame.transform.scale(img, (75, 75))
-    explosion_anim['lg'].append(img_lg)
-    img_sm = pygame.transform.scale(img, (32, 32))
-    explosion_anim['sm'].append(img_sm)
-    img.set_colorkey(color.BLACK)
-
-    filename2 = 'sonicExplosion0{}.png'.format(i)
-    img2 = pygame.image.load(str(img_dir / filename2)).convert()
-    img2.set_colorkey(color.BLACK)
-    explosion_anim['player'].append(img2)
-
-# Load all game sounds
-shoot_sound = mixer.Sound(str(snd_dir / 'pew.wav'))
-player_die_sound = mixer.Sound(str(snd_dir / 'rumble1.ogg'))
-expl_sounds_fnl = ['expl3.wav', 'expl6.wav']
-expl_sounds = [mixer.Sound(str(snd_dir / fn)) for fn in expl_sounds_fnl]
-mixer.music.load(str(snd_dir / 'tgfcoder-FrozenJam-SeamlessLoop.ogg'))
-mixer.music.set_volume(0.4)
-
-# create sprite groups
-all_sprites = sprite.Group()
-mobs = sprite.Group()
-bullets = sprite.Group()
-player = Player()
-all_sprites.add(player)
-
-for _ in range(8):
-    newmob()
-
-
-# Game loop
-pygame.mixer.music.play(loops=-1)
-score = 0
-running = True
-died_countdown = []
-while running:
-    # keep loop running at the right speed
-    clock.tick(FPS)
-    # Process input (events)
-    for event in pygame.event.get():
-        # check for closing window
-        if event.type == pygame.QUIT:
-            running = False
-        # elif event.type == pygame.KEYDOWN:
-
-    # Update
-    all_sprites.update()
-
-    # check to see if a bullet hit a mob
-    bullet_hits: Dict[Mob, List[Bullet]] = sprite.groupcollide(mobs, bullets, True, True)
-    for hit in bullet_hits:
-        score += 50 - hit.radius
-        random.choice(expl_sounds).play()
-        expl = Explosion(hit.rect.center, 'lg')
-        all_sprites.add(expl)
-        newmob()
-
-    # check to see if a mob hit the player
-    mob_hits: List[Mob] = sprite.spritecollide(player, mobs, False, sprite.collide_circle)
-    for hit in mob_hits:
-        player.shield -= hit.radius * 0.1
-        expl = Explosion(hit.rect.center, 'sm')
-        all_sprites.add(expl)
-        newmob()
+                rect = self.rect
+                center = rect.center
+                self.image = self.anim[self.frame]
+                rect.size = self.image.get_size()
+                rect.center = center
+
+
+class Game():
+    # One game of Shmup!. run() plays it in a window; tests, benchmarks and bots call
+    # init(), then step()/render() as often as they like, then shutdown().
+
+    def __init__(self,
+                 headless: bool = False,
+                 seed: Opt[int] = None,
+                 num_mobs: int = 8,
+                 swarm: bool = False,
+                 layered: bool = False,
+                 ) -> None:
+        if swarm and layered:
+            raise ValueError('the swarm is not made of sprites, it has no layered renderer')
+        self.headless = headless  # no window and no audio, SDL's dummy drivers are used
+        self.rng = random.Random(seed)
+        self.num_mobs = num_mobs
+        self.swarm_mode = swarm  # mobs and bullets in a NumPy Swarm instead of sprites, for thousands of mobs
+        self.layered = layered  # draw with a LayeredDirty, updating only the parts of the display that changed
+        self.swarm: Opt[Swarm] = None
+        self.frame = 0
+        self.now = 0  # game time in ms, advances 1000 / FPS per step
+        self.score = 0
+        self.running = False
+        self.died_countdown = 0  # steps since the last life was lost
+        self.score_shown = -1  # the score score_surface shows
+        self.saved_env: Dict[str, Opt[str]] = {}  # SDL variables init() overrode, shutdown() puts them back
+        self.player_drawn: Opt[Tuple[int, int]] = None  # where the layered renderer last drew the player
+        self.prev_centers: Dict[_spriteT, Tuple[int, int]] = {}  # by save_positions(), for render()
+
+    def init(self, wait: bool = True) -> None:
+        # Initialize pygame, create the window and start loading the assets. With wait the game is
+        # ready to play on return, else start() it once assets.ready(), see run().
+        if self.headless:
+            for name in ('SDL_VIDEODRIVER', 'SDL_AUDIODRIVER'):
+                self.saved_env[name] = os.environ.get(name)
+                os.environ[name] = 'dummy'
+        pygame.init()
+        audio = not self.headless
+        if not audio:
+            mixer.quit()  # pygame.init() opened it on the dummy driver
+        else:
+            try:
+                mixer.init()
+            except pygame.error:
+                audio = False  # no sound device, play silently
+        self.screen: Surface = pygame.display.set_mode((WIDTH, HEIGHT))
+        pygame.display.set_caption("Shmup!")
+        self.clock: pygame.time.Clock = pygame.time.Clock()
+        self.loader = AssetLoader()
+        self.assets = Assets(audio, self.loader)
+        self.running = True
+        if wait:
+            self.start()
+
+    def start(self) -> None:
+        # create the sprites, waits for any images still loading
+        self.assets.resolve()
+
+        # create sprite groups
+        self.all_sprites: sprite.AbstractGroup = sprite.LayeredDirty() if self.layered else sprite.Group()
+        self.mobs: sprite.Group = sprite.Group()
+        self.bullets: sprite.Group = sprite.Group()
+        self.mob_grid: SpatialHash[Mob] = SpatialHash()
+        self.bullet_pool: SpritePool[Bullet] = SpritePool(lambda: Bullet(self), BULLET_POOL)
+        self.mob_pool: SpritePool[Mob] = SpritePool(lambda: Mob(self), MOB_POOL)
+        self.explosion_pool: SpritePool[Explosion] = SpritePool(lambda: Explosion(self), EXPLOSION_POOL)
+        self.player = Player(self)
+        self.all_sprites.add(self.player)
+        if isinstance(self.all_sprites, sprite.LayeredDirty):
+            assets = self.assets
+            self.all_sprites.clear(self.screen, assets.background)
+            self.score_hud = HudSprite(score_image, midtop=(WIDTH // 2, 10))
+            self.shield_hud = HudSprite(shield_bar_image, topleft=(5, 5))
+            self.lives_hud = HudSprite(functools.partial(lives_image, img=assets.player_mini_img), topleft=(WIDTH - 100, 5))
+            self.game_over_hud = HudSprite(lambda over: text_renderer.render('Game Over!', 68, color.RED) if over else None,
+                                           midtop=(WIDTH // 2, HEIGHT // 2))
+            self.all_sprites.add(self.score_hud, self.shield_hud, self.lives_hud, self.game_over_hud)
+        if self.swarm_mode:
+            assets = self.assets
+            self.swarm = Swarm(self.num_mobs, assets.meteor_images, assets.meteor_frames, assets.bullet_img,
+                               WIDTH, HEIGHT, seed=self.rng.getrandbits(64), now=self.now)
+        else:
+            for _ in range(self.num_mobs):
+                self.newmob()
+
+    def newmob(self) -> None:
+        m = self.mob_pool.acquire()
+        m.reset()
+        self.prev_centers.pop(m, None)  # pooled, it may have been somewhere else before
+        self.all_sprites.add(m)
+        self.mobs.add(m)
+        self.insert_mob(m)  # mobs spawned during the collision tests can still hit the player
+
+    def add_bullet(self, x: int, y: int) -> None:
+        if self.swarm is not None:
+            self.swarm.add_bullet(x, y)
+            return
+        bullet = self.bullet_pool.acquire()
+        bullet.reset(x, y)
+        self.prev_centers.pop(bullet, None)
+        self.all_sprites.add(bullet)
+        self.bullets.add(bullet)
+
+    def add_explosion(self, center: Tuple[int, int], size: Lit['sm', 'med', 'lg', 'player']) -> None:
+        expl = self.explosion_pool.acquire()
+        expl.reset(center, size)
+        self.prev_centers.pop(expl, None)
+        self.all_sprites.add(expl)
+
+    def pool_stats(self) -> Dict[str, Dict[str, int]]:
+        # 'reused' counts the allocations the pools saved
+        return {'bullets': self.bullet_pool.stats(),
+                'mobs': self.mob_pool.stats(),
+                'explosions': self.explosion_pool.stats()}
+
+    def handle_events(self) -> None:
+        # Process input (events)
+        for event in pygame.event.get():
+            # check for closing window
+            if event.type == pygame.QUIT:
+                self.running = False
+
+    def save_positions(self) -> None:
+        # where everything is before the next step, render() interpolates from here
+        self.prev_centers = {s: s.rect.center for s in self.all_sprites}
+        if self.swarm is not None:
+            self.swarm.save_positions()
+
+    def step(self, keystate: Opt[_keysT] = None) -> bool:
+        # Update one step (1000 / FPS ms of game time) with the given pressed keys (the keyboard's by default), return whether the game goes on
+        if keystate is None:
+            keystate = pygame.key.get_pressed()
+        self.frame += 1
+        self.now = self.frame * 1000 // FPS
+        # sprites killed last frame can be reused from now on
+        self.bullet_pool.collect()
+        self.mob_pool.collect()
+        self.explosion_pool.collect()
+        player = self.player
+        assets = self.assets
+        player.update(keystate)
+        for s in self.all_sprites.sprites():
+            if s is not player:
+                s.update()
+
+        if self.swarm is not None:
+            self.step_swarm()
+        else:
+            # check to see if a bullet hit a mob
+            self.build_mob_grid()
+            bullet_hits = self.collide_bullets()
+            for hit in bullet_hits:
+                self.score += 50 - hit.radius
+                self.rng.choice(assets.expl_sounds).play()
+                self.add_explosion(hit.rect.center, 'lg')
+                self.newmob()
+
+            # check to see if a mob hit the player
+            mob_hits = self.collide_player()
+            for hit in mob_hits:
+                self.add_explosion(hit.rect.center, 'sm')
+                self.newmob()
+                self.damage_player(hit.radius * 0.1)
+
+        # if the player died, end the game after 3 seconds of 'Game Over!'
+        if player.lives <= 0:
+            self.died_countdown += 1
+            if self.died_countdown >= FPS * 3:
+                self.running = False
+        return self.running
+
+    def step_swarm(self) -> None:
+        # move the swarm, then the same hit rules as for sprites, with shot mobs respawned by the swarm
+        swarm = self.swarm
+        assert swarm is not None
+        swarm.update(self.now)
+        for x, y, radius in swarm.collide_bullets():
+            self.score += 50 - radius
+            self.rng.choice(self.assets.expl_sounds).play()
+            self.add_explosion((x, y), 'lg')
+        player = self.player
+        for x, y, radius in swarm.collide_circle(player.rect.center, player.radius):
+            self.add_explosion((x, y), 'sm')
+            self.damage_player(radius * 0.1)
+
+    def damage_player(self, amount: float) -> None:
+        player = self.player
+        player.shield -= amount
         if player.shield <= 0:
-            player_die_sound.play()
-            death_explosion = Explosion(player.rect.center, 'player')
-            all_sprites.add(death_explosion)
+            self.assets.player_die_sound.play()
+            self.add_explosion(player.rect.center, 'player')
             player.hide()
             player.lives -= 1
             player.shield = 100
 
-    # if the player died and the explosion has finished playing
-
-    # Draw / render
-    screen.fill(color.BLACK)
-    screen.blit(background, background_rect)
-    all_sprites.draw(screen)
-
-    if player.lives <= 0:   # and not death_explosion.alive():
-        draw_text(screen, 'Game Over!', size=68, x=WIDTH // 2, y=HEIGHT // 2, color=color.RED)
-        died_countdown.append(1)
-        if len(died_countdown) >= FPS * 3:
-            running = False
-
-    draw_text(screen, str(score), size=28, x=WIDTH // 2, y=10, color=color.YELLOW)
-    draw_shield_bar(screen, 5, 5, player.shield)
-    draw_lives(screen, WIDTH - 100, 5, player.lives, player_mini_img)
-    pygame.display.flip()
-
-pygame.quit()
-
-# if __name__ == "__main__":
+    def build_mob_grid(self) -> None:
+        # the broad phase of both collision tests, each mob under the box around its rect and its circle
+        grid = self.mob_grid
+        grid.clear()
+        for mob in self.mobs:
+            self.insert_mob(mob)
+
+    def insert_mob(self, mob: Mob) -> None:
+        r = mob.rect
+        (x, y), radius = r.center, int(mob.radius)
+        self.mob_grid.insert(mob, (min(r.left, x - radius), min(r.top, y - radius),
+                                   max(r.right - 1, x + radius), max(r.bottom - 1, y + radius)))
+
+    def collide_bullets(self) -> Dict[Mob, List[Bullet]]:
+        # sprite.groupcollide(self.mobs, self.bullets, True, True): rect overlaps, a bullet goes to the
+        # first mob in group order it overlaps, mobs and bullets that hit are killed
+        hits: Dict[Mob, List[Bullet]] = {}
+        query = self.mob_grid.query
+        for bullet in self.bullets:
+            r = bullet.rect
+            for mob in query((r.left, r.top, r.right - 1, r.bottom - 1)):
+                if mob.rect.colliderect(r):
+                    hits.setdefault(mob, []).append(bullet)
+                    break
+        if len(hits) > 1:
+            hits = {mob: hits[mob] for mob in self.mobs if mob in hits}
+        for mob, collided in hits.items():
+            for bullet in collided:
+                bullet.kill()
+            mob.kill()
+        return hits
+
+    def collide_player(self) -> List[Mob]:
+        # sprite.spritecollide(self.player, self.mobs, False, sprite.collide_circle)
+        player = self.player
+        (x, y), radius = player.rect.center, int(player.radius)
+        return [mob for mob in self.mob_grid.query((x - radius, y - radius, x + radius, y + radius))
+                if mob.alive() and sprite.collide_circle(player, mob)]
+
+    def sprite_position(self, s: _spriteT, alpha: float) -> Tuple[int, int]:
+        # Where to blit the sprite, alpha of the way from its centre at save_positions() to its centre now.
+        # Sprites that are new since or moved more than SNAP_DISTANCE are drawn where they are.
+        r = s.rect
+        x, y = r.topleft
+        p = self.prev_centers.get(s)
+        if p is not None and alpha < 1:
+            dx, dy = p[0] - r.centerx, p[1] - r.centery
+            if abs(dx) <= SNAP_DISTANCE and abs(dy) <= SNAP_DISTANCE:
+                back = 1 - alpha
+                x, y = x + round(dx * back), y + round(dy * back)
+        return x, y
+
+    def sprite_positions(self, alpha: float = 1.0) -> List[Tuple[Surface, Tuple[int, int]]]:
+        # each sprite's image and sprite_position()
+        if alpha >= 1:
+            return [(s.image, s.rect.topleft) for s in self.all_sprites]
+        return [(s.image, self.sprite_position(s, alpha)) for s in self.all_sprites]
+
+    def render(self, alpha: float = 1.0) -> List[Rect]:
+        # Draw / render, alpha of the way from the positions before the last step to those after it.
+        # Returns the parts of the screen that changed.
+        if self.layered:
+            return self.render_layers(alpha)
+        screen = self.screen
+        if not self.assets.background_rect.contains(screen.get_rect()):
+            screen.fill(color.BLACK)  # the starfield covers the window, this is for smaller backgrounds
+        screen.blit(self.assets.background, self.assets.background_rect)
+        if self.swarm is not None:
+            self.swarm.draw(screen, alpha)
+        screen.blits(self.sprite_positions(alpha), doreturn=False)
+
+        if self.player.lives <= 0:   # and not death_explosion.alive():
+            draw_text(screen, 'Game Over!', size=68, x=WIDTH // 2, y=HEIGHT // 2, color=color.RED)
+
+        if self.score != self.score_shown:
+            self.score_shown = self.score
+            self.score_surface = score_image(self.score)
+            self.score_rect = self.score_surface.get_rect(midtop=(WIDTH // 2, 10))
+        screen.blit(self.score_surface, self.score_rect)
+        draw_shield_bar(screen, 5, 5, self.player.shield)
+        draw_lives(screen, WIDTH - 100, 5, self.player.lives, self.assets.player_mini_img)
+        if not self.headless:
+            pygame.display.flip()
+        return [screen.get_rect()]
+
+    def render_layers(self, alpha: float) -> List[Rect]:
+        # The layered renderer: the LayeredDirty repaints the background under the sprites that are dirty
+        # (mobs, bullets and explosions always, the player and HUD when they changed) and redraws what
+        # overlaps, then only those rects are updated on the display.
+        layers = self.all_sprites
+        assert isinstance(layers, sprite.LayeredDirty)
+        player = self.player
+        self.score_hud.show(self.score)
+        self.shield_hud.show(player.shield)
+        self.lives_hud.show(player.lives)
+        self.game_over_hud.show(player.lives <= 0)
+
+        # draw the sprites at their interpolated positions, then put them back
+        moved = []
+        if alpha < 1:
+            for s in layers.sprites():
+                if isinstance(s, HudSprite):
+                    continue  # a repainted HUD sprite may change its rect, it's never in between
+                pos = self.sprite_position(s, alpha)
+                if pos != s.rect.topleft:
+                    moved.append((s, s.rect.topleft))
+                    s.rect.topleft = pos
+        if player.rect.topleft != self.player_drawn:
+            self.player_drawn = player.rect.topleft
+            player.dirty = 1
+        rects: List[Rect] = layers.draw(self.screen)
+        for s, pos in moved:
+            s.rect.topleft = pos
+        if not self.headless:
+            pygame.display.update(rects)
+        return rects
+
+    def draw_loading(self) -> None:
+        # the loading screen, with the share of images loaded
+        ready, total = self.loader.progress()
+        screen = self.screen
+        screen.fill(color.BLACK)
+        draw_text(screen, 'Loading...', size=28, x=WIDTH // 2, y=HEIGHT // 2 - 40, color=color.WHITE)
+        bar = pygame.Rect(WIDTH // 2 - 100, HEIGHT // 2, 200, 10)
+        pygame.draw.rect(screen, color.GREEN, (bar.x, bar.y, bar.width * ready // max(total, 1), bar.height))
+        pygame.draw.rect(screen, color.WHITE, bar, 2)
+        pygame.display.flip()
+
+    def shutdown(self) -> None:
+        self.running = False
+        self.loader.shutdown()
+        text_renderer.clear()
+        pygame.quit()
+        for name, value in self.saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        self.saved_env.clear()
+
+    def run(self, fps: int = FPS) -> None:
+        # Game loop, after a loading screen while the assets load. Renders up to fps frames a second
+        # (as fast as it can with 0) and steps the game FPS times a second of wall clock time.
+        self.init(wait=False)
+        try:
+            while self.running and not self.assets.ready():
+                self.clock.tick(fps)
+                self.handle_events()
+                self.loader.poll()
+                self.draw_loading()
+            if not self.running:
+                return
+            self.start()
+            if self.assets.has_music.get():
+                pygame.mixer.music.play(loops=-1)
+            timestep = FixedStep()
+            self.clock.tick()
+            while self.running:
+                # keep loop running at the right speed
+                elapsed = self.clock.tick(fps)
+                self.handle_events()
+                for _ in range(timestep.advance(elapsed)):
+                    if not self.running:
+                        break
+                    self.save_positions()
+                    self.step()
+                if self.running:
+                    self.render(timestep.alpha())
+        finally:
+            self.shutdown()
+
+
+def main(argv: Opt[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Shmup!')
+    parser.add_argument('--mobs', type=int, default=8, help='number of meteors')
+    parser.add_argument('--swarm', action='store_true', help='simulate the meteors with NumPy, for thousands of them')
+    parser.add_argument('--seed', type=int, help='seed for a repeatable game')
+    parser.add_argument('--layered', action='store_true', help='redraw only what changed (not with --swarm)')
+    parser.add_argument('--fps', type=int, default=FPS, help='most frames drawn per second, 0 for no limit; '
+                                                             'the game itself always runs at %(default)s steps a second')
+    args = parser.parse_args(argv)
+    if args.swarm and args.layered:
+        parser.error('--layered does not work with --swarm')
+    Game(seed=args.seed, num_mobs=args.mobs, swarm=args.swarm, layered=args.layered).run(args.fps)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+from typing import Callable, Dict, Generic, List, TypeVar
+
+# Object pools for the shooter's short lived sprites (bullets, mobs, explosions).
+# A killed sprite is released to its pool, and acquire() hands it out again
+# instead of building a new one, the caller then resets its state. Released
+# sprites only become free at the next collect(), which the game calls at the
+# start of each frame: a sprite killed during a frame may still be read later
+# in that frame (a hit's rect and radius) and must not be reused before then.
+# At most capacity free sprites are kept, any more are dropped for the GC.
+
+T = TypeVar('T')
+
+
+class SpritePool(Generic[T]):
+    def __init__(self, factory: Callable[[], T], capacity: int) -> None:
+        self.factory = factory
+        self.capacity = capacity
+        self.free: List[T] = []
+        self.dead: List[T] = []  # released since the last collect()
+        self.created = 0
+        self.reused = 0  # allocations avoided
+        self.dropped = 0  # released while the pool was full
+
+    def acquire(self) -> T:
+        if self.free:
+            self.reused += 1
+            return self.free.pop()
+        self.created += 1
+        return self.factory()
+
+    def release(self, item: T) -> None:
+        self.dead.append(item)
+
+    def collect(self) -> None:
+        dead = self.dead
+        room = self.capacity - len(self.free)
+        if len(dead) > room:
+            self.dropped += len(dead) - room
+            del dead[room:]
+        self.free += dead
+        dead.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {'created': self.created, 'reused': self.reused, 'dropped': self.dropped, 'free': len(self.free)}
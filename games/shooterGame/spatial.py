@@ -0,0 +1,58 @@
+from __future__ import annotations
+from collections import defaultdict
+
+from typing import DefaultDict, Generic, List, Tuple, TypeVar
+from typing_extensions import Final as Fin
+
+# Broad phase collision for the shooter: a uniform grid spatial hash.
+# Items are inserted with a bounding box and land in every cell the box
+# touches. query(box) returns each item whose cells the box shares, once and
+# in insertion order, so a caller that inserts a sprite group in group order
+# gets hits in the same order as sprite.spritecollide() and friends. It is a
+# broad phase only: candidates may not overlap, the caller runs the exact test.
+# The grid is rebuilt every frame with clear() and insert(), which is cheaper
+# than tracking moves when nearly everything moves every frame.
+
+CELL_SIZE: Fin[int] = 64  # px, about the size of the largest meteor
+
+_boxT = Tuple[int, int, int, int]  # left, top, right, bottom, all inclusive
+T = TypeVar('T')
+
+
+class SpatialHash(Generic[T]):
+    def __init__(self, cell_size: int = CELL_SIZE) -> None:
+        self.cell_size = cell_size
+        self.items: List[T] = []
+        self.cells: DefaultDict[Tuple[int, int], List[int]] = defaultdict(list)  # cell -> indices into items
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def clear(self) -> None:
+        self.items.clear()
+        self.cells.clear()
+
+    def insert(self, item: T, box: _boxT) -> None:
+        left, top, right, bottom = box
+        size = self.cell_size
+        index = len(self.items)
+        self.items.append(item)
+        cells = self.cells
+        for cx in range(left // size, right // size + 1):
+            for cy in range(top // size, bottom // size + 1):
+                cells[cx, cy].append(index)
+
+    def query(self, box: _boxT) -> List[T]:
+        left, top, right, bottom = box
+        size = self.cell_size
+        cells = self.cells
+        found: List[int] = []
+        for cx in range(left // size, right // size + 1):
+            for cy in range(top // size, bottom // size + 1):
+                cell = cells.get((cx, cy))
+                if cell:
+                    found += cell
+        items = self.items
+        if len(found) > 1:
+            found = sorted(set(found))
+        return [items[i] for i in found]
@@ -0,0 +1,252 @@
+from __future__ import annotations
+import numpy as np
+from pygame import Surface, RLEACCEL
+
+from typing import List, Tuple, TYPE_CHECKING
+from typing_extensions import Final as Fin
+
+if TYPE_CHECKING:
+    from .main import RotationCache
+
+# Swarm mode: the mobs and bullets of a shooter Game as a structure of arrays.
+# Positions, velocities, rotations and radii live in NumPy arrays, one entry
+# per mob or bullet, and each frame moves, respawns and collides all of them in
+# a few vectorized passes instead of a Python update() per sprite. Nothing is a
+# pygame Sprite: draw() blits the rotated frame of each visible mob straight
+# from the arrays, and the Game turns hits into score, explosions and damage.
+# Differences from the sprite mode:
+#   - mob x, y are centres, a mob's extent is the size of its current frame
+#   - a bullet is the circle of radius BULLET_RADIUS at its tip, hits are circle vs circle
+#   - a mob that was shot or hit the player respawns above the screen, the swarm keeps its size
+#   - respawns draw from a NumPy generator seeded from the Game's rng
+#   - draw() interpolates between save_positions() and now like Game.render(), a respawn isn't interpolated
+
+CELL_SIZE: Fin[int] = 64  # broad phase grid, grown to the largest mob radius + BULLET_RADIUS if needed
+BULLET_RADIUS: Fin[int] = 6
+BULLET_SPEED: Fin[int] = -10
+MOB_ROT_DELAY: Fin[int] = 50  # ms between rotation steps, as Mob.rotate()
+
+_hitsT = List[Tuple[int, int, int]]  # (x, y, radius) of each mob hit
+
+
+class Swarm():
+    def __init__(self,
+                 count: int,
+                 images: List[Surface],
+                 frames: RotationCache,
+                 bullet_img: Surface,
+                 width: int,
+                 height: int,
+                 seed: int,
+                 now: int = 0,
+                 ) -> None:
+        self.count = count
+        self.width = width
+        self.height = height
+        self.rng = np.random.default_rng(seed)
+
+        # every rotated frame of every image, with their sizes for the rect maths
+        frames.prebuild(images)
+        self.step = frames.step
+        self.num_angles = 360 // frames.step
+        self.frames: List[List[Surface]] = [[frames.frame(img, i * frames.step)[0] for i in range(self.num_angles)]
+                                            for img in images]
+        self.sizes = np.array([[frame.get_size() for frame in row] for row in self.frames], dtype=np.int32)
+        # copies by img * num_angles + angle, with run length encoded colorkeys (much faster blits).
+        # The RotationCache frames are shared with sprite mode and stay as they are.
+        self.flat_frames: List[Surface] = []
+        for row in self.frames:
+            for frame in row:
+                frame = frame.copy()
+                colorkey = frame.get_colorkey()
+                if colorkey is not None:
+                    frame.set_colorkey(colorkey, RLEACCEL)
+                self.flat_frames.append(frame)
+        self.radii = np.array([int(img.get_width() * 0.85 / 2) for img in images], dtype=np.int32)
+        self.cell_size = max(CELL_SIZE, int(self.radii.max()) + BULLET_RADIUS)
+
+        # mobs
+        rng = self.rng
+        self.img = rng.integers(0, len(images), count)
+        size = self.sizes[self.img, 0]
+        self.radius = self.radii[self.img]
+        self.x = rng.integers(0, np.maximum(width - size[:, 0], 1)) + size[:, 0] // 2
+        self.y = rng.integers(-80, -20, count) - size[:, 1] // 2
+        self.vx = rng.integers(-3, 3, count)
+        self.vy = rng.integers(1, 5, count)
+        self.rot = np.zeros(count, dtype=np.int64)
+        self.rot_speed = rng.integers(-8, 8, count)
+        self.last_update = np.full(count, now, dtype=np.int64)
+        self.prev_x = self.x.copy()
+        self.prev_y = self.y.copy()
+
+        # bullets, the first num_bullets entries are live
+        self.bullet_img = bullet_img
+        self.bullet_height = bullet_img.get_height()
+        self.num_bullets = 0
+        self.bx = np.zeros(256, dtype=np.int64)
+        self.by = np.zeros(256, dtype=np.int64)  # top
+
+    def add_bullet(self, x: int, bottom: int) -> None:
+        n = self.num_bullets
+        if n == len(self.bx):
+            self.bx = np.concatenate((self.bx, np.zeros(n, dtype=np.int64)))
+            self.by = np.concatenate((self.by, np.zeros(n, dtype=np.int64)))
+        self.bx[n] = x
+        self.by[n] = bottom - self.bullet_height
+        self.num_bullets = n + 1
+
+    def angles(self) -> np.ndarray:
+        # the index of each mob's frame, rounded as RotationCache.key()
+        return np.rint(self.rot / self.step).astype(np.int64) % self.num_angles
+
+    def update(self, now: int) -> None:
+        # rotate, move and respawn the mobs that left the screen, move the bullets and drop those off the top
+        turn = now - self.last_update > MOB_ROT_DELAY
+        self.last_update[turn] = now
+        self.rot[turn] = (self.rot[turn] + self.rot_speed[turn]) % 360
+        self.x += self.vx
+        self.y += self.vy
+
+        size = self.sizes[self.img, self.angles()]
+        w, h = size[:, 0], size[:, 1]
+        left = self.x - w // 2
+        gone = np.flatnonzero((self.y - h // 2 > self.height + 10) | (left < -100) | (left + w > self.width + 100))
+        if len(gone):
+            rng = self.rng
+            w, h = w[gone], h[gone]
+            self.x[gone] = rng.integers(0, np.maximum(self.width - w, 1)) + w // 2
+            self.y[gone] = rng.integers(-100, -40, len(gone)) + h // 2
+            self.vy[gone] = rng.integers(1, 5, len(gone))
+            self.prev_x[gone] = self.x[gone]
+            self.prev_y[gone] = self.y[gone]
+
+        n = self.num_bullets
+        by = self.by[:n]
+        by += BULLET_SPEED
+        self.drop_bullets(by + self.bullet_height < 0)
+
+    def drop_bullets(self, dead: np.ndarray) -> None:
+        # remove the live bullets where dead is set, keeping the order of the rest
+        if dead.any():
+            n = self.num_bullets
+            keep = ~dead
+            kept = int(keep.sum())
+            self.bx[:kept] = self.bx[:n][keep]
+            self.by[:kept] = self.by[:n][keep]
+            self.num_bullets = kept
+
+    def respawn(self, mobs: np.ndarray) -> None:
+        # new mobs in place of these, as Mob.reset()
+        rng = self.rng
+        k = len(mobs)
+        self.img[mobs] = img = rng.integers(0, len(self.frames), k)
+        self.radius[mobs] = self.radii[img]
+        size = self.sizes[img, 0]
+        self.x[mobs] = rng.integers(0, np.maximum(self.width - size[:, 0], 1)) + size[:, 0] // 2
+        self.y[mobs] = rng.integers(-80, -20, k) - size[:, 1] // 2
+        self.vx[mobs] = rng.integers(-3, 3, k)
+        self.vy[mobs] = rng.integers(1, 5, k)
+        self.rot[mobs] = 0
+        self.rot_speed[mobs] = rng.integers(-8, 8, k)
+        self.prev_x[mobs] = self.x[mobs]
+        self.prev_y[mobs] = self.y[mobs]
+
+    def save_positions(self) -> None:
+        # the mob centres before the next update(), for draw()
+        np.copyto(self.prev_x, self.x)
+        np.copyto(self.prev_y, self.y)
+
+    def hits(self, mobs: np.ndarray) -> _hitsT:
+        return list(zip(self.x[mobs].tolist(), self.y[mobs].tolist(), self.radius[mobs].tolist()))
+
+    def collide_bullets(self) -> _hitsT:
+        # Mobs hit by bullets, in index order. A bullet hits the first mob (by index) it touches, every
+        # bullet that hits is dropped and every mob that was hit respawns. The broad phase sorts the mobs
+        # by grid cell and finds the mobs in the 3 x 3 cells around each bullet with searchsorted().
+        n = self.num_bullets
+        if not n or not self.count:
+            return []
+        bx = self.bx[:n]
+        by = self.by[:n] + BULLET_RADIUS  # the centre of the tip
+        cell = self.cell_size
+        origin = 4 * cell  # anything beyond the grid is clipped into its edge cells
+        cols = (self.width + 2 * origin) // cell + 1
+        rows = (self.height + 2 * origin) // cell + 1
+
+        def cells(x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+            return np.clip((x + origin) // cell, 0, cols - 1), np.clip((y + origin) // cell, 0, rows - 1)
+
+        mcx, mcy = cells(self.x, self.y)
+        keys = mcy * cols + mcx
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        bcx, bcy = cells(bx, by)
+        pair_bullets = []
+        pair_mobs = []
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                key = (bcy + dy) * cols + bcx + dx
+                lo = np.searchsorted(keys, key, 'left')
+                counts = np.searchsorted(keys, key, 'right') - lo
+                total = int(counts.sum())
+                if not total:
+                    continue
+                # the concatenated ranges lo[i]:lo[i] + counts[i]
+                firsts = np.cumsum(counts) - counts
+                pos = np.arange(total) - np.repeat(firsts - lo, counts)
+                pair_bullets.append(np.repeat(np.arange(n), counts))
+                pair_mobs.append(order[pos])
+        if not pair_bullets:
+            return []
+        b = np.concatenate(pair_bullets)
+        m = np.concatenate(pair_mobs)
+        reach = self.radius[m] + BULLET_RADIUS
+        touching = (bx[b] - self.x[m]) ** 2 + (by[b] - self.y[m]) ** 2 <= reach * reach
+        b, m = b[touching], m[touching]
+        if not len(b):
+            return []
+        first = np.lexsort((m, b))
+        b, m = b[first], m[first]
+        bullets, index = np.unique(b, return_index=True)
+        mobs = np.unique(m[index])
+        hits = self.hits(mobs)
+        dead = np.zeros(n, dtype=bool)
+        dead[bullets] = True
+        self.drop_bullets(dead)
+        self.respawn(mobs)
+        return hits
+
+    def collide_circle(self, center: Tuple[int, int], radius: int) -> _hitsT:
+        # mobs touching this circle (the player), in index order; they respawn
+        x, y = center
+        reach = self.radius + radius
+        mobs = np.flatnonzero((self.x - x) ** 2 + (self.y - y) ** 2 <= reach * reach)
+        if not len(mobs):
+            return []
+        hits = self.hits(mobs)
+        self.respawn(mobs)
+        return hits
+
+    def draw(self, surf: Surface, alpha: float = 1.0) -> None:
+        # blit the mobs and bullets that are on the surface, alpha of the way from their last saved positions
+        angles = self.angles()
+        size = self.sizes[self.img, angles]
+        x, y = self.x, self.y
+        if alpha < 1:
+            x = np.rint(self.prev_x + (x - self.prev_x) * alpha).astype(np.int64)
+            y = np.rint(self.prev_y + (y - self.prev_y) * alpha).astype(np.int64)
+        left = x - size[:, 0] // 2
+        top = y - size[:, 1] // 2
+        visible = np.flatnonzero((left < self.width) & (left + size[:, 0] > 0) &
+                                 (top < self.height) & (top + size[:, 1] > 0))
+        # built by zip() and map() rather than a Python loop, as there can be 10000 of them
+        frames = (self.img[visible] * self.num_angles + angles[visible]).tolist()
+        surf.blits(list(zip(map(self.flat_frames.__getitem__, frames), zip(left[visible].tolist(), top[visible].tolist()))),
+                   doreturn=False)
+        n = self.num_bullets
+        if n:
+            bullet = self.bullet_img
+            by = self.by[:n] - round(BULLET_SPEED * (1 - alpha))  # bullets all move BULLET_SPEED a step
+            surf.blits(list(zip([bullet] * n, zip((self.bx[:n] - bullet.get_width() // 2).tolist(), by.tolist()))),
+                       doreturn=False)
@@ -0,0 +1,390 @@
+import os
+import random
+import shutil
+import tempfile
+import threading
+import pygame
+from pathlib import Path
+from pygame import sprite
+from unittest import TestCase
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+from games.shooterGame.main import (FixedStep, Game, HudSprite, TextRenderer, BULLET_POOL, FPS, HEIGHT, LAYER_PLAYER,
+                                    MAX_STEPS, ROT_STEP, SNAP_DISTANCE, WIDTH, keys_down, text_renderer)
+from games.shooterGame.atlas import (ATLAS_IMAGE, ATLAS_INDEX, build_atlas, img_dir, load_images, pack,
+                                     source_images)
+from games.shooterGame.loader import AssetLoader
+from games.shooterGame.pool import SpritePool
+from games.shooterGame.spatial import SpatialHash
+from games.shooterGame.swarm import BULLET_RADIUS
+
+
+def playGame(seed: int, frames: int, render: bool = False) -> Game:
+    # a headless game of the given length, shooting and moving left and right
+    game = Game(headless=True, seed=seed)
+    game.init()
+    for frame in range(frames):
+        key = (pygame.K_SPACE, pygame.K_LEFT, pygame.K_SPACE, pygame.K_RIGHT)[frame // 20 % 4]
+        if not game.step(keys_down(key)):
+            break
+        if render:
+            game.render()
+    return game
+
+
+class BruteForceGame(Game):
+    # the all pairs collision tests the game used before the spatial hash
+    def collide_bullets(self):  # type: ignore
+        return sprite.groupcollide(self.mobs, self.bullets, True, True)
+
+    def collide_player(self):  # type: ignore
+        return sprite.spritecollide(self.player, self.mobs, False, sprite.collide_circle)
+
+
+def bulletHell(game: Game, frames: int) -> list:
+    # a game with a spray of extra bullets, returning what happened every frame
+    game.init()
+    rng = random.Random(11)
+    history = []
+    for frame in range(frames):
+        for _ in range(frame % 2):
+            game.add_bullet(rng.randrange(WIDTH), rng.randrange(HEIGHT // 2))
+        key = (pygame.K_LEFT, pygame.K_UP, pygame.K_RIGHT, pygame.K_DOWN)[frame // 15 % 4]
+        game.step(keys_down(key))
+        history.append((game.score, game.player.shield, game.player.lives,
+                        [(type(s).__name__, s.rect.topleft) for s in game.all_sprites]))
+    game.shutdown()
+    return history
+
+
+class TestCaseGame(TestCase):
+    """"""
+
+    def test_headless_game(self) -> None:
+        game = playGame(seed=1, frames=20 * FPS, render=True)
+        try:
+            assert game.now == game.frame * 1000 // FPS
+            assert game.score > 0
+            assert pygame.mixer.get_init() is None
+        finally:
+            game.shutdown()
+
+    def test_same_seed_same_game(self) -> None:
+        games = [playGame(seed=7, frames=10 * FPS) for _ in range(2)]
+        try:
+            first, second = ([(type(s).__name__, s.rect.topleft) for s in g.all_sprites] for g in games)
+            assert first == second
+            assert games[0].score == games[1].score
+            assert games[0].player.shield == games[1].player.shield
+        finally:
+            for game in games:
+                game.shutdown()
+
+    def test_init_after_shutdown(self) -> None:
+        for _ in range(2):
+            game = Game(headless=True, seed=3)
+            game.init()
+            assert game.step(keys_down())
+            game.render()
+            game.shutdown()
+            assert not pygame.get_init()
+
+    def test_shutdown_restores_environment(self) -> None:
+        saved = os.environ.pop('SDL_AUDIODRIVER')
+        try:
+            game = Game(headless=True, seed=3)
+            game.init()
+            assert os.environ['SDL_AUDIODRIVER'] == 'dummy'
+            game.shutdown()
+            assert 'SDL_AUDIODRIVER' not in os.environ
+            assert os.environ['SDL_VIDEODRIVER'] == 'dummy'
+        finally:
+            os.environ['SDL_AUDIODRIVER'] = saved
+
+    def test_rotation_cache(self) -> None:
+        game = playGame(seed=2, frames=5 * FPS)
+        try:
+            cache = game.assets.meteor_frames
+            assert 0 < len(cache.frames) <= len(game.assets.meteor_images) * 360 // ROT_STEP
+            frames = dict(cache.frames)
+            for _ in range(FPS):
+                game.step(keys_down())
+            for mob in game.mobs:
+                image, size = cache.frame(mob.image_orig, mob.rot)
+                assert mob.rect.size == size
+                assert mob.image is image
+                assert mob.mask is cache.mask(mob.image_orig, mob.rot)
+                assert mob.mask.get_size() == size
+            # frames already built are reused, not rendered again
+            assert all(cache.frames[key] is frame for key, frame in frames.items())
+            assert cache.frame(mob.image_orig, 361) is cache.frame(mob.image_orig, 1)
+        finally:
+            game.shutdown()
+
+    def test_spatial_hash(self) -> None:
+        grid: SpatialHash[str] = SpatialHash(cell_size=10)
+        grid.insert('a', (0, 0, 25, 5))
+        grid.insert('b', (-15, -15, -1, -1))
+        grid.insert('c', (12, 3, 12, 3))
+        assert grid.query((5, 0, 15, 9)) == ['a', 'c']
+        assert grid.query((-5, -5, 0, 0)) == ['a', 'b']
+        assert grid.query((100, 100, 120, 120)) == []
+        grid.clear()
+        assert len(grid) == 0 and grid.query((0, 0, 25, 5)) == []
+
+    def test_collisions_match_brute_force(self) -> None:
+        fast = bulletHell(Game(headless=True, seed=5, num_mobs=60), 8 * FPS)
+        slow = bulletHell(BruteForceGame(headless=True, seed=5, num_mobs=60), 8 * FPS)
+        assert fast == slow
+        assert fast[-1][0] > 0
+        assert any(shield < 100 or lives < 3 for _, shield, lives, _ in fast)
+
+    def test_sprite_pools(self) -> None:
+        game = Game(headless=True, seed=4, num_mobs=30)
+        bulletHell(game, 10 * FPS)
+        stats = game.pool_stats()
+        for name in ('bullets', 'mobs', 'explosions'):
+            assert stats[name]['reused'] > stats[name]['created']
+        assert stats['bullets']['free'] <= BULLET_POOL
+
+        pool: SpritePool[list] = SpritePool(list, capacity=1)
+        first, second = pool.acquire(), pool.acquire()
+        pool.release(first)
+        pool.release(second)
+        assert pool.acquire() is not first  # released items only come back after collect()
+        pool.collect()
+        assert pool.acquire() is first
+        assert pool.stats() == {'created': 3, 'reused': 1, 'dropped': 1, 'free': 0}
+
+    def test_text_cache(self) -> None:
+        game = Game(headless=True, seed=1)
+        game.init()
+        try:
+            renderer = TextRenderer(max_texts=2)
+            first = renderer.render('a', 20, (255, 0, 0))
+            assert renderer.render('a', 20, (255, 0, 0)) is first
+            renderer.render('b', 20, (255, 0, 0))
+            renderer.render('a', 20, (255, 0, 0))
+            renderer.render('c', 20, (255, 0, 0))  # drops 'b', the least recently used
+            assert list(renderer.texts) == [('a', 'arial', 20, (255, 0, 0)), ('c', 'arial', 20, (255, 0, 0))]
+            assert renderer.font('arial', 20) is renderer.font('arial', 20)
+            assert len(renderer.fonts) == 1
+
+            game.render()
+            score = game.score_surface
+            game.render()
+            assert game.score_surface is score
+            game.score += 10
+            game.render()
+            assert game.score_surface is not score
+        finally:
+            game.shutdown()
+        assert not text_renderer.fonts
+
+    def test_swarm_mode(self) -> None:
+        game = Game(headless=True, seed=6, num_mobs=3000, swarm=True)
+        game.init()
+        try:
+            swarm = game.swarm
+            assert swarm is not None and not game.mobs
+            for _ in range(2 * FPS):
+                game.step(keys_down(pygame.K_SPACE))
+                game.render()
+            assert game.score > 0
+            assert len(swarm.x) == 3000
+            # the swarm RLE encodes its own copies, the shared RotationCache frames are untouched
+            assert all(frame.get_flags() & pygame.RLEACCELOK for frame in swarm.flat_frames)
+            assert not set(swarm.flat_frames) & {frame for frame, _ in game.assets.meteor_frames.frames.values()}
+
+            # the vectorized hit test against all pairs
+            rng = random.Random(1)
+            for _ in range(500):
+                swarm.add_bullet(rng.randrange(-50, WIDTH + 50), rng.randrange(-50, HEIGHT + 100))
+            n = swarm.num_bullets
+            bx, tip = swarm.bx[:n].tolist(), (swarm.by[:n] + BULLET_RADIUS).tolist()
+            mobs = list(zip(swarm.x.tolist(), swarm.y.tolist(), swarm.radius.tolist()))
+            expected = set()
+            hitting = 0
+            for x, y in zip(bx, tip):
+                for i, (mx, my, r) in enumerate(mobs):
+                    if (x - mx) ** 2 + (y - my) ** 2 <= (r + BULLET_RADIUS) ** 2:
+                        expected.add(i)
+                        hitting += 1
+                        break
+            hits = swarm.collide_bullets()
+            assert hits == [mobs[i] for i in sorted(expected)]
+            assert hitting and swarm.num_bullets == n - hitting
+        finally:
+            game.shutdown()
+
+    def test_atlas(self) -> None:
+        sizes = {'a': (600, 10), 'b': (500, 30), 'c': (400, 20), 'd': (24, 24)}
+        rects, height = pack(sizes, width=1024)
+        assert rects == {'b': (0, 0, 500, 30), 'd': (500, 0, 24, 24), 'c': (524, 0, 400, 20), 'a': (0, 30, 600, 10)}
+        assert height == 40
+
+        game = Game(headless=True)
+        game.init()  # for the display mode
+        try:
+            with tempfile.TemporaryDirectory() as out:
+                build_atlas(img_dir, Path(out))
+                assert sorted(os.listdir(out)) == sorted([ATLAS_IMAGE, ATLAS_INDEX])
+                atlas = load_images(Path(out))
+                source = source_images(img_dir)
+                assert atlas.keys() == source.keys()
+                for name, img in source.items():
+                    assert atlas[name].get_parent() is not None
+                    assert pygame.image.tostring(atlas[name], 'RGB') == pygame.image.tostring(img, 'RGB'), name
+                assert atlas['meteorBrown_tiny1'].get_colorkey() is not None
+                assert atlas['starfield'].get_colorkey() is None
+
+            # the first run without an atlas loads the separate files and writes one for the next run
+            with tempfile.TemporaryDirectory() as tmp:
+                for png in img_dir.glob('*.png'):
+                    shutil.copy(png, tmp)
+                first = load_images(Path(tmp))
+                assert first['player'].get_parent() is None
+                assert (Path(tmp) / ATLAS_IMAGE).exists() and (Path(tmp) / ATLAS_INDEX).exists()
+                second = load_images(Path(tmp))
+                assert second['player'].get_parent() is not None
+                assert pygame.image.tostring(second['player'], 'RGB') == pygame.image.tostring(first['player'], 'RGB')
+        finally:
+            game.shutdown()
+
+    def test_asset_loader(self) -> None:
+        game = Game(headless=True, seed=5)
+        game.init(wait=False)
+        try:
+            loader = game.loader
+            gate = threading.Event()
+            slow = loader.task(gate.wait)
+            assert not slow.ready()
+            assert loader.progress([slow]) == (0, 1)
+            gate.set()
+            assert slow.get() is True and slow.ready()
+
+            # images are decoded on the pool but only convert()ed on the display thread
+            handle = loader.image(img_dir / 'laserRed16.png')
+            errors = []
+
+            def off_thread() -> None:
+                try:
+                    handle.get()
+                except RuntimeError as e:
+                    errors.append(e)
+            worker = threading.Thread(target=off_thread)
+            worker.start()
+            worker.join()
+            assert len(errors) == 1
+            assert handle.get().get_size() == (13, 54)
+
+            while not game.assets.ready():
+                loader.poll()
+            game.start()
+            assert loader.progress() == (len(loader.images), len(loader.images))
+            assert game.assets.has_music.get() is False  # headless games are silent
+            for _ in range(60):
+                assert game.step(keys_down(pygame.K_SPACE))
+                game.render()
+        finally:
+            game.shutdown()
+
+    def test_fixed_timestep(self) -> None:
+        def frame_times(hz: int, seconds: int) -> list:
+            # the whole ms a Clock.tick() at hz returns
+            return [(i + 1) * 1000 // hz - i * 1000 // hz for i in range(hz * seconds)]
+
+        timestep = FixedStep()
+        assert [timestep.advance(ms) for ms in frame_times(30, 1)[:3]] == [1, 2, 3]  # 33, 33, 34 ms
+        timestep = FixedStep()
+        assert sum(timestep.advance(ms) for ms in frame_times(144, 3)) == 3 * FPS
+        assert timestep.advance(10000) == MAX_STEPS and timestep.alpha() == 0
+        timestep.advance(4)
+        assert timestep.alpha() == 0.24
+
+        def play(display_hz: int, swarm: bool) -> tuple:
+            # two seconds of a game drawn display_hz times a second
+            game = Game(headless=True, seed=9, swarm=swarm, num_mobs=50 if swarm else 8)
+            game.init()
+            timestep = FixedStep()
+            try:
+                for ms in frame_times(display_hz, 2):
+                    for _ in range(timestep.advance(ms)):
+                        game.save_positions()
+                        game.step(keys_down(pygame.K_SPACE))
+                    game.render(timestep.alpha())
+                mobs = game.swarm.x.tolist() if game.swarm is not None else [m.rect.topleft for m in game.mobs]
+                return game.frame, game.score, mobs
+            finally:
+                game.shutdown()
+
+        for swarm in (False, True):
+            assert play(30, swarm) == play(60, swarm) == play(144, swarm)
+            assert play(60, swarm)[0] == 2 * FPS
+
+        game = Game(headless=True, seed=2)
+        game.init()
+        try:
+            for _ in range(10):
+                game.save_positions()
+                game.step(keys_down(pygame.K_LEFT))
+            # half way, every sprite that moved a little is drawn half way between its last two positions
+            player = game.player
+            before = game.prev_centers[player]
+            assert player.rect.centerx == before[0] - 8
+            positions = {id(img): pos for img, pos in game.sprite_positions(0.5)}
+            assert positions[id(player.image)] == (player.rect.x + 4, player.rect.y)
+            assert game.sprite_positions(1) == [(s.image, s.rect.topleft) for s in game.all_sprites]
+            assert game.sprite_positions(0) == [(s.image, (s.rect.x + game.prev_centers[s][0] - s.rect.centerx,
+                                                           s.rect.y + game.prev_centers[s][1] - s.rect.centery))
+                                                for s in game.all_sprites]
+            # jumps aren't interpolated
+            player.hide()
+            assert (player.image, player.rect.topleft) in game.sprite_positions(0)
+            assert abs(player.rect.centery - before[1]) > SNAP_DISTANCE
+        finally:
+            game.shutdown()
+
+    def test_layered_rendering(self) -> None:
+        def play(layered: bool) -> list:
+            game = Game(headless=True, seed=4, layered=layered)
+            game.init()
+            states = []
+            try:
+                layers = game.all_sprites
+                if layered:
+                    assert isinstance(layers, sprite.LayeredDirty)
+                    layers.set_timing_threshold(1000)  # don't fall back to full redraws on a busy machine
+                screen = game.screen.get_rect()
+                for frame in range(600):
+                    key = (pygame.K_SPACE, pygame.K_LEFT, pygame.K_SPACE, pygame.K_RIGHT)[frame // 20 % 4]
+                    game.save_positions()
+                    game.step(keys_down(key))
+                    rects = game.render(alpha=frame % 3 / 3)
+                    if layered and frame > 0:
+                        # only the parts that changed, and the HUD only when its values did
+                        assert sum(r.width * r.height for r in rects) < screen.width * screen.height
+                        assert game.score_hud.dirty == game.shield_hud.dirty == 0
+                    if layered and frame % 50 == 0:
+                        # what was drawn bit by bit is what a full redraw draws
+                        drawn = pygame.image.tostring(game.screen, 'RGB')
+                        assert isinstance(layers, sprite.LayeredDirty)
+                        layers.repaint_rect(screen)
+                        game.render(alpha=frame % 3 / 3)
+                        assert pygame.image.tostring(game.screen, 'RGB') == drawn
+                    states.append((game.score, game.player.lives,
+                                   sorted((type(s).__name__, s.rect.topleft) for s in game.all_sprites
+                                          if not isinstance(s, HudSprite))))
+                if layered:
+                    assert game.score_hud.painted == len({score for score, *_ in states})
+                    assert isinstance(layers, sprite.LayeredDirty)
+                    assert layers.get_layer_of_sprite(game.player) == LAYER_PLAYER
+            finally:
+                game.shutdown()
+            return states
+
+        assert play(True) == play(False)
+        with self.assertRaises(ValueError):
+            Game(swarm=True, layered=True)
@@ -0,0 +1,163 @@
+import numpy as np
+
+from typing import Dict, Optional as Opt, Tuple
+
+from .bitboard import PAD
+from .shapes import TEMPLATEWIDTH, TEMPLATEHEIGHT, SHAPES, SHAPENAMES
+from .simulation import BOARDWIDTH, BOARDHEIGHT
+
+# Vectorized tetris for training placement policies.
+# N boards are kept in one (N, rows) int64 array of row bitmasks using the same
+# layout as BitBoard (bit PAD + x for column x, wall bits on both sides), with
+# extra rows above the board that never collide and rows below it that always
+# do. A step places one piece on every board at once: the action picks the
+# rotation and column, the piece is hard dropped from the spawn row, full rows
+# are cleared and boards that topped out are reset in place.
+
+TOPROWS = 2  # pieces spawn at y = -2
+FLOORROWS = TEMPLATEHEIGHT
+SPAWNY = -2
+MAXROTATIONS = 4
+
+obsType = Tuple[np.ndarray, np.ndarray, np.ndarray]  # board rows (N, height), shape index (N,), next shape index (N,)
+
+
+class BatchTetrisEnv():
+
+    def __init__(self, numEnvs: int, seed: Opt[int] = None, width: int = BOARDWIDTH, height: int = BOARDHEIGHT) -> None:
+        assert width + 2 * PAD < 63, 'rows are stored as int64 bitmasks'
+        self.numEnvs = numEnvs
+        self.width = width
+        self.height = height
+        self.rng = np.random.default_rng(seed)
+
+        boardBits = ((1 << width) - 1) << PAD
+        wallBits = ((1 << (width + 2 * PAD)) - 1) & ~boardBits
+        self.emptyRow = np.int64(wallBits)
+        self.fullRow = np.int64(wallBits | boardBits)
+
+        # template x can put any filled column from the left wall to the right wall
+        self.numColumns = width + TEMPLATEWIDTH - 1
+        self.numActions = MAXROTATIONS * self.numColumns
+        self.spawnX = int(width / 2) - int(TEMPLATEWIDTH / 2)
+
+        # masks[shape, rotation, column, ty] is the template row ty shifted onto the board at x = column - (TEMPLATEWIDTH - 1)
+        numShapes = len(SHAPENAMES)
+        self.masks = np.zeros((numShapes, MAXROTATIONS, self.numColumns, TEMPLATEHEIGHT), dtype=np.int64)
+        self.numRotations = np.zeros(numShapes, dtype=np.int64)
+        for s, name in enumerate(SHAPENAMES):
+            rotations = SHAPES[name]
+            self.numRotations[s] = len(rotations)
+            for r in range(MAXROTATIONS):
+                rot = rotations[r % len(rotations)]
+                for c in range(self.numColumns):
+                    shift = c - (TEMPLATEWIDTH - 1) + PAD
+                    for ty, m in rot.rowMasks:
+                        self.masks[s, r, c, ty] = m << shift
+
+        # board row index of every template row for every spawn-relative drop distance
+        self.dropYs = np.arange(SPAWNY, height + 1)
+        self.dropRows = self.dropYs[:, None] + TOPROWS + np.arange(TEMPLATEHEIGHT)[None, :]
+        self.boardRows = slice(TOPROWS, TOPROWS + height)
+
+        self.boards = np.empty((numEnvs, TOPROWS + height + FLOORROWS), dtype=np.int64)
+        self.shapes = np.zeros(numEnvs, dtype=np.int64)
+        self.spawnRotations = np.zeros(numEnvs, dtype=np.int64)
+        self.nextShapes = np.zeros(numEnvs, dtype=np.int64)
+        self.scores = np.zeros(numEnvs, dtype=np.int64)
+        self.pieces = np.zeros(numEnvs, dtype=np.int64)
+        self.reset()
+
+    def reset(self, envs: Opt[np.ndarray] = None) -> obsType:
+        # reset every board, or only the boards selected by the bool/index array envs
+        if envs is None:
+            envs = np.arange(self.numEnvs)
+        self.boards[envs, :TOPROWS] = 0
+        self.boards[envs, self.boardRows] = self.emptyRow
+        self.boards[envs, TOPROWS + self.height:] = -1  # floor collides with everything
+        self.scores[envs] = 0
+        self.pieces[envs] = 0
+        self.nextShapes[envs] = self.rng.integers(0, len(SHAPENAMES), size=self.nextShapes[envs].shape)
+        self._spawn(envs)
+        return self.observe()
+
+    def _spawn(self, envs: np.ndarray) -> None:
+        self.shapes[envs] = self.nextShapes[envs]
+        self.nextShapes[envs] = self.rng.integers(0, len(SHAPENAMES), size=self.nextShapes[envs].shape)
+        self.spawnRotations[envs] = self.rng.integers(0, MAXROTATIONS, size=self.shapes[envs].shape) % self.numRotations[self.shapes[envs]]
+
+    def observe(self) -> obsType:
+        return self.boards[:, self.boardRows], self.shapes, self.nextShapes
+
+    def cells(self) -> np.ndarray:
+        # (N, height, width) bool occupancy, for feeding a network
+        bits = (self.boards[:, self.boardRows, None] >> (PAD + np.arange(self.width))) & 1
+        return bits.astype(bool)
+
+    def encodeAction(self, rotation: np.ndarray, x: np.ndarray) -> np.ndarray:
+        actions: np.ndarray = rotation * self.numColumns + x + (TEMPLATEWIDTH - 1)
+        return actions
+
+    def _collisions(self, masks: np.ndarray, envs: Opt[np.ndarray] = None) -> np.ndarray:
+        # (n, drop distance) bool, True where the piece with the given (n, TEMPLATEHEIGHT) masks would collide
+        boards = self.boards if envs is None else self.boards[envs]
+        rows = boards[:, self.dropRows]  # (n, Y, TEMPLATEHEIGHT)
+        collisions: np.ndarray = ((rows & masks[:, None, :]) != 0).any(axis=2)
+        return collisions
+
+    def validActions(self) -> np.ndarray:
+        # (N, numActions) bool, placements that fit at the spawn row
+        rows = self.boards[:, TOPROWS + SPAWNY:TOPROWS + SPAWNY + TEMPLATEHEIGHT]  # (N, TEMPLATEHEIGHT)
+        masks = self.masks[self.shapes].reshape(self.numEnvs, self.numActions, TEMPLATEHEIGHT)
+        valid: np.ndarray = ~((masks & rows[:, None, :]) != 0).any(axis=2)
+        return valid
+
+    def step(self, actions: np.ndarray) -> Tuple[obsType, np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+        # place the current piece on every board. Actions that don't fit at the spawn row fall back
+        # to the spawned rotation and column. Returns (obs, lines cleared, done, info) and auto-resets
+        # finished boards; info holds the final score and piece count of the games that ended.
+        N = self.numEnvs
+        envs = np.arange(N)
+        rotation, column = np.divmod(np.asarray(actions, dtype=np.int64), self.numColumns)
+        masks = self.masks[self.shapes, rotation, column]
+        spawnMasks = self.masks[self.shapes, self.spawnRotations, self.spawnX + TEMPLATEWIDTH - 1]
+
+        collisions = self._collisions(masks)
+        invalid = collisions[:, 0]
+        if invalid.any():
+            masks[invalid] = spawnMasks[invalid]
+            collisions[invalid] = self._collisions(masks[invalid], invalid)
+        # the spawn position itself may be blocked, which is game over before anything is placed
+        toppedOut = collisions[:, 0]
+
+        dropped = collisions.argmax(axis=1) - 1  # first colliding distance, minus one
+        dropped[toppedOut] = 0
+        placed = ~toppedOut
+        landRows = self.dropRows[dropped]  # (N, TEMPLATEHEIGHT)
+        self.boards[envs[:, None], landRows] |= np.where(placed[:, None], masks, 0)
+        self.boards[:, :TOPROWS] = 0  # cells above the board are dropped, as in BitBoard.place
+
+        region = self.boards[:, self.boardRows]
+        full = region == self.fullRow
+        lines = full.sum(axis=1)
+        cleared = lines > 0
+        if cleared.any():
+            sub = region[cleared]
+            order = np.argsort(~full[cleared], axis=1, kind='stable')  # full rows first, the rest keep their order
+            sub = np.take_along_axis(sub, order, axis=1)
+            sub[np.arange(self.height)[None, :] < lines[cleared][:, None]] = self.emptyRow
+            region[cleared] = sub
+        self.scores += lines
+        self.pieces += placed
+
+        self._spawn(envs)
+        rows = self.boards[:, TOPROWS + SPAWNY:TOPROWS + SPAWNY + TEMPLATEHEIGHT]
+        nextMasks = self.masks[self.shapes, self.spawnRotations, self.spawnX + TEMPLATEWIDTH - 1]
+        dones = toppedOut | ((rows & nextMasks) != 0).any(axis=1)
+
+        info: Dict[str, np.ndarray] = {}
+        if dones.any():
+            info['scores'] = self.scores[dones].copy()
+            info['pieces'] = self.pieces[dones].copy()
+            self.reset(dones)
+        return self.observe(), lines, dones, info
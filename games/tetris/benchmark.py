@@ -0,0 +1,312 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from typing import Any, Callable, Dict, List, Optional as Opt, Tuple
+
+from .bitboard import BitBoard, PAD
+from .shapes import SHAPES, SHAPENAMES
+from .simulation import (boardType, pieceType, TetrisSim, BOARDWIDTH, BOARDHEIGHT,
+                         KEY_DROP, getNewPiece, addToBoard, isValidPosition, removeCompleteLines)
+from .state import GameState
+from .generator import PieceGenerator
+from .bot import TetrisBot, BotController
+
+# Benchmarks for the tetris hot paths: the rules functions on synthetic boards,
+# the bot's placement search and a headless frame of the pygame front end.
+# Run with
+#   python -m games.tetris.benchmark --save baseline.json
+#   python -m games.tetris.benchmark --baseline baseline.json --threshold 0.2
+# The second run exits with status 1 if any benchmark got slower than the
+# baseline by more than threshold (as a fraction of the baseline ops/sec).
+# Rendering uses SDL's dummy video driver unless SDL_VIDEODRIVER is set.
+
+resultsType = Dict[str, Dict[str, float]]  # benchmark name -> {'opsPerSec': ..., 'usPerOp': ...}
+
+BOARDKINDS = ('empty', 'nearlyFull', 'completeLines', 'tallStack')
+
+
+def makeBoard(kind: str, width: int = BOARDWIDTH, height: int = BOARDHEIGHT, seed: int = 0) -> boardType:
+    # a synthetic board of the given kind, filled with random colours
+    rng = random.Random(seed)
+    board = BitBoard(width, height)
+
+    def fillRow(y: int, gaps: Tuple[int, ...] = ()) -> None:
+        for x in range(width):
+            if x not in gaps:
+                board.rows[y] |= 1 << (PAD + x)
+                board.colors[y][x] = rng.randint(1, 4)
+
+    if kind == 'empty':
+        pass
+    elif kind == 'nearlyFull':
+        # every row but the top four has a single gap, so nothing clears
+        for y in range(4, height):
+            fillRow(y, (rng.randrange(width), ))
+    elif kind == 'completeLines':
+        # the bottom half is full rows, interleaved with rows that are one short
+        for y in range(height // 2, height):
+            fillRow(y, () if y % 4 else (rng.randrange(width), ))
+    elif kind == 'tallStack':
+        # ragged columns up to near the top, with holes under them
+        for x in range(width):
+            top = rng.randint(2, 6)
+            for y in range(top, height):
+                if rng.random() < 0.85:
+                    board.rows[y] |= 1 << (PAD + x)
+                    board.colors[y][x] = rng.randint(1, 4)
+    else:
+        raise ValueError(f'unknown board kind {kind!r}, expected one of {BOARDKINDS}')
+    return board
+
+
+def timeOp(op: Callable[[], Any], minSeconds: float = 0.2, repeat: int = 3) -> Dict[str, float]:
+    # ops/sec of the fastest of repeat runs, each calling op until minSeconds have passed
+    perf = time.perf_counter
+    number = 1
+    while True:
+        start = perf()
+        for _ in range(number):
+            op()
+        elapsed = perf() - start
+        if elapsed >= minSeconds / 10 or number >= 1 << 24:
+            break
+        number *= 4
+    number = max(1, int(number * minSeconds / max(elapsed, 1e-9)))
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf()
+        for _ in range(number):
+            op()
+        best = min(best, (perf() - start) / number)
+    return {'opsPerSec': 1 / best if best else float('inf'), 'usPerOp': best * 1e6}
+
+
+def allPieces(board: boardType) -> List[pieceType]:
+    # every shape and rotation at every column, at a few heights over the board
+    return [{'shape': shape, 'rotation': r, 'x': x, 'y': y, 'color': 0}
+            for shape in SHAPENAMES
+            for r in range(len(SHAPES[shape]))
+            for x in range(-2, board.width)
+            for y in (-2, board.height // 2, board.height - 4)]
+
+
+def matches(name: str, match: Opt[str]) -> bool:
+    # whether the benchmark called name is selected by --match
+    return match is None or match in name
+
+
+def engineBenchmarks(match: Opt[str] = None, kinds: Tuple[str, ...] = BOARDKINDS) -> Dict[str, Callable[[], Any]]:
+    # the rules functions, one op is one call
+    ops: Dict[str, Callable[[], Any]] = {}
+    rng = random.Random(1)
+    ops['getNewPiece'] = lambda: getNewPiece(rng)
+    ops['PieceGenerator.next[uniform]'] = PieceGenerator(1).next
+    ops['PieceGenerator.next[bag]'] = PieceGenerator(1, 'bag').next
+    for kind in kinds:
+        if not any(matches(f'{name}[{kind}]', match) for name in ('isValidPosition', 'addToBoard', 'removeCompleteLines')):
+            continue
+        board = makeBoard(kind)
+        pieces = allPieces(board)
+        numPieces = len(pieces)
+        counter = [0]
+
+        def validPosition(board: boardType = board, pieces: List[pieceType] = pieces, n: int = numPieces,
+                          counter: List[int] = counter) -> bool:
+            counter[0] = (counter[0] + 1) % n
+            return isValidPosition(board, pieces[counter[0]], adjY=1)
+
+        def addPiece(board: boardType = board) -> None:
+            # the piece lands on a copy of the board, with the copy counted in
+            addToBoard(board.copy(), {'shape': 'T', 'rotation': 0, 'x': 3, 'y': 0, 'color': 1})
+
+        def removeLines(board: boardType = board) -> int:
+            return removeCompleteLines(board.copy())
+
+        ops[f'isValidPosition[{kind}]'] = validPosition
+        ops[f'addToBoard[{kind}]'] = addPiece
+        ops[f'removeCompleteLines[{kind}]'] = removeLines
+    ops['boardCopy'] = makeBoard('tallStack').copy
+
+    if any(matches(name, match) for name in ('snapshot', 'restore', 'snapshotToBytes', 'snapshotFromBytes')):
+        # snapshots of a game in progress
+        sim = TetrisSim(seed=0)
+        for tick in range(600):
+            sim.step(KEY_DROP if tick % 20 == 0 else 0)
+        state = sim.snapshot()
+        data = state.toBytes()
+        ops['snapshot'] = sim.snapshot
+        ops['restore'] = lambda: sim.restore(state)
+        ops['snapshotToBytes'] = state.toBytes
+        ops['snapshotFromBytes'] = lambda: GameState.fromBytes(data)
+
+    if matches('clearLine[1000x10000]', match):
+        # a full row at the bottom of a stress size board, cleared the way TetrisSim.lock() does it.
+        # Clearing moves whole rows, so what is in them doesn't matter.
+        big = makeBoard('empty', 1000, 10000)
+
+        def clearBottomLine(board: boardType = big) -> int:
+            board.rows[-1] = board.fullRow
+            return removeCompleteLines(board, board.height - 4, board.height)
+
+        ops['clearLine[1000x10000]'] = clearBottomLine
+    return {name: op for name, op in ops.items() if matches(name, match)}
+
+
+def aiBenchmarks(match: Opt[str] = None, kinds: Tuple[str, ...] = BOARDKINDS) -> Dict[str, Callable[[], Any]]:
+    # one op is a placement choice for a T piece with the next piece known.
+    # The bot's cache is cleared every time so it really searches.
+    ops: Dict[str, Callable[[], Any]] = {}
+    for kind in kinds:
+        if not matches(f'botChoose[{kind}]', match):
+            continue
+        board = makeBoard(kind)
+        piece: pieceType = {'shape': 'T', 'rotation': 0, 'x': 3, 'y': -2, 'color': 0}
+        nextPiece: pieceType = {'shape': 'L', 'rotation': 0, 'x': 3, 'y': -2, 'color': 1}
+
+        def choose(board: boardType = board, piece: pieceType = piece, nextPiece: pieceType = nextPiece) -> Any:
+            bot = TetrisBot(cacheSize=100_000)
+            return bot.choose(board, piece, nextPiece)
+
+        ops[f'botChoose[{kind}]'] = choose
+    return ops
+
+
+def renderBenchmarks(match: Opt[str] = None) -> Dict[str, Callable[[], Any]]:
+    # one op is one displayed frame: the ticks runGame() steps between two frames, then drawing and
+    # display.update(). 'fullFrame' redraws everything, 'dirtyFrame' only what changed. The keys come
+    # from a bot game recorded up front, so the bot's search isn't part of the frame cost.
+    # Nothing is set up, not even the display, for benchmarks that match leaves out.
+    ops: Dict[str, Callable[[], Any]] = {}
+    wanted = [name for name in ('fullFrame', 'dirtyFrame', 'drawBoard[tallStack]') if matches(name, match)]
+    if not wanted:
+        return ops
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    import pygame
+    from . import terisgame as tg
+
+    tg.initDisplay()
+    if 'fullFrame' in wanted or 'dirtyFrame' in wanted:
+        ticksPerFrame = round(tg.TICKRATE / tg.FPS)
+        sim = TetrisSim(seed=0, tickSeconds=1 / tg.TICKRATE)
+        controller = BotController(TetrisBot())
+        recorded: List[int] = []
+        while sim.pieces < 60 and not sim.gameOver:
+            keys = controller.nextKeys(sim)
+            sim.step(keys)
+            recorded.append(keys)
+        numFrames = len(recorded) // ticksPerFrame
+        sims: List[TetrisSim] = [sim]
+        frames: List[int] = [numFrames]  # frames of the recording played by sims[0]
+
+        def stepFrame() -> TetrisSim:
+            if frames[0] == numFrames:
+                sims[0] = TetrisSim(seed=0, tickSeconds=1 / tg.TICKRATE)
+                frames[0] = 0
+            sim = sims[0]
+            start = frames[0] * ticksPerFrame
+            for keys in recorded[start:start + ticksPerFrame]:
+                sim.step(keys)
+            frames[0] += 1
+            return sim
+
+        def fullFrame() -> None:
+            sim = stepFrame()
+            tg.drawGame(sim)
+            pygame.display.update()
+
+        renderer = tg.DirtyRenderer()
+
+        def dirtyFrame() -> None:
+            sim = stepFrame()
+            pygame.display.update(renderer.draw(sim))
+
+        ops['fullFrame'] = fullFrame
+        ops['dirtyFrame'] = dirtyFrame
+
+    tallStack = makeBoard('tallStack')
+
+    def drawTallStack(board: boardType = tallStack) -> None:
+        tg.drawBoard(board)
+
+    ops['drawBoard[tallStack]'] = drawTallStack
+    return {name: ops[name] for name in wanted}
+
+
+SUITES: Dict[str, Callable[[Opt[str]], Dict[str, Callable[[], Any]]]] = {
+    'engine': engineBenchmarks,
+    'ai': aiBenchmarks,
+    'render': renderBenchmarks,
+}
+
+
+def runBenchmarks(suites: Tuple[str, ...] = tuple(SUITES), minSeconds: float = 0.2, repeat: int = 3,
+                  match: Opt[str] = None, out: Opt[Any] = sys.stdout) -> resultsType:
+    results: resultsType = {}
+    for suite in suites:
+        for name, op in SUITES[suite](match).items():
+            results[name] = timeOp(op, minSeconds, repeat)
+            if out is not None:
+                print(f'{name:<36} {results[name]["opsPerSec"]:>14,.1f} ops/s {results[name]["usPerOp"]:>12,.2f} us/op', file=out)
+    return results
+
+
+def compare(results: resultsType, baseline: resultsType, threshold: float) -> List[str]:
+    # a message for each benchmark more than threshold slower than its baseline
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = result['opsPerSec'] / base['opsPerSec']
+        if ratio < 1 - threshold:
+            regressions.append(f'{name}: {result["opsPerSec"]:,.1f} ops/s is {1 - ratio:.0%} slower than the baseline {base["opsPerSec"]:,.1f}')
+    return regressions
+
+
+def saveBaseline(path: str, results: resultsType) -> None:
+    data = {'python': platform.python_version(),
+            'machine': platform.machine(),
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'results': results}
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=4)
+
+
+def loadBaseline(path: str) -> resultsType:
+    with open(path) as f:
+        results: resultsType = json.load(f)['results']
+    return results
+
+
+def main(argv: Opt[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the tetris engine, bot and rendering.')
+    parser.add_argument('--suite', action='append', choices=list(SUITES), help='run only this suite (repeatable)')
+    parser.add_argument('--match', help='run only benchmarks whose name contains this')
+    parser.add_argument('--min-seconds', type=float, default=0.2, help='minimum time per timing run')
+    parser.add_argument('--repeat', type=int, default=3, help='timing runs per benchmark, the fastest is kept')
+    parser.add_argument('--save', help='write the results here as a JSON baseline')
+    parser.add_argument('--baseline', help='compare against this JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='fail when ops/sec drops by more than this fraction of the baseline')
+    args = parser.parse_args(argv)
+
+    results = runBenchmarks(tuple(args.suite or SUITES), args.min_seconds, args.repeat, args.match)
+    if args.save:
+        saveBaseline(args.save, results)
+    if args.baseline:
+        regressions = compare(results, loadBaseline(args.baseline), args.threshold)
+        for message in regressions:
+            print('REGRESSION ' + message, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+from typing import List, Sequence, Tuple, Union, Optional as Opt
+
+from .shapes import BLANK, TEMPLATEWIDTH
+
+# Bitboard engine for the tetris board.
+# Each row is an int bitmask: bit (PAD + x) is set when column x is filled.
+# PAD wall bits are kept set on both sides of every row, so a piece template
+# shifted off the left or right edge collides with the wall instead of
+# needing a per-cell isOnBoard() check. Colours live in a side array of one
+# bytearray per row (0 = blank, colour index + 1 otherwise).
+
+PAD = TEMPLATEWIDTH  # so any template column can be shifted onto the wall
+
+OCCUPIED = bytes([ord('0')] + [ord('1')] * 255)  # bytes.translate() table, a colour byte to a bit digit
+
+maskRowsType = Sequence[Tuple[int, int]]  # (ty, bitmask) per non-empty template row, bit tx for template column tx
+cellsType = Sequence[Tuple[int, int]]  # (tx, ty) offsets of the filled template cells
+
+
+class BitBoard():
+    __slots__ = ('width', 'height', 'emptyRow', 'fullRow', 'rows', 'colors')
+
+    def __init__(self, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+        boardBits = ((1 << width) - 1) << PAD
+        wallBits = ((1 << (width + 2 * PAD)) - 1) & ~boardBits
+        self.emptyRow = wallBits
+        self.fullRow = wallBits | boardBits
+        self.rows: List[int] = [wallBits] * height
+        self.colors: List[bytearray] = [bytearray(width) for _ in range(height)]
+
+    def copy(self) -> 'BitBoard':
+        new = BitBoard.__new__(BitBoard)
+        new.width = self.width
+        new.height = self.height
+        new.emptyRow = self.emptyRow
+        new.fullRow = self.fullRow
+        new.rows = self.rows[:]
+        new.colors = [bytearray(c) for c in self.colors]
+        return new
+
+    def pack(self) -> Tuple[Tuple[int, ...], bytes]:
+        # (row masks, colours as width * height bytes), an immutable copy of the board
+        return tuple(self.rows), b''.join(self.colors)
+
+    @classmethod
+    def unpack(cls, width: int, height: int, colors: bytes, rows: Opt[Sequence[int]] = None) -> 'BitBoard':
+        # the board back from pack(). Without rows the row masks are rebuilt from the colours.
+        board = cls(width, height)
+        board.colors = [bytearray(colors[y * width:(y + 1) * width]) for y in range(height)]
+        if rows is None:
+            empty = board.emptyRow
+            # colour bytes to '0'/'1' digits, reversed so column x is bit x
+            rows = [empty | int(colors[y * width:(y + 1) * width].translate(OCCUPIED)[::-1], 2) << PAD for y in range(height)]
+        board.rows = list(rows)
+        return board
+
+    def isFilled(self, x: int, y: int) -> bool:
+        return bool(self.rows[y] >> (PAD + x) & 1)
+
+    def colorAt(self, x: int, y: int) -> Union[str, int]:
+        # BLANK for an empty cell, otherwise the colour index of the piece that filled it
+        c = self.colors[y][x]
+        return BLANK if c == 0 else c - 1
+
+    def fits(self, masks: maskRowsType, x: int, y: int) -> bool:
+        # True if the template rows shifted to (x, y) are inside the board and hit nothing.
+        # Rows above the top of the board are not checked, as in the original isValidPosition.
+        shift = x + PAD
+        if shift < 0:
+            return False
+        rows = self.rows
+        height = self.height
+        for ty, m in masks:
+            by = y + ty
+            if by >= 0 and (by >= height or rows[by] & (m << shift)):
+                return False
+        return True
+
+    def place(self, masks: maskRowsType, cells: cellsType, color: int, x: int, y: int) -> None:
+        # lock a piece into the board. Cells above the top row are dropped.
+        shift = x + PAD
+        rows = self.rows
+        for ty, m in masks:
+            if y + ty >= 0:
+                rows[y + ty] |= m << shift
+        colors = self.colors
+        c = color + 1
+        for tx, ty in cells:
+            if y + ty >= 0:
+                colors[y + ty][x + tx] = c
+
+    def isCompleteLine(self, y: int) -> bool:
+        return self.rows[y] == self.fullRow
+
+    def clearLines(self, top: int = 0, bottom: Opt[int] = None) -> int:
+        # remove every full row between top and bottom (exclusive) and drop the rows above them down.
+        # Only rows a piece just filled can be full, so lock passes the piece's rows and the rest
+        # of a tall board is never scanned. The rows above move down in one list memmove.
+        full = self.fullRow
+        rows = self.rows
+        top = max(top, 0)
+        bottom = self.height if bottom is None else min(bottom, self.height)
+        keep = [y for y in range(top, bottom) if rows[y] != full]
+        numRemoved = bottom - top - len(keep)
+        if numRemoved:
+            colors = self.colors
+            colors[top:bottom] = [colors[y] for y in keep]
+            colors[:0] = [bytearray(self.width) for _ in range(numRemoved)]
+            rows[top:bottom] = [rows[y] for y in keep]
+            rows[:0] = [self.emptyRow] * numRemoved
+        return numRemoved
@@ -0,0 +1,303 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from typing import Dict, Hashable, List, Optional as Opt, Tuple
+
+from .bitboard import PAD
+from .shapes import SHAPES
+from .simulation import (boardType, pieceType, TetrisSim,
+                         KEY_LEFT, KEY_RIGHT, KEY_DOWN, KEY_ROTATE, KEY_ROTATE_BACK, KEY_DROP)
+
+# Placement search bot.
+# Boards are searched as tuples of BitBoard row masks, so they can be copied
+# by slicing and used directly as transposition table keys. A piece can reach
+# every state the BFS in findPlacements() finds by shifting, rotating and
+# soft-dropping to rest (which covers tucks and spins under overhangs).
+
+rowsType = Tuple[int, ...]
+stateType = Tuple[int, int, int]  # (rotation, x, y)
+moveType = str  # 'left', 'right', 'rotate', 'rotateBack' or 'down' (soft drop until resting)
+
+MOVEKEYS: Dict[moveType, int] = {'left': KEY_LEFT, 'right': KEY_RIGHT,
+                                 'rotate': KEY_ROTATE, 'rotateBack': KEY_ROTATE_BACK,
+                                 'down': KEY_DOWN}
+
+
+@dataclass(frozen=True)
+class Heuristic():
+    # weights for the board features, bigger total is better
+    holes: float = -0.35663
+    aggregateHeight: float = -0.510066
+    bumpiness: float = -0.184483
+    linesCleared: float = 0.760666
+
+
+class TranspositionTable():
+    # bounded LRU map from a position to its value
+
+    def __init__(self, maxSize: int) -> None:
+        self.maxSize = maxSize
+        self.table: 'OrderedDict[Hashable, float]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Opt[float]:
+        value = self.table.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.table.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: float) -> None:
+        self.table[key] = value
+        self.table.move_to_end(key)
+        if len(self.table) > self.maxSize:
+            self.table.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+
+def rowsFit(rows: rowsType, masks: Tuple[Tuple[int, int], ...], x: int, y: int) -> bool:
+    # BitBoard.fits() on a tuple of row masks
+    shift = x + PAD
+    if shift < 0:
+        return False
+    height = len(rows)
+    for ty, m in masks:
+        by = y + ty
+        if by >= 0 and (by >= height or rows[by] & (m << shift)):
+            return False
+    return True
+
+
+def placeRows(rows: rowsType, masks: Tuple[Tuple[int, int], ...], x: int, y: int, emptyRow: int, fullRow: int) -> Tuple[rowsType, int]:
+    # lock the piece into a copy of rows, clear full rows and return (new rows, lines cleared)
+    newRows = list(rows)
+    shift = x + PAD
+    for ty, m in masks:
+        if y + ty >= 0:
+            newRows[y + ty] |= m << shift
+    kept = [r for r in newRows if r != fullRow]
+    numLines = len(newRows) - len(kept)
+    if numLines:
+        kept[:0] = [emptyRow] * numLines
+    return tuple(kept), numLines
+
+
+def boardFeatures(rows: rowsType, emptyRow: int, fullRow: int) -> Tuple[int, int, int]:
+    # (holes, aggregate height, bumpiness) of the board
+    boardMask = fullRow & ~emptyRow
+    height = len(rows)
+    width = boardMask.bit_length() - PAD
+    heights = [0] * width
+    seen = 0
+    holes = 0
+    for y, row in enumerate(rows):
+        bits = row & boardMask
+        if seen:
+            holes += bin(seen & ~bits).count('1')
+        new = bits & ~seen
+        while new:
+            low = new & -new
+            heights[low.bit_length() - 1 - PAD] = height - y
+            new ^= low
+        seen |= bits
+    bumpiness = sum(abs(heights[i] - heights[i + 1]) for i in range(width - 1))
+    return holes, sum(heights), bumpiness
+
+
+def findPlacements(rows: rowsType, shape: str, rotation: int, x: int, y: int,
+                   withPaths: bool = False) -> Dict[stateType, List[moveType]]:
+    # every resting (rotation, x, y) the piece can reach from (rotation, x, y).
+    # With withPaths the moves to get there are returned too, otherwise the lists are empty.
+    rotations = SHAPES[shape]
+    numRotations = len(rotations)
+    start = (rotation, x, y)
+    parents: Dict[stateType, Tuple[stateType, moveType]] = {}
+    seen = {start}
+    frontier = [start]
+    finals: List[stateType] = []
+    while frontier:
+        nextFrontier = []
+        for state in frontier:
+            r, sx, sy = state
+            masks = rotations[r].rowMasks
+            # shifts and rotations first, so paths prefer moving before dropping
+            candidates = [((r, sx - 1, sy), 'left'), ((r, sx + 1, sy), 'right')]
+            if numRotations > 1:
+                candidates += [(((r + 1) % numRotations, sx, sy), 'rotate'), (((r - 1) % numRotations, sx, sy), 'rotateBack')]
+            if rowsFit(rows, masks, sx, sy + 1):
+                dy = sy + 1
+                while rowsFit(rows, masks, sx, dy + 1):
+                    dy += 1
+                candidates.append(((r, sx, dy), 'down'))
+            else:
+                finals.append(state)
+            for nextState, move in candidates:
+                if nextState in seen:
+                    continue
+                nr, nx, ny = nextState
+                if move == 'down' or rowsFit(rows, rotations[nr].rowMasks, nx, ny):
+                    seen.add(nextState)
+                    nextFrontier.append(nextState)
+                    if withPaths:
+                        parents[nextState] = (state, move)
+        frontier = nextFrontier
+
+    placements: Dict[stateType, List[moveType]] = {}
+    for state in finals:
+        path: List[moveType] = []
+        if withPaths:
+            node = state
+            while node != start:
+                node, move = parents[node]
+                path.append(move)
+            path.reverse()
+        placements[state] = path
+    return placements
+
+
+class TetrisBot():
+    # Picks the placement with the best heuristic value, looking one piece ahead when the next piece is known.
+
+    def __init__(self, heuristic: Opt[Heuristic] = None, lookahead: bool = True, cacheSize: int = 200_000) -> None:
+        self.heuristic = heuristic if heuristic is not None else Heuristic()
+        self.lookahead = lookahead
+        self.cache = TranspositionTable(cacheSize)
+        self.placementsEvaluated = 0
+
+    def evaluate(self, rows: rowsType, emptyRow: int, fullRow: int) -> float:
+        value = self.cache.get(rows)
+        if value is None:
+            h = self.heuristic
+            holes, aggregateHeight, bumpiness = boardFeatures(rows, emptyRow, fullRow)
+            value = h.holes * holes + h.aggregateHeight * aggregateHeight + h.bumpiness * bumpiness
+            self.cache.put(rows, value)
+        return value
+
+    def bestValue(self, rows: rowsType, piece: pieceType, emptyRow: int, fullRow: int) -> float:
+        # value of the best placement of piece on rows, with no further lookahead
+        key = (rows, piece['shape'], piece['rotation'], piece['x'], piece['y'])
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+        rotations = SHAPES[piece['shape']]
+        linesWeight = self.heuristic.linesCleared
+        best = float('-inf')
+        for (r, x, y) in findPlacements(rows, piece['shape'], piece['rotation'], piece['x'], piece['y']):
+            newRows, numLines = placeRows(rows, rotations[r].rowMasks, x, y, emptyRow, fullRow)
+            self.placementsEvaluated += 1
+            best = max(best, self.evaluate(newRows, emptyRow, fullRow) + linesWeight * numLines)
+        self.cache.put(key, best)
+        return best
+
+    def choose(self, board: boardType, piece: pieceType, nextPiece: Opt[pieceType] = None,
+               withPath: bool = False) -> Opt[Tuple[stateType, List[moveType]]]:
+        # the best reachable resting state for piece and the moves to get there, None if nothing is reachable
+        rows = tuple(board.rows)
+        emptyRow = board.emptyRow
+        fullRow = board.fullRow
+        rotations = SHAPES[piece['shape']]
+        linesWeight = self.heuristic.linesCleared
+        best: Opt[Tuple[stateType, List[moveType]]] = None
+        bestValue = float('-inf')
+        placements = findPlacements(rows, piece['shape'], piece['rotation'], piece['x'], piece['y'], withPaths=withPath)
+        for state, path in placements.items():
+            r, x, y = state
+            newRows, numLines = placeRows(rows, rotations[r].rowMasks, x, y, emptyRow, fullRow)
+            self.placementsEvaluated += 1
+            value = linesWeight * numLines
+            if self.lookahead and nextPiece is not None and rowsFit(newRows, SHAPES[nextPiece['shape']][nextPiece['rotation']].rowMasks,
+                                                                    nextPiece['x'], nextPiece['y']):
+                value += self.bestValue(newRows, nextPiece, emptyRow, fullRow)
+            else:
+                value += self.evaluate(newRows, emptyRow, fullRow)
+            if value > bestValue:
+                best, bestValue = (state, path), value
+        return best
+
+    def playHeadless(self, sim: TetrisSim, maxPieces: Opt[int] = None) -> float:
+        # play placement by placement until game over (or maxPieces), return placements evaluated per second
+        start = time.perf_counter()
+        evaluated = self.placementsEvaluated
+        if sim.fallingPiece is None:
+            sim.spawn()
+        while not sim.gameOver and (maxPieces is None or sim.pieces < maxPieces):
+            assert sim.fallingPiece is not None
+            choice = self.choose(sim.board, sim.fallingPiece, sim.nextPiece)
+            if choice is None:
+                # nothing rests anywhere reachable, so the piece locks where it is
+                piece = sim.fallingPiece
+                sim.place(piece['rotation'], piece['x'], piece['y'])
+                continue
+            (r, x, y), _ = choice
+            sim.place(r, x, y)
+        elapsed = time.perf_counter() - start
+        return (self.placementsEvaluated - evaluated) / elapsed if elapsed else 0.0
+
+
+class BotController():
+    # Turns the bot's plan for each piece into held keys for TetrisSim.step(), so it can
+    # drive runGame() or a headless tick by tick game. Keys are tapped for one tick and
+    # released for one tick, so every move is a fresh KEYDOWN.
+
+    def __init__(self, bot: TetrisBot) -> None:
+        self.bot = bot
+        self.piece: Opt[pieceType] = None
+        self.moves: List[moveType] = []
+        self.lastKeys = 0
+
+    def replan(self, sim: TetrisSim) -> None:
+        piece = sim.fallingPiece
+        assert piece is not None
+        self.piece = piece
+        choice = self.bot.choose(sim.board, piece, sim.nextPiece, withPath=True)
+        self.moves = choice[1] if choice is not None else []
+
+    def nextKeys(self, sim: TetrisSim) -> int:
+        piece = sim.fallingPiece
+        if piece is None or sim.gameOver:
+            self.lastKeys = 0
+            return 0
+        if piece is not self.piece:
+            self.replan(sim)
+        if self.lastKeys & ~KEY_DOWN:
+            self.lastKeys = 0  # release, so the next tap is a new key press
+            return 0
+
+        if self.moves == ['down']:
+            self.moves = []  # the last drop to rest is a hard drop
+        if self.moves and self.moves[0] == 'down':
+            # soft drop (hold down) until resting, then carry on with the tuck
+            if sim.board.fits(SHAPES[piece['shape']][piece['rotation']].rowMasks, piece['x'], piece['y'] + 1):
+                self.lastKeys = KEY_DOWN
+                return KEY_DOWN
+            self.moves.pop(0)
+
+        if not self.moves:
+            self.lastKeys = KEY_DROP
+            return KEY_DROP
+
+        move = self.moves[0]
+        rotations = SHAPES[piece['shape']]
+        r, x = piece['rotation'], piece['x']
+        if move == 'left':
+            x -= 1
+        elif move == 'right':
+            x += 1
+        elif move == 'rotate':
+            r = (r + 1) % len(rotations)
+        else:
+            r = (r - 1) % len(rotations)
+        if move != 'down' and not sim.board.fits(rotations[r].rowMasks, x, piece['y']):
+            # gravity moved the piece somewhere the plan no longer works from
+            self.replan(sim)
+            self.lastKeys = 0
+            return 0
+        self.moves.pop(0)
+        self.lastKeys = MOVEKEYS[move]
+        return self.lastKeys
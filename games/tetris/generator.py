@@ -0,0 +1,81 @@
+import random
+from collections import deque
+
+from typing import Any, Deque, List, Optional as Opt, Tuple
+
+from .shapes import SHAPES, SHAPENAMES
+
+# Piece sequences for TetrisSim.
+# A PieceGenerator owns a seeded random.Random and keeps a queue of upcoming
+# (shape, rotation, colour) specs, generated in batches so a spawn is only a
+# popleft(). Policies:
+#   'uniform'  every piece is an independent random shape, drawn with exactly
+#              the rng calls getNewPiece() makes, so seeds give the same games
+#              (and old replays the same pieces) as before
+#   'bag'      the 7-bag: each run of seven pieces is a shuffle of all shapes
+# Rotation and colour are random under both policies.
+
+specType = Tuple[str, int, int]  # (shape, rotation, colour)
+
+POLICIES = ('uniform', 'bag')
+PIECEBATCH = 64  # pieces generated at a time once the queue runs short
+NUMCOLORS = 4  # simulation.NUMCOLORS, repeated here as simulation imports this module
+
+
+class PieceGenerator():
+
+    def __init__(self, seed: Opt[int] = None, policy: str = 'uniform', preview: int = 1,
+                 batch: int = PIECEBATCH) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f'unknown piece policy {policy!r}, expected one of {POLICIES}')
+        self.rng = random.Random(seed)
+        self.policy = policy
+        self.preview = preview  # upcoming pieces that must always be known
+        self.batch = max(batch, preview)
+        self.queue: Deque[specType] = deque()
+
+    def generate(self, count: int) -> None:
+        # append at least count more pieces to the queue (the bag policy rounds up to whole bags)
+        rng = self.rng
+        choice = rng.choice
+        randint = rng.randint
+        lastRotation = {shape: len(SHAPES[shape]) - 1 for shape in SHAPENAMES}
+        lastColor = NUMCOLORS - 1
+        append = self.queue.append
+        if self.policy == 'uniform':
+            for _ in range(count):
+                shape = choice(SHAPENAMES)
+                append((shape, randint(0, lastRotation[shape]), randint(0, lastColor)))
+        else:
+            for _ in range(-(-count // len(SHAPENAMES))):
+                bag = list(SHAPENAMES)  # always shuffled from the same order, so batch sizes don't change the sequence
+                rng.shuffle(bag)
+                for shape in bag:
+                    append((shape, randint(0, lastRotation[shape]), randint(0, lastColor)))
+
+    def next(self) -> specType:
+        queue = self.queue
+        if len(queue) <= self.preview:
+            self.generate(self.batch)
+        return queue.popleft()
+
+    def peek(self, count: int) -> List[specType]:
+        # the next count pieces, without taking them
+        if len(self.queue) < count:
+            self.generate(max(count - len(self.queue), self.batch))
+        return [self.queue[i] for i in range(count)]
+
+    def sequence(self, count: int) -> List[specType]:
+        # take the next count pieces in one go, e.g. for a headless game known in advance
+        if len(self.queue) < count:
+            self.generate(count - len(self.queue))
+        queue = self.queue
+        return [queue.popleft() for _ in range(count)]
+
+    def getState(self) -> Tuple[Tuple[Any, ...], Tuple[specType, ...]]:
+        # (rng state, queued pieces), everything needed to continue the same sequence
+        return self.rng.getstate(), tuple(self.queue)
+
+    def setState(self, rngState: Tuple[Any, ...], queue: Tuple[specType, ...]) -> None:
+        self.rng.setstate(rngState)
+        self.queue = deque(queue)
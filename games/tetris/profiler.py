@@ -0,0 +1,102 @@
+import json
+import math
+import time
+from array import array
+from collections import deque
+
+from typing import Any, Deque, Dict, List, Optional as Opt, Sequence, Tuple
+
+# Opt-in timing of the phases of the tetris game loop.
+# The loop calls lap(phase) after each phase, which charges the nanoseconds
+# since the previous lap to that phase, and endFrame() once a frame is on
+# screen. Callers hold the profiler in a local and guard each call with
+# "if prof:", so with profiling off a phase costs one truth test.
+# Recent frames feed the live overlay (p50/p95/p99), every frame is kept in
+# compact arrays for the CSV or JSON trace written by export().
+
+FRAME = 'frame'  # pseudo phase, the sum of all phases of a frame
+
+
+def percentile(ordered: Sequence[int], q: float) -> int:
+    # nearest-rank percentile of already sorted values, 0 for no values
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+class FrameProfiler():
+
+    def __init__(self, window: int = 250, tracePath: Opt[str] = None) -> None:
+        self.clock = time.perf_counter_ns
+        self.window = window  # frames the overlay percentiles are over
+        self.tracePath = tracePath
+        self.showOverlay = False
+        self.phases: List[str] = []  # in the order they first appeared
+        self.current: Dict[str, int] = {}
+        self.recent: Dict[str, Deque[int]] = {FRAME: deque(maxlen=window)}
+        self.trace: Dict[str, 'array[int]'] = {FRAME: array('q')}
+        self.frames = 0
+        self.last = self.clock()
+
+    def lap(self, phase: str) -> None:
+        now = self.clock()
+        current = self.current
+        current[phase] = current.get(phase, 0) + now - self.last
+        self.last = now
+
+    def skip(self) -> None:
+        # don't charge the time since the last lap to anything, e.g. after the game was paused
+        self.last = self.clock()
+
+    def endFrame(self) -> None:
+        current = self.current
+        for phase in current:
+            if phase not in self.trace:
+                self.phases.append(phase)
+                self.recent[phase] = deque([0] * min(self.frames, self.window), maxlen=self.window)
+                self.trace[phase] = array('q', bytes(8 * self.frames))
+        total = 0
+        for phase in self.phases:
+            ns = current.get(phase, 0)
+            total += ns
+            self.recent[phase].append(ns)
+            self.trace[phase].append(ns)
+        self.recent[FRAME].append(total)
+        self.trace[FRAME].append(total)
+        current.clear()
+        self.frames += 1
+
+    def percentiles(self, phase: str, recent: bool = True) -> Tuple[int, int, int]:
+        # (p50, p95, p99) in ns, over the last window frames or the whole run
+        ordered = sorted(self.recent[phase] if recent else self.trace[phase])
+        return percentile(ordered, 0.5), percentile(ordered, 0.95), percentile(ordered, 0.99)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        # per phase statistics of the whole run, in microseconds
+        summary = {}
+        for phase in self.phases + [FRAME]:
+            values = self.trace[phase]
+            p50, p95, p99 = self.percentiles(phase, recent=False)
+            summary[phase] = {'p50': p50 / 1e3, 'p95': p95 / 1e3, 'p99': p99 / 1e3,
+                              'mean': sum(values) / len(values) / 1e3 if values else 0.0,
+                              'max': max(values) / 1e3 if values else 0.0}
+        return summary
+
+    def export(self, path: Opt[str] = None) -> None:
+        # write the trace as CSV (one row per frame, microseconds) or JSON (summary and per frame
+        # nanoseconds), picked by the file extension
+        path = path or self.tracePath
+        if path is None:
+            return
+        columns = self.phases + [FRAME]
+        if path.endswith('.csv'):
+            with open(path, 'w') as f:
+                f.write(','.join(['frame'] + [f'{c}_us' for c in columns]) + '\n')
+                for i in range(self.frames):
+                    f.write(','.join([str(i)] + [f'{self.trace[c][i] / 1e3:.1f}' for c in columns]) + '\n')
+        else:
+            data: Dict[str, Any] = {'frames': self.frames,
+                                    'summaryMicroseconds': self.summary(),
+                                    'traceNanoseconds': {c: self.trace[c].tolist() for c in columns}}
+            with open(path, 'w') as f:
+                json.dump(data, f)
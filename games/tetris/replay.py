@@ -0,0 +1,123 @@
+import struct
+
+from typing import BinaryIO, Iterator, Optional as Opt, Tuple, Type
+from types import TracebackType
+
+from .simulation import TetrisSim, BOARDWIDTH, BOARDHEIGHT
+from .generator import POLICIES
+
+# Compact replays: a TetrisSim is fully determined by its seed, its tick length,
+# its board size, its piece policy and the held keys of every tick, so that is
+# all a replay stores.
+# File layout:
+#   header  MAGIC, version (B), seed (q), tickSeconds (d), board width (I), board height (I),
+#           piece policy (B, index into generator.POLICIES)
+#   body    runs of (tick count as LEB128 varint, keys byte) until end of file
+# Keys only change a few times a second, so a game is a few bytes per second
+# of play. ReplayReader decodes runs from fixed size chunks, so replays of any
+# length are read without loading the whole file.
+
+MAGIC = b'TTRP'
+VERSION = 3
+HEADER = struct.Struct('<4sBqdIIB')
+CHUNKSIZE = 64 * 1024
+
+
+def encodeVarint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+class ReplayWriter():
+
+    def __init__(self, path: str, seed: int, tickSeconds: float, width: int = BOARDWIDTH, height: int = BOARDHEIGHT,
+                 policy: str = 'uniform') -> None:
+        self.file: BinaryIO = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, seed, tickSeconds, width, height, POLICIES.index(policy)))
+        self.keys = 0
+        self.count = 0
+        self.ticks = 0
+
+    def record(self, keys: int) -> None:
+        # add the held keys of one tick
+        if keys != self.keys and self.count:
+            self._flush()
+        self.keys = keys
+        self.count += 1
+        self.ticks += 1
+
+    def _flush(self) -> None:
+        self.file.write(encodeVarint(self.count) + bytes((self.keys, )))
+        self.count = 0
+
+    def close(self) -> None:
+        if self.count:
+            self._flush()
+        self.file.close()
+
+    def __enter__(self) -> 'ReplayWriter':
+        return self
+
+    def __exit__(self, excType: Opt[Type[BaseException]], exc: Opt[BaseException], tb: Opt[TracebackType]) -> None:
+        self.close()
+
+
+class ReplayReader():
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            start = f.read(HEADER.size)
+        if len(start) < 5 or start[:4] != MAGIC:
+            raise ValueError(f'{path} is not a tetris replay')
+        if start[4] != VERSION:
+            raise ValueError(f'{path} is replay version {start[4]}, only version {VERSION} can be played')
+        if len(start) < HEADER.size:
+            raise ValueError(f'{path} is a truncated tetris replay')
+        _, _, self.seed, self.tickSeconds, self.width, self.height, policy = HEADER.unpack(start)
+        self.policy = POLICIES[policy]
+
+    def runs(self) -> Iterator[Tuple[int, int]]:
+        # yield (keys, number of ticks) runs, reading the file a chunk at a time
+        with open(self.path, 'rb') as f:
+            f.seek(HEADER.size)
+            count = 0
+            shift = 0
+            inKeys = False
+            while True:
+                chunk = f.read(CHUNKSIZE)
+                if not chunk:
+                    break
+                for byte in chunk:
+                    if inKeys:
+                        yield byte, count
+                        count = shift = 0
+                        inKeys = False
+                    else:
+                        count |= (byte & 0x7f) << shift
+                        shift += 7
+                        inKeys = not byte & 0x80
+
+    def ticks(self) -> Iterator[int]:
+        # yield the held keys of every tick
+        for keys, count in self.runs():
+            for _ in range(count):
+                yield keys
+
+    def newSim(self) -> TetrisSim:
+        return TetrisSim(seed=self.seed, tickSeconds=self.tickSeconds, width=self.width, height=self.height, policy=self.policy)
+
+
+def replayHeadless(path: str) -> TetrisSim:
+    # play a replay back as fast as possible and return the finished simulation
+    reader = ReplayReader(path)
+    sim = reader.newSim()
+    step = sim.step
+    for keys, count in reader.runs():
+        for _ in range(count):
+            step(keys)
+    return sim
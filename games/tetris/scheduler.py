@@ -0,0 +1,108 @@
+import heapq
+import time
+
+from typing import Callable, Dict, List, Tuple
+
+# Timing for the tetris front end and simulation.
+# TimerQueue holds the simulation's named timers (gravity, auto-repeat, lock
+# delay) as due tick numbers, so nothing in the rules reads a clock.
+# FixedTimestep turns the monotonic wall clock into a whole number of
+# simulation ticks per loop iteration and, separately, tells the caller when a
+# frame is due, so the simulation can run at a high fixed rate while the
+# display runs at its own.
+
+
+class TimerQueue():
+
+    def __init__(self) -> None:
+        self.heap: List[Tuple[int, int, str]] = []
+        self.active: Dict[str, int] = {}  # name -> seq of its live entry, older entries are ignored
+        self.seq = 0
+
+    def schedule(self, name: str, dueTick: int) -> None:
+        # (re)start the named timer, replacing any pending one
+        self.seq += 1
+        self.active[name] = self.seq
+        heapq.heappush(self.heap, (dueTick, self.seq, name))
+
+    def cancel(self, name: str) -> None:
+        self.active.pop(name, None)
+
+    def isPending(self, name: str) -> bool:
+        return name in self.active
+
+    def popDue(self, tick: int) -> List[str]:
+        # names of the timers due at or before tick, each fires once
+        heap = self.heap
+        fired = []
+        while heap and heap[0][0] <= tick:
+            _, seq, name = heapq.heappop(heap)
+            if self.active.get(name) == seq:
+                del self.active[name]
+                fired.append(name)
+        return fired
+
+    def clear(self) -> None:
+        self.heap.clear()
+        self.active.clear()
+
+    def pending(self) -> Tuple[Tuple[str, int], ...]:
+        # (name, dueTick) of every live timer, in firing order
+        active = self.active
+        return tuple((name, due) for due, seq, name in sorted(self.heap) if active.get(name) == seq)
+
+    def load(self, pending: Tuple[Tuple[str, int], ...]) -> None:
+        # replace every timer with the (name, dueTick) pairs from pending()
+        self.clear()
+        for name, due in pending:
+            self.schedule(name, due)
+
+
+def ticksFor(seconds: float, tickSeconds: float) -> int:
+    # number of ticks until "elapsed > seconds" is true, the test the original wall clock timers used
+    return max(0, int(seconds / tickSeconds + 1e-9) + 1)
+
+
+class FixedTimestep():
+
+    def __init__(self, tickSeconds: float, frameSeconds: float, maxTicksPerUpdate: int = 250,
+                 clock: Callable[[], float] = time.perf_counter) -> None:
+        self.tickSeconds = tickSeconds
+        self.frameSeconds = frameSeconds
+        self.maxTicksPerUpdate = maxTicksPerUpdate  # after a long stall, drop time instead of spiralling
+        self.clock = clock
+        self.reset()
+
+    def reset(self) -> None:
+        # forget elapsed time, e.g. after a pause
+        now = self.clock()
+        self.lastTime = now
+        self.accumulator = 0.0
+        self.nextFrame = now
+
+    def ticksDue(self) -> int:
+        now = self.clock()
+        self.accumulator += now - self.lastTime
+        self.lastTime = now
+        ticks = int(self.accumulator / self.tickSeconds)
+        self.accumulator -= ticks * self.tickSeconds
+        if ticks > self.maxTicksPerUpdate:
+            ticks = self.maxTicksPerUpdate
+        return ticks
+
+    def frameDue(self) -> bool:
+        now = self.clock()
+        if now < self.nextFrame:
+            return False
+        self.nextFrame += self.frameSeconds
+        if self.nextFrame < now:
+            self.nextFrame = now + self.frameSeconds  # fell behind, don't try to catch up on frames
+        return True
+
+    def wait(self) -> None:
+        # sleep until the next tick or frame is due
+        now = self.clock()
+        untilTick = self.tickSeconds - self.accumulator - (now - self.lastTime)
+        delay = min(untilTick, self.nextFrame - now)
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,150 @@
+from types import MappingProxyType
+from typing import Dict, List, Mapping, NamedTuple, Tuple
+
+# Piece templates and the tables compiled from them at import time.
+# The hot paths (collision, locking, drawing) only ever touch the compiled
+# SHAPES tables, which hold just the 4 filled cells of each rotation.
+
+BLANK = '.'
+
+TEMPLATEWIDTH = 5
+TEMPLATEHEIGHT = 5
+
+# shape templates for vertical or horizontal rotations
+S_SHAPE_TEMPLATE = [['.....',
+                     '.....',
+                     '..OO.',
+                     '.OO..',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '..OO.',
+                     '...O.',
+                     '.....']]
+
+Z_SHAPE_TEMPLATE = [['.....',
+                     '.....',
+                     '.OO..',
+                     '..OO.',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '.OO..',
+                     '.O...',
+                     '.....']]
+
+I_SHAPE_TEMPLATE = [['..O..',
+                     '..O..',
+                     '..O..',
+                     '..O..',
+                     '.....'],
+                    ['.....',
+                     '.....',
+                     'OOOO.',
+                     '.....',
+                     '.....']]
+
+O_SHAPE_TEMPLATE = [['.....',
+                     '.....',
+                     '.OO..',
+                     '.OO..',
+                     '.....']]
+
+J_SHAPE_TEMPLATE = [['.....',
+                     '.O...',
+                     '.OOO.',
+                     '.....',
+                     '.....'],
+                    ['.....',
+                     '..OO.',
+                     '..O..',
+                     '..O..',
+                     '.....'],
+                    ['.....',
+                     '.....',
+                     '.OOO.',
+                     '...O.',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '..O..',
+                     '.OO..',
+                     '.....']]
+
+L_SHAPE_TEMPLATE = [['.....',
+                     '...O.',
+                     '.OOO.',
+                     '.....',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '..O..',
+                     '..OO.',
+                     '.....'],
+                    ['.....',
+                     '.....',
+                     '.OOO.',
+                     '.O...',
+                     '.....'],
+                    ['.....',
+                     '.OO..',
+                     '..O..',
+                     '..O..',
+                     '.....']]
+
+T_SHAPE_TEMPLATE = [['.....',
+                     '..O..',
+                     '.OOO.',
+                     '.....',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '..OO.',
+                     '..O..',
+                     '.....'],
+                    ['.....',
+                     '.....',
+                     '.OOO.',
+                     '..O..',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '.OO..',
+                     '..O..',
+                     '.....']]
+
+PIECES: Dict[str, List[List[str]]] = {'S': S_SHAPE_TEMPLATE,
+                                      'Z': Z_SHAPE_TEMPLATE,
+                                      'J': J_SHAPE_TEMPLATE,
+                                      'L': L_SHAPE_TEMPLATE,
+                                      'I': I_SHAPE_TEMPLATE,
+                                      'O': O_SHAPE_TEMPLATE,
+                                      'T': T_SHAPE_TEMPLATE}
+
+
+class PieceRotation(NamedTuple):
+    cells: Tuple[Tuple[int, int], ...]  # (x, y) template offsets of the filled cells
+    rowMasks: Tuple[Tuple[int, int], ...]  # (y, bitmask) per non-empty template row, bit x for template column x
+    bbox: Tuple[int, int, int, int]  # (minX, minY, maxX, maxY) of the filled cells, inclusive
+    bottoms: Tuple[Tuple[int, int], ...]  # (x, lowest filled y) per non-empty template column
+    width: int
+    height: int
+
+
+def compileTemplate(template: List[str]) -> PieceRotation:
+    cells = tuple((x, y) for y in range(TEMPLATEHEIGHT) for x in range(TEMPLATEWIDTH) if template[y][x] != BLANK)
+    xs = [x for x, _ in cells]
+    ys = [y for _, y in cells]
+    rowMasks = tuple((y, sum(1 << x for x, cy in cells if cy == y)) for y in sorted(set(ys)))
+    bottoms = tuple((x, max(cy for cx, cy in cells if cx == x)) for x in sorted(set(xs)))
+    return PieceRotation(cells=cells,
+                         rowMasks=rowMasks,
+                         bbox=(min(xs), min(ys), max(xs), max(ys)),
+                         bottoms=bottoms,
+                         width=max(xs) - min(xs) + 1,
+                         height=max(ys) - min(ys) + 1)
+
+
+SHAPES: Mapping[str, Tuple[PieceRotation, ...]] = MappingProxyType(
+    {shape: tuple(compileTemplate(template) for template in templates) for shape, templates in PIECES.items()})
+SHAPENAMES: Tuple[str, ...] = tuple(SHAPES)  # fixed order, so random.choice() needs no list per spawn
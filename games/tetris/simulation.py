@@ -0,0 +1,355 @@
+import random
+
+from typing import Any, List, Tuple, Optional as Opt
+from mypy_extensions import TypedDict
+
+from .bitboard import BitBoard
+from .shapes import TEMPLATEWIDTH, SHAPES, SHAPENAMES
+from .scheduler import TimerQueue, ticksFor
+from .generator import PieceGenerator, specType
+from .state import GameState, PieceState, MOVINGDOWN, MOVINGLEFT, MOVINGRIGHT, GAMEOVER
+
+# Display-free tetris rules. TetrisSim advances on explicit ticks and takes the
+# held keys for each tick as a bitmask, so it can run as fast as the CPU allows
+# (AI training, regression runs) or be driven once per frame by terisgame.runGame().
+
+boardType = BitBoard  # row bitmasks, each square is BLANK: str or piece.colour: int via board.colorAt()
+pieceType = TypedDict('pieceType', {'shape': str,  # shape is str, key to SHAPES
+                                    'rotation': int,
+                                    'x': int,
+                                    'y': int,
+                                    'color': int})
+
+BOARDWIDTH = 10
+BOARDHEIGHT = 20
+NUMCOLORS = 4  # len(terisgame.COLORS)
+
+MOVESIDEWAYSFREQ = 0.15
+MOVEDOWNFREQ = 0.1
+TICKSECONDS = 1 / 25  # one frame of the pygame front end
+
+# key bits for the input state passed to TetrisSim.step()
+KEY_LEFT = 1  # K_LEFT / K_a
+KEY_RIGHT = 2  # K_RIGHT / K_d
+KEY_DOWN = 4  # K_DOWN / K_s
+KEY_ROTATE = 8  # K_UP / K_w
+KEY_ROTATE_BACK = 16  # K_q
+KEY_DROP = 32  # K_SPACE
+
+
+def calculateLevelAndFallFreq(score: int) -> Tuple[int, float]:
+    # Based on the score, return the level the player is on and
+    # how many seconds pass until a falling piece falls one space.
+    level = int(score / 10) + 1
+    fallFreq = 0.27 - (level * 0.02)
+    return (level, fallFreq)
+
+
+def getNewPiece(rng: Opt[random.Random] = None, boardWidth: int = BOARDWIDTH) -> pieceType:
+    # return a random new piece in a random rotation and color, centred over a board boardWidth wide.
+    # Pass a seeded rng to make the piece sequence reproducible, otherwise the global random module is used.
+    r: Any = random if rng is None else rng
+    shape = r.choice(SHAPENAMES)
+    newPiece: pieceType = {'shape': shape,
+                           'rotation': r.randint(0, len(SHAPES[shape]) - 1),
+                           'x': int(boardWidth / 2) - int(TEMPLATEWIDTH / 2),
+                           'y': -2,  # start it above the board (i.e. less than 0)
+                           'color': r.randint(0, NUMCOLORS - 1)}
+    return newPiece
+
+
+def makePiece(spec: specType, boardWidth: int = BOARDWIDTH) -> pieceType:
+    # a new piece at the top of the board from a PieceGenerator (shape, rotation, colour) spec
+    shape, rotation, color = spec
+    return {'shape': shape,
+            'rotation': rotation,
+            'x': int(boardWidth / 2) - int(TEMPLATEWIDTH / 2),
+            'y': -2,  # start it above the board (i.e. less than 0)
+            'color': color}
+
+
+def pieceFromState(state: PieceState) -> pieceType:
+    # the piece dict of a snapshot's PieceState
+    return {'shape': state.shape, 'rotation': state.rotation, 'x': state.x, 'y': state.y, 'color': state.color}
+
+
+def addToBoard(board: boardType, piece: pieceType) -> None:
+    # fill in the board based on piece's location, shape, and rotation
+    rot = SHAPES[piece['shape']][piece['rotation']]
+    board.place(rot.rowMasks, rot.cells, piece['color'], piece['x'], piece['y'])
+
+
+def getBlankBoard(width: int = BOARDWIDTH, height: int = BOARDHEIGHT) -> boardType:
+    # create and return a new blank board data structure
+    return BitBoard(width, height)
+
+
+def isOnBoard(x: int, y: int, width: int = BOARDWIDTH, height: int = BOARDHEIGHT) -> bool:
+    return x >= 0 and x < width and y < height
+
+
+def isValidPosition(board: boardType, piece: pieceType, adjX: int = 0, adjY: int = 0) -> bool:
+    # Return True if the piece is within the board and not colliding
+    return board.fits(SHAPES[piece['shape']][piece['rotation']].rowMasks, piece['x'] + adjX, piece['y'] + adjY)
+
+
+def isCompleteLine(board: boardType, y: int) -> bool:
+    # Return True if the line filled with boxes with no gaps.
+    return board.isCompleteLine(y)
+
+
+def getDropDistance(board: boardType, piece: pieceType) -> int:
+    # how far the piece can move straight down from where it is
+    for i in range(1, board.height):
+        if not isValidPosition(board, piece, adjY=i):
+            break
+    return i - 1
+
+
+def removeCompleteLines(board: boardType, top: int = 0, bottom: Opt[int] = None) -> int:
+    # Remove any completed lines on the board, move everything above them down, and return the number of complete lines.
+    # Only rows top to bottom (exclusive) are checked, the whole board by default.
+    return board.clearLines(top, bottom)
+
+
+class TetrisSim():
+    # One game of tetris. Call step(keys) once per tick until gameOver is True;
+    # keys is the OR of the KEY_* bits held during that tick. A key that goes from
+    # up to down acts like a KEYDOWN event, down to up like a KEYUP event.
+    # Gravity, sideways auto-repeat (das: delay before the first repeat, arr: between
+    # repeats), soft drop repeat and lock delay are timers in ticks, so the rules are
+    # the same at any tick rate. A lockDelay of 0 locks as soon as the piece lands.
+    # The board size is per game, up to stress sizes like 1000 x 10000.
+    # Pieces come from a PieceGenerator with the given policy ('uniform' or 'bag'), which keeps
+    # preview pieces known (nextPiece and the ones after it, see previewPieces()).
+
+    def __init__(self, seed: Opt[int] = None, tickSeconds: float = TICKSECONDS,
+                 das: float = MOVESIDEWAYSFREQ, arr: float = MOVESIDEWAYSFREQ, lockDelay: float = 0.0,
+                 width: int = BOARDWIDTH, height: int = BOARDHEIGHT, policy: str = 'uniform', preview: int = 1) -> None:
+        self.pieceGen = PieceGenerator(seed, policy, preview - 1)
+        self.tickSeconds = tickSeconds
+        self.dasTicks = ticksFor(das, tickSeconds)
+        self.arrTicks = ticksFor(arr, tickSeconds)
+        self.softDropTicks = ticksFor(MOVEDOWNFREQ, tickSeconds)
+        self.lockDelayTicks = ticksFor(lockDelay, tickSeconds) if lockDelay > 0 else 0
+        self.timers = TimerQueue()
+        self.board: boardType = getBlankBoard(width, height)
+        self.ticks = 0
+        self.keys = 0
+        self.movingDown = False  # note: there is no movingUp variable
+        self.movingLeft = False
+        self.movingRight = False
+        self.score = 0
+        self.pieces = 0
+        self.level, self.fallFreq = calculateLevelAndFallFreq(self.score)
+        self.gameOver = False
+
+        self.fallingPiece: Opt[pieceType] = makePiece(self.pieceGen.next(), width)
+        self.nextPiece = makePiece(self.pieceGen.next(), width)
+        self.timers.schedule('fall', ticksFor(self.fallFreq, tickSeconds))
+
+    @property
+    def now(self) -> float:
+        return self.ticks * self.tickSeconds
+
+    def previewPieces(self, count: int) -> List[pieceType]:
+        # nextPiece and the count - 1 pieces after it
+        width = self.board.width
+        return [self.nextPiece] + [makePiece(spec, width) for spec in self.pieceGen.peek(count - 1)]
+
+    def spawn(self) -> None:
+        # No falling piece in play, so start a new piece at the top
+        self.fallingPiece = self.nextPiece
+        self.nextPiece = makePiece(self.pieceGen.next(), self.board.width)
+        self.timers.schedule('fall', self.ticks + ticksFor(self.fallFreq, self.tickSeconds))  # reset the fall timer
+        self.timers.cancel('lock')
+        if not isValidPosition(self.board, self.fallingPiece):
+            self.gameOver = True  # can't fit a new piece on the board, so game over
+
+    def step(self, keys: int = 0) -> int:
+        # advance the game by one tick and return the number of lines cleared in it
+        if self.gameOver:
+            return 0
+        if self.fallingPiece is None:
+            self.spawn()
+            if self.gameOver:
+                return 0
+        piece = self.fallingPiece
+        assert piece is not None
+        board = self.board
+        timers = self.timers
+        tick = self.ticks
+        pressed = keys & ~self.keys
+        released = self.keys & ~keys
+        self.keys = keys
+
+        if released:
+            if released & KEY_LEFT:
+                self.movingLeft = False
+            if released & KEY_RIGHT:
+                self.movingRight = False
+            if released & KEY_DOWN:
+                self.movingDown = False
+                timers.cancel('softDrop')
+            if not (self.movingLeft or self.movingRight):
+                timers.cancel('shift')
+
+        if pressed:
+            # moving the piece sideways
+            if pressed & KEY_LEFT and isValidPosition(board, piece, adjX=-1):
+                piece['x'] -= 1
+                self.movingLeft = True
+                self.movingRight = False
+                timers.schedule('shift', tick + self.dasTicks)
+            elif pressed & KEY_RIGHT and isValidPosition(board, piece, adjX=1):
+                piece['x'] += 1
+                self.movingRight = True
+                self.movingLeft = False
+                timers.schedule('shift', tick + self.dasTicks)
+
+            # rotating the piece (if there is room to rotate)
+            if pressed & KEY_ROTATE:
+                self.rotate(1)
+            elif pressed & KEY_ROTATE_BACK:  # rotate the other direction
+                self.rotate(-1)
+
+            # making the piece fall faster with the down key
+            if pressed & KEY_DOWN:
+                self.movingDown = True
+                if isValidPosition(board, piece, adjY=1):
+                    piece['y'] += 1
+                timers.schedule('softDrop', tick + self.softDropTicks)
+
+            # move the current piece all the way down
+            if pressed & KEY_DROP:
+                self.movingDown = False
+                self.movingLeft = False
+                self.movingRight = False
+                timers.cancel('shift')
+                timers.cancel('softDrop')
+                piece['y'] += getDropDistance(board, piece)
+
+        numLines = 0
+        fired = timers.popDue(tick)
+        if fired:
+            # handle moving the piece because of held keys
+            if 'shift' in fired:
+                if self.movingLeft and isValidPosition(board, piece, adjX=-1):
+                    piece['x'] -= 1
+                elif self.movingRight and isValidPosition(board, piece, adjX=1):
+                    piece['x'] += 1
+                timers.schedule('shift', tick + self.arrTicks)
+
+            if 'softDrop' in fired:
+                if isValidPosition(board, piece, adjY=1):
+                    piece['y'] += 1
+                    timers.schedule('softDrop', tick + self.softDropTicks)
+                else:
+                    timers.schedule('softDrop', tick + 1)  # keep trying while the key is held
+
+            # let the piece fall if it is time to fall
+            if 'fall' in fired:
+                # see if the piece has landed
+                if isValidPosition(board, piece, adjY=1):
+                    # piece did not land, just move the piece down
+                    piece['y'] += 1
+                    timers.cancel('lock')
+                    timers.schedule('fall', tick + ticksFor(self.fallFreq, self.tickSeconds))
+                elif not self.lockDelayTicks:
+                    numLines = self.lock()
+                else:
+                    # wait for the lock timer, checking every tick whether it can fall again
+                    if not timers.isPending('lock') and 'lock' not in fired:
+                        timers.schedule('lock', tick + self.lockDelayTicks)
+                    timers.schedule('fall', tick + 1)
+
+            if 'lock' in fired and self.fallingPiece is not None and not isValidPosition(board, piece, adjY=1):
+                numLines = self.lock()
+
+        self.ticks += 1
+        return numLines
+
+    def snapshot(self) -> GameState:
+        # the whole game as an immutable value, see state.py
+        falling = self.fallingPiece
+        nextPiece = self.nextPiece
+        rows, colors = self.board.pack()
+        flags = ((MOVINGDOWN if self.movingDown else 0) | (MOVINGLEFT if self.movingLeft else 0)
+                 | (MOVINGRIGHT if self.movingRight else 0) | (GAMEOVER if self.gameOver else 0))
+        return GameState(self.board.width, self.board.height, self.tickSeconds,
+                         self.dasTicks, self.arrTicks, self.softDropTicks, self.lockDelayTicks,
+                         self.ticks, self.keys, flags, self.score, self.pieces,
+                         PieceState(falling['shape'], falling['rotation'], falling['x'], falling['y'], falling['color'])
+                         if falling is not None else None,
+                         PieceState(nextPiece['shape'], nextPiece['rotation'], nextPiece['x'], nextPiece['y'], nextPiece['color']),
+                         self.timers.pending(), self.pieceGen.policy, *self.pieceGen.getState(), rows, colors)
+
+    def restore(self, state: GameState) -> None:
+        # put the game back the way it was when state was taken
+        self.tickSeconds = state.tickSeconds
+        self.dasTicks, self.arrTicks = state.dasTicks, state.arrTicks
+        self.softDropTicks, self.lockDelayTicks = state.softDropTicks, state.lockDelayTicks
+        self.ticks = state.ticks
+        self.keys = state.keys
+        flags = state.flags
+        self.movingDown = bool(flags & MOVINGDOWN)
+        self.movingLeft = bool(flags & MOVINGLEFT)
+        self.movingRight = bool(flags & MOVINGRIGHT)
+        self.gameOver = bool(flags & GAMEOVER)
+        self.score = state.score
+        self.pieces = state.pieces
+        self.level, self.fallFreq = calculateLevelAndFallFreq(self.score)
+        self.fallingPiece = pieceFromState(state.fallingPiece) if state.fallingPiece is not None else None
+        self.nextPiece = pieceFromState(state.nextPiece)
+        self.timers.load(state.timers)
+        self.pieceGen.policy = state.policy
+        self.pieceGen.setState(state.rngState, state.queue)
+        self.board = state.board()
+
+    @classmethod
+    def fromSnapshot(cls, state: GameState) -> 'TetrisSim':
+        sim = cls(tickSeconds=state.tickSeconds, width=state.width, height=state.height, policy=state.policy)
+        sim.restore(state)
+        return sim
+
+    def rotate(self, direction: int) -> bool:
+        piece = self.fallingPiece
+        assert piece is not None
+        numRotations = len(SHAPES[piece['shape']])
+        piece['rotation'] = (piece['rotation'] + direction) % numRotations
+        if not isValidPosition(self.board, piece):
+            piece['rotation'] = (piece['rotation'] - direction) % numRotations
+            return False
+        return True
+
+    def lock(self) -> int:
+        # falling piece has landed, set it on the board
+        assert self.fallingPiece is not None
+        self.timers.cancel('lock')
+        piece = self.fallingPiece
+        addToBoard(self.board, piece)
+        rowMasks = SHAPES[piece['shape']][piece['rotation']].rowMasks
+        # only the rows the piece landed in can have filled up
+        numLines = removeCompleteLines(self.board, piece['y'] + rowMasks[0][0], piece['y'] + rowMasks[-1][0] + 1)
+        self.score += numLines
+        self.pieces += 1
+        self.level, self.fallFreq = calculateLevelAndFallFreq(self.score)
+        self.fallingPiece = None
+        return numLines
+
+    def place(self, rotation: int, x: int, y: int) -> int:
+        # move the falling piece straight to a resting position and lock it, for bots that play
+        # placement by placement instead of tick by tick. Spawns the next piece, returns the lines cleared.
+        piece = self.fallingPiece
+        assert piece is not None
+        piece['rotation'], piece['x'], piece['y'] = rotation, x, y
+        numLines = self.lock()
+        self.spawn()
+        return numLines
+
+    def run(self, keys: int = 0, maxTicks: int = 1_000_000) -> int:
+        # step with the same held keys until the game ends, return the number of ticks played
+        start = self.ticks
+        while not self.gameOver and self.ticks - start < maxTicks:
+            self.step(keys)
+        return self.ticks - start
@@ -0,0 +1,133 @@
+import struct
+from array import array
+
+from typing import Any, NamedTuple, Optional as Opt, Tuple
+
+from .bitboard import BitBoard
+from .shapes import SHAPENAMES
+from .generator import POLICIES, specType
+
+# Immutable snapshots of a TetrisSim, from TetrisSim.snapshot() and back with
+# TetrisSim.restore(). A GameState is a tuple of ints, bytes and small tuples,
+# so it copies by reference, compares by value, and can be used as a dict key
+# (search, undo, rollback netcode). toBytes()/fromBytes() pack it with struct
+# and array, without a Python object per board cell.
+# Byte layout (little endian):
+#   FIXED     the scalar fields below, then the number of pending timers,
+#             the piece policy (index into POLICIES) and the number of queued pieces
+#   pieces    falling piece (if the hasFalling flag is set) and next piece, PIECE each
+#   timers    TIMER each: index into TIMERNAMES, due tick
+#   queue     SPEC each: the PieceGenerator's queued (shape, rotation, colour) specs
+#   rng       version (B), has gauss (B), gauss (d), MT state (625 x I)
+#   board     colours, width * height bytes; the row masks are rebuilt from them
+
+FIXED = struct.Struct('<IIdIIIIqBBIIBBI')
+PIECE = struct.Struct('<BBiiB')
+SPEC = struct.Struct('<BBB')
+TIMER = struct.Struct('<Bq')
+RNGHEADER = struct.Struct('<BBd')
+TIMERNAMES = ('fall', 'shift', 'softDrop', 'lock')
+
+# flag bits
+MOVINGDOWN = 1
+MOVINGLEFT = 2
+MOVINGRIGHT = 4
+GAMEOVER = 8
+HASFALLING = 16
+
+
+class PieceState(NamedTuple):
+    shape: str
+    rotation: int
+    x: int
+    y: int
+    color: int
+
+
+class GameState(NamedTuple):
+    width: int
+    height: int
+    tickSeconds: float
+    dasTicks: int
+    arrTicks: int
+    softDropTicks: int
+    lockDelayTicks: int
+    ticks: int
+    keys: int
+    flags: int  # MOVINGDOWN | MOVINGLEFT | MOVINGRIGHT | GAMEOVER bits, HASFALLING is only used in bytes
+    score: int
+    pieces: int
+    fallingPiece: Opt[PieceState]
+    nextPiece: PieceState
+    timers: Tuple[Tuple[str, int], ...]  # (name, due tick) in firing order
+    policy: str  # PieceGenerator policy
+    rngState: Tuple[Any, ...]  # the PieceGenerator's random.Random.getstate()
+    queue: Tuple[specType, ...]  # the PieceGenerator's queued pieces
+    rows: Tuple[int, ...]  # BitBoard row masks
+    colors: bytes  # BitBoard colours, row after row
+
+    def __hash__(self) -> int:
+        # a hash of the small fields and the colour bytes, which cache their own hash. The rows
+        # follow from the colours and the 625 int MT state is left out, equal states still hash equal.
+        return hash((self.ticks, self.keys, self.flags, self.score, self.pieces, self.fallingPiece,
+                     self.nextPiece, self.timers, self.rngState[1][-1], self.colors))
+
+    def board(self) -> BitBoard:
+        return BitBoard.unpack(self.width, self.height, self.colors, self.rows)
+
+    def toBytes(self) -> bytes:
+        flags = self.flags | (HASFALLING if self.fallingPiece is not None else 0)
+        parts = [FIXED.pack(self.width, self.height, self.tickSeconds, self.dasTicks, self.arrTicks,
+                            self.softDropTicks, self.lockDelayTicks, self.ticks, self.keys, flags,
+                            self.score, self.pieces, len(self.timers), POLICIES.index(self.policy), len(self.queue))]
+        for piece in (self.fallingPiece, self.nextPiece):
+            if piece is not None:
+                parts.append(PIECE.pack(SHAPENAMES.index(piece.shape), piece.rotation, piece.x, piece.y, piece.color))
+        for name, due in self.timers:
+            parts.append(TIMER.pack(TIMERNAMES.index(name), due))
+        parts += [SPEC.pack(SHAPENAMES.index(shape), rotation, color) for shape, rotation, color in self.queue]
+        version, mt, gauss = self.rngState
+        parts.append(RNGHEADER.pack(version, gauss is not None, gauss or 0.0))
+        parts.append(array('I', mt).tobytes())
+        parts.append(self.colors)
+        return b''.join(parts)
+
+    @classmethod
+    def fromBytes(cls, data: bytes) -> 'GameState':
+        (width, height, tickSeconds, dasTicks, arrTicks, softDropTicks, lockDelayTicks,
+         ticks, keys, flags, score, pieces, numTimers, policy, numQueued) = FIXED.unpack_from(data, 0)
+        offset = FIXED.size
+        fallingPiece = None
+        if flags & HASFALLING:
+            fallingPiece = unpackPiece(data, offset)
+            offset += PIECE.size
+        nextPiece = unpackPiece(data, offset)
+        offset += PIECE.size
+        timers = []
+        for _ in range(numTimers):
+            index, due = TIMER.unpack_from(data, offset)
+            timers.append((TIMERNAMES[index], due))
+            offset += TIMER.size
+        queue = []
+        for _ in range(numQueued):
+            shape, rotation, color = SPEC.unpack_from(data, offset)
+            queue.append((SHAPENAMES[shape], rotation, color))
+            offset += SPEC.size
+        version, hasGauss, gauss = RNGHEADER.unpack_from(data, offset)
+        offset += RNGHEADER.size
+        mt = array('I')
+        mt.frombytes(data[offset:offset + 625 * mt.itemsize])
+        offset += 625 * mt.itemsize
+        colors = bytes(data[offset:offset + width * height])
+        if len(colors) != width * height:
+            raise ValueError('truncated tetris game state')
+        board = BitBoard.unpack(width, height, colors)
+        return cls(width, height, tickSeconds, dasTicks, arrTicks, softDropTicks, lockDelayTicks,
+                   ticks, keys, flags & ~HASFALLING, score, pieces, fallingPiece, nextPiece, tuple(timers),
+                   POLICIES[policy], (version, tuple(mt), gauss if hasGauss else None), tuple(queue),
+                   tuple(board.rows), colors)
+
+
+def unpackPiece(data: bytes, offset: int) -> PieceState:
+    shape, rotation, x, y, color = PIECE.unpack_from(data, offset)
+    return PieceState(SHAPENAMES[shape], rotation, x, y, color)
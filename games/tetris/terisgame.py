@@ -1,39 +1,57 @@
+import argparse
 import random
+from collections import OrderedDict
 import time
 import pygame
 import sys
+from pathlib import Path
 from pygame.locals import (KEYUP, KEYDOWN, QUIT,
                            K_UP, K_DOWN, K_LEFT, K_RIGHT, K_ESCAPE,
-                           K_d, K_s, K_q, K_SPACE, K_w, K_p, K_a,
+                           K_d, K_s, K_q, K_SPACE, K_w, K_p, K_a, K_F3,
                            )
 
-from typing import Union, List, Tuple, Dict, Optional as Opt
-from mypy_extensions import TypedDict
-boardType = List[List[Union[str, int]]]  # each staure can be BLANK: str ot piece.colour: int
-pieceType = TypedDict('pieceType', {'shape': str,  # shape is str, key to SHAPES
-                                    'rotation': int,
-                                    'x': int,
-                                    'y': int,
-                                    'color': int})
+from typing import Union, Dict, List, Set, Tuple, Optional as Opt
 
+from .bitboard import BitBoard
+from .shapes import (BLANK, TEMPLATEWIDTH, TEMPLATEHEIGHT, PIECES, SHAPES, SHAPENAMES,
+                     S_SHAPE_TEMPLATE, Z_SHAPE_TEMPLATE, I_SHAPE_TEMPLATE, O_SHAPE_TEMPLATE,
+                     J_SHAPE_TEMPLATE, L_SHAPE_TEMPLATE, T_SHAPE_TEMPLATE)
+from .simulation import (boardType, pieceType, TetrisSim,
+                         BOARDWIDTH, BOARDHEIGHT, NUMCOLORS, MOVESIDEWAYSFREQ, MOVEDOWNFREQ,
+                         KEY_LEFT, KEY_RIGHT, KEY_DOWN, KEY_ROTATE, KEY_ROTATE_BACK, KEY_DROP,
+                         calculateLevelAndFallFreq, getNewPiece, addToBoard, getBlankBoard, isOnBoard,
+                         isValidPosition, getDropDistance, isCompleteLine, removeCompleteLines)
+from .bot import TetrisBot, BotController
+from .replay import ReplayReader, ReplayWriter
+from .scheduler import FixedTimestep
+from .profiler import FrameProfiler, FRAME
+
+
+GAMEDIR = Path(__file__).resolve().parent
 
 FPSCLOCK: pygame.time.Clock
 DISPLAYSURF: pygame.Surface
 BASICFONT: pygame.font.Font
 BIGFONT: pygame.font.Font
+SMALLFONT: pygame.font.Font
+RENDERCACHE: 'RenderCache'
+VIEWPORT: 'Viewport'
+PROFILER: Opt[FrameProfiler] = None  # set to time the phases of the game loop, F3 shows them
 
 
-FPS = 25
+FPS = 25  # frames drawn per second
+TICKRATE = 250  # simulation ticks per second, input is handled within one tick (4 ms)
 WINDOWWIDTH = 640
 WINDOWHEIGHT = 480
 BOXSIZE = 20
-BOARDWIDTH = 10
-BOARDHEIGHT = 20
-BLANK = '.'
 
-MOVESIDEWAYSFREQ = 0.15
-MOVEDOWNFREQ = 0.1
+MAXVIEWCOLS = 16  # bigger boards are shown through a scrolling viewport of at most this many cells
+MAXVIEWROWS = BOARDHEIGHT
+SCROLLMARGIN = 3  # cells kept between the falling piece and the edge of a scrolling viewport
+OVERLAYRECT = (5, 5, 150, 150)  # where the profiler overlay goes, left of the board
+OVERLAYREFRESH = 10  # frames between overlay updates
 
+# margins for the default board, Viewport works them out for other sizes
 XMARGIN = int((WINDOWWIDTH - BOARDWIDTH * BOXSIZE) / 2)
 TOPMARGIN = WINDOWHEIGHT - (BOARDHEIGHT * BOXSIZE) - 5
 
@@ -57,266 +75,182 @@ TEXTSHADOWCOLOR = GRAY
 COLORS = (BLUE, GREEN, RED, YELLOW)
 LIGHTCOLORS = (LIGHTBLUE, LIGHTGREEN, LIGHTRED, LIGHTYELLOW)
 assert len(COLORS) == len(LIGHTCOLORS)  # each color must have light color
+assert len(COLORS) == NUMCOLORS
+
+KEYMAP: Dict[int, int] = {K_LEFT: KEY_LEFT, K_a: KEY_LEFT,
+                          K_RIGHT: KEY_RIGHT, K_d: KEY_RIGHT,
+                          K_DOWN: KEY_DOWN, K_s: KEY_DOWN,
+                          K_UP: KEY_ROTATE, K_w: KEY_ROTATE,
+                          K_q: KEY_ROTATE_BACK,
+                          K_SPACE: KEY_DROP}
+
 
-TEMPLATEWIDTH = 5
-TEMPLATEHEIGHT = 5
-
-# shape templates for vertical or horizontal rotations
-S_SHAPE_TEMPLATE = [['.....',
-                     '.....',
-                     '..OO.',
-                     '.OO..',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..OO.',
-                     '...O.',
-                     '.....']]
-
-Z_SHAPE_TEMPLATE = [['.....',
-                     '.....',
-                     '.OO..',
-                     '..OO.',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '.OO..',
-                     '.O...',
-                     '.....']]
-
-I_SHAPE_TEMPLATE = [['..O..',
-                     '..O..',
-                     '..O..',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     'OOOO.',
-                     '.....',
-                     '.....']]
-
-O_SHAPE_TEMPLATE = [['.....',
-                     '.....',
-                     '.OO..',
-                     '.OO..',
-                     '.....']]
-
-J_SHAPE_TEMPLATE = [['.....',
-                     '.O...',
-                     '.OOO.',
-                     '.....',
-                     '.....'],
-                    ['.....',
-                     '..OO.',
-                     '..O..',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     '.OOO.',
-                     '...O.',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..O..',
-                     '.OO..',
-                     '.....']]
-
-L_SHAPE_TEMPLATE = [['.....',
-                     '...O.',
-                     '.OOO.',
-                     '.....',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..O..',
-                     '..OO.',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     '.OOO.',
-                     '.O...',
-                     '.....'],
-                    ['.....',
-                     '.OO..',
-                     '..O..',
-                     '..O..',
-                     '.....']]
-
-T_SHAPE_TEMPLATE = [['.....',
-                     '..O..',
-                     '.OOO.',
-                     '.....',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..OO.',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     '.OOO.',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '.OO..',
-                     '..O..',
-                     '.....']]
-
-PIECES: Dict[str, List[List[str]]] = {'S': S_SHAPE_TEMPLATE,
-                                      'Z': Z_SHAPE_TEMPLATE,
-                                      'J': J_SHAPE_TEMPLATE,
-                                      'L': L_SHAPE_TEMPLATE,
-                                      'I': I_SHAPE_TEMPLATE,
-                                      'O': O_SHAPE_TEMPLATE,
-                                      'T': T_SHAPE_TEMPLATE}
-
-
-def main() -> None:
-    global FPSCLOCK, DISPLAYSURF, BASICFONT, BIGFONT
+def initDisplay() -> None:
+    global FPSCLOCK, DISPLAYSURF, BASICFONT, BIGFONT, SMALLFONT
     pygame.init()
     FPSCLOCK = pygame.time.Clock()
     DISPLAYSURF = pygame.display.set_mode((WINDOWWIDTH, WINDOWHEIGHT))
     BASICFONT = pygame.font.Font('freesansbold.ttf', 18)
     BIGFONT = pygame.font.Font('freesansbold.ttf', 100)
+    SMALLFONT = pygame.font.Font('freesansbold.ttf', 12)
     pygame.display.set_caption('Tetromino')
+    setBoardSize(BOARDWIDTH, BOARDHEIGHT)
 
-    showTextScreen('Tetromino')
-    while True:  # game loop
-        if random.randint(0, 1) == 0:
-            pygame.mixer.music.load('tetrisb.mid')
-        else:
-            pygame.mixer.music.load('tetrisc.mid')
-        pygame.mixer.music.play(-1, 0.0)
-        runGame()
-        pygame.mixer.music.stop()
-        showTextScreen('Game Over')
 
+def setBoardSize(width: int, height: int) -> None:
+    # lay the screen out for a board of this size, the background depends on the viewport
+    global VIEWPORT, RENDERCACHE
+    VIEWPORT = Viewport(width, height)
+    RENDERCACHE = RenderCache()
 
-def runGame() -> None:
-    # setup variables for the start of the game
-    board: boardType = getBlankBoard()
-    lastMoveDownTime = time.time()
-    lastMoveSidewaysTime = time.time()
-    lastFallTime = time.time()
-    movingDown = False  # note: there is no movingUp variable
-    movingLeft = False
-    movingRight = False
-    score = 0
-    level, fallFreq = calculateLevelAndFallFreq(score)
 
-    fallingPiece: Opt[pieceType] = getNewPiece()
-    nextPiece = getNewPiece()
+def main(bot: Opt[TetrisBot] = None, recordDir: Opt[Path] = None,
+         width: int = BOARDWIDTH, height: int = BOARDHEIGHT, policy: str = 'uniform') -> None:
+    initDisplay()
+    showTextScreen('Tetromino')
+    try:
+        while True:  # game loop
+            if random.randint(0, 1) == 0:
+                pygame.mixer.music.load(str(GAMEDIR / 'tetrisb.mid'))
+            else:
+                pygame.mixer.music.load(str(GAMEDIR / 'tetrisc.mid'))
+            pygame.mixer.music.play(-1, 0.0)
+            replayPath = recordDir / f'tetris-{time.strftime("%Y%m%d-%H%M%S")}.ttr' if recordDir is not None else None
+            runGame(bot, replayPath, width, height, policy)
+            pygame.mixer.music.stop()
+            showTextScreen('Game Over')
+    finally:
+        if PROFILER is not None:
+            PROFILER.export()  # terminate() exits through here too
+
+
+def watchReplay(path: Path, speed: float = 1.0) -> None:
+    initDisplay()
+    try:
+        playReplay(path, speed)
+        showTextScreen('Game Over')
+    finally:
+        if PROFILER is not None:
+            PROFILER.export()  # the same exit path as main()
+
+
+def runGame(bot: Opt[TetrisBot] = None, replayPath: Opt[Path] = None,
+            width: int = BOARDWIDTH, height: int = BOARDHEIGHT, policy: str = 'uniform') -> None:
+    # setup the simulation for the start of the game.
+    # If a bot is given it plays instead of the keyboard, with a replayPath the game is recorded there.
+    seed = random.randrange(2 ** 63)
+    sim = TetrisSim(seed=seed, tickSeconds=1 / TICKRATE, width=width, height=height, policy=policy)
+    setBoardSize(width, height)
+    controller = BotController(bot) if bot is not None else None
+    recorder = ReplayWriter(str(replayPath), seed, sim.tickSeconds, width, height, policy) if replayPath is not None else None
+    try:
+        playTicks(sim, controller, recorder)
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+
+def playTicks(sim: TetrisSim, controller: Opt[BotController], recorder: Opt[ReplayWriter]) -> None:
+    # Input is polled every loop iteration, the simulation runs a whole number of fixed
+    # ticks for the wall clock time that passed and the screen is redrawn at FPS.
+    # With PROFILER set every phase is timed; a profiler frame is everything between two drawn frames.
+    heldKeys = 0  # KEY_* bits of the keys that are down right now
+    tappedKeys = 0  # keys pressed since the last tick, so a tap released before the tick still counts
+    renderer = DirtyRenderer()
+    timestep = FixedTimestep(sim.tickSeconds, 1 / FPS)
+    prof = PROFILER
+    if prof:
+        prof.skip()
 
     while True:  # game loop
-        if fallingPiece is None:
-            # No falling piece in play, so start a new piece at the top
-            fallingPiece = nextPiece
-            nextPiece = getNewPiece()
-            lastFallTime = time.time()  # reset lastFallTime
-
-            if not isValidPosition(board, fallingPiece):
+        checkForQuit()
+        for event in pygame.event.get():  # event handling loop
+            if event.type == KEYUP:
+                if (event.key == K_p):
+                    # Pausing the game, the simulation does not advance while paused
+                    DISPLAYSURF.fill(BGCOLOR)
+                    pygame.mixer.music.stop()
+                    showTextScreen('Paused')  # pause until a key press
+                    pygame.mixer.music.play(-1, 0.0)
+                    renderer.invalidate()
+                    timestep.reset()
+                    if prof:
+                        prof.skip()
+                elif event.key == K_F3 and prof:
+                    prof.showOverlay = not prof.showOverlay
+                    renderer.invalidate()
+                heldKeys &= ~KEYMAP.get(event.key, 0)
+            elif event.type == KEYDOWN:
+                heldKeys |= KEYMAP.get(event.key, 0)
+                tappedKeys |= KEYMAP.get(event.key, 0)
+        if prof:
+            prof.lap('events')
+
+        for _ in range(timestep.ticksDue()):
+            keys = controller.nextKeys(sim) if controller is not None else heldKeys | tappedKeys
+            tappedKeys = 0
+            sim.step(keys)
+            if recorder is not None:
+                recorder.record(keys)
+            if sim.gameOver:
                 return  # can't fit a new piece on the board, so game over
-        else:
+        if prof:
+            prof.lap('sim')
+
+        if timestep.frameDue():
+            rects = renderer.draw(sim)
+            pygame.display.update(rects)
+            if prof:
+                prof.lap('display')
+                prof.endFrame()
+        timestep.wait()
+        if prof:
+            prof.lap('wait')
+
+
+def playReplay(path: Path, speed: float = 1.0) -> TetrisSim:
+    # render a recorded game at speed times real time. Fast speeds step several ticks per drawn frame.
+    reader = ReplayReader(str(path))
+    sim = reader.newSim()
+    setBoardSize(reader.width, reader.height)
+    ticksPerFrame = speed / (FPS * sim.tickSeconds)
+    renderer = DirtyRenderer()
+    due = 0.0
+    prof = PROFILER
+    if prof:
+        prof.skip()
+    for keys in reader.ticks():
+        sim.step(keys)
+        due += 1
+        if due >= ticksPerFrame:
+            due -= ticksPerFrame
+            if prof:
+                prof.lap('sim')
             checkForQuit()
-            for event in pygame.event.get():  # event handling loop
-                if event.type == KEYUP:
-                    if (event.key == K_p):
-                        # Pausing the game
-                        DISPLAYSURF.fill(BGCOLOR)
-                        pygame.mixer.music.stop()
-                        showTextScreen('Paused')  # pause until a key press
-                        pygame.mixer.music.play(-1, 0.0)
-                        lastFallTime = time.time()
-                        lastMoveDownTime = time.time()
-                        lastMoveSidewaysTime = time.time()
-                    elif (event.key == K_LEFT or event.key == K_a):
-                        movingLeft = False
-                    elif (event.key == K_RIGHT or event.key == K_d):
-                        movingRight = False
-                    elif (event.key == K_DOWN or event.key == K_s):
-                        movingDown = False
-
-                elif event.type == KEYDOWN:
-                    # moving the piece sideways
-                    if (event.key == K_LEFT or event.key == K_a):
-                        if isValidPosition(board, fallingPiece, adjX=-1):
-                            fallingPiece['x'] -= 1
-                            movingLeft = True
-                            movingRight = False
-                            lastMoveSidewaysTime = time.time()
-
-                    elif (event.key == K_RIGHT or event.key == K_d):
-                        if isValidPosition(board, fallingPiece, adjX=1):
-                            fallingPiece['x'] += 1
-                            movingRight = True
-                            movingLeft = False
-                            lastMoveSidewaysTime = time.time()
-
-                    # rotating the piece (if there is room to rotate)
-                    elif (event.key == K_UP or event.key == K_w):
-                        fallingPiece['rotation'] = (fallingPiece['rotation'] + 1) % len(PIECES[fallingPiece['shape']])
-                        if not isValidPosition(board, fallingPiece):
-                            fallingPiece['rotation'] = (fallingPiece['rotation'] - 1) % len(PIECES[fallingPiece['shape']])
-                    elif (event.key == K_q):  # rotate the other direction
-                        fallingPiece['rotation'] = (fallingPiece['rotation'] - 1) % len(PIECES[fallingPiece['shape']])
-                        if not isValidPosition(board, fallingPiece):
-                            fallingPiece['rotation'] = (fallingPiece['rotation'] + 1) % len(PIECES[fallingPiece['shape']])
-
-                    # making the piece fall faster with the down key
-                    elif (event.key == K_DOWN or event.key == K_s):
-                        movingDown = True
-                        if isValidPosition(board, fallingPiece, adjY=1):
-                            fallingPiece['y'] += 1
-                        lastMoveDownTime = time.time()
-
-                    # move the current piece all the way down
-                    elif event.key == K_SPACE:
-                        movingDown = False
-                        movingLeft = False
-                        movingRight = False
-                        for i in range(1, BOARDHEIGHT):
-                            if not isValidPosition(board, fallingPiece, adjY=i):
-                                break
-                        fallingPiece['y'] += i - 1
-
-            # handle moving the piece because of user input
-            if (movingLeft or movingRight) and time.time() - lastMoveSidewaysTime > MOVESIDEWAYSFREQ:
-                if movingLeft and isValidPosition(board, fallingPiece, adjX=-1):
-                    fallingPiece['x'] -= 1
-                elif movingRight and isValidPosition(board, fallingPiece, adjX=1):
-                    fallingPiece['x'] += 1
-                lastMoveSidewaysTime = time.time()
-
-            if movingDown and time.time() - lastMoveDownTime > MOVEDOWNFREQ and isValidPosition(board, fallingPiece, adjY=1):
-                fallingPiece['y'] += 1
-                lastMoveDownTime = time.time()
-
-            # let the piece fall if it is time to fall
-            if time.time() - lastFallTime > fallFreq:
-                # see if the piece has landed
-                if not isValidPosition(board, fallingPiece, adjY=1):
-                    # falling piece has landed, set it on the board
-                    addToBoard(board, fallingPiece)
-                    score += removeCompleteLines(board)
-                    level, fallFreq = calculateLevelAndFallFreq(score)
-                    fallingPiece = None
-                else:
-                    # piece did not land, just move the piece down
-                    fallingPiece['y'] += 1
-                    lastFallTime = time.time()
-
-            # drawing everything on the screen
-            DISPLAYSURF.fill(BGCOLOR)
-            drawBoard(board)
-            drawStatus(score, level)
-            drawNextPiece(nextPiece)
-            if fallingPiece is not None:
-                drawPiece(fallingPiece)
-
-            pygame.display.update()
+            pygame.event.pump()
+            if prof:
+                prof.lap('events')
+            pygame.display.update(renderer.draw(sim))
+            if prof:
+                prof.lap('display')
+                prof.endFrame()
             FPSCLOCK.tick(FPS)
+            if prof:
+                prof.lap('wait')
+    drawGame(sim)
+    pygame.display.update()
+    return sim
+
+
+def drawGame(sim: TetrisSim) -> None:
+    # drawing everything on the screen, the border, board background and labels come with the background
+    VIEWPORT.follow(sim.fallingPiece)
+    DISPLAYSURF.blit(RENDERCACHE.background, (0, 0))
+    drawBoard(sim.board)
+    drawStatus(sim.score, sim.level)
+    drawNextPiece(sim.nextPiece)
+    if sim.fallingPiece is not None:
+        drawPiece(sim.fallingPiece)
 
 
 def makeTextObjs(text: str, font: pygame.font.Font, color: Tuple[int, int, int]) -> Tuple[pygame.Surface, pygame.Rect]:
@@ -373,93 +307,229 @@ def checkForQuit() -> None:
         pygame.event.post(event)  # put the other KEYUP event objects back
 
 
-def calculateLevelAndFallFreq(score: int) -> Tuple[int, float]:
-    # Based on the score, return the level the player is on and
-    # how many seconds pass until a falling piece falls one space.
-    level = int(score / 10) + 1
-    fallFreq = 0.27 - (level * 0.02)
-    return (level, fallFreq)
-
-
-def getNewPiece() -> pieceType:
-    # return a random new piece in a random rotation and color
-    shape = random.choice(list(PIECES.keys()))
-    newPiece: pieceType = {'shape': shape,
-                           'rotation': random.randint(0, len(PIECES[shape]) - 1),
-                           'x': int(BOARDWIDTH / 2) - int(TEMPLATEWIDTH / 2),
-                           'y': -2,  # start it above the board (i.e. less than 0)
-                           'color': random.randint(0, len(COLORS) - 1)}
-    return newPiece
-
-
-def addToBoard(board: boardType, piece: pieceType) -> None:
-    # fill in the board based on piece's location, shape, and rotation
-    for x in range(TEMPLATEWIDTH):
-        for y in range(TEMPLATEHEIGHT):
-            if PIECES[piece['shape']][piece['rotation']][y][x] != BLANK:
-                board[x + piece['x']][y + piece['y']] = piece['color']
-
-
-def getBlankBoard() -> boardType:
-    # create and return a new blank board data structure
-    board: boardType = []
-    for i in range(BOARDWIDTH):
-        board.append([BLANK] * BOARDHEIGHT)
-    return board
-
-
-def isOnBoard(x: int, y: int) -> bool:
-    return x >= 0 and x < BOARDWIDTH and y < BOARDHEIGHT
-
-
-def isValidPosition(board: boardType, piece: pieceType, adjX: int = 0, adjY: int = 0) -> bool:
-    # Return True if the piece is within the board and not colliding
-    for x in range(TEMPLATEWIDTH):
-        for y in range(TEMPLATEHEIGHT):
-            isAboveBoard = y + piece['y'] + adjY < 0
-            if isAboveBoard or PIECES[piece['shape']][piece['rotation']][y][x] == BLANK:
-                continue
-            if not isOnBoard(x + piece['x'] + adjX, y + piece['y'] + adjY):
-                return False
-            if board[x + piece['x'] + adjX][y + piece['y'] + adjY] != BLANK:
-                return False
-    return True
-
-
-def isCompleteLine(board: boardType, y: int) -> bool:
-    # Return True if the line filled with boxes with no gaps.
-    for x in range(BOARDWIDTH):
-        if board[x][y] == BLANK:
+class Viewport():
+    # The part of the board that is on screen. Boards up to MAXVIEWCOLS x MAXVIEWROWS are
+    # shown whole and centred; bigger ones scroll (left, top) to keep the falling piece in view.
+
+    def __init__(self, boardWidth: int, boardHeight: int) -> None:
+        self.boardWidth = boardWidth
+        self.boardHeight = boardHeight
+        self.cols = min(boardWidth, MAXVIEWCOLS)
+        self.rows = min(boardHeight, MAXVIEWROWS)
+        self.xMargin = int((WINDOWWIDTH - self.cols * BOXSIZE) / 2)
+        self.topMargin = WINDOWHEIGHT - (self.rows * BOXSIZE) - 5
+        self.left = 0
+        self.top = 0
+        self.scrolls = self.cols < boardWidth or self.rows < boardHeight
+
+    def follow(self, piece: Opt[pieceType]) -> bool:
+        # scroll so the piece is in view, return True if the view moved
+        if piece is None or not self.scrolls:
             return False
-    return True
-
-
-def removeCompleteLines(board: boardType) -> int:
-    # Remove any completed lines on the board, move everything above them down, and return the number of complete lines.
-    numLinesRemoved = 0
-    y = BOARDHEIGHT - 1  # start y at the bottom of the board
-    while y >= 0:
-        if isCompleteLine(board, y):
-            # Remove the line and pull boxes down by one line.
-            for pullDownY in range(y, 0, -1):
-                for x in range(BOARDWIDTH):
-                    board[x][pullDownY] = board[x][pullDownY - 1]
-            # Set very top line to blank.
-            for x in range(BOARDWIDTH):
-                board[x][0] = BLANK
-            numLinesRemoved += 1
-            # Note on the next iteration of the loop, y is the same.
-            # This is so that if the line that was pulled down is also
-            # complete, it will be removed.
+        minX, minY, maxX, maxY = SHAPES[piece['shape']][piece['rotation']].bbox
+        left = scrollTo(self.left, piece['x'] + minX, piece['x'] + maxX, self.cols, self.boardWidth)
+        top = scrollTo(self.top, piece['y'] + minY, piece['y'] + maxY, self.rows, self.boardHeight)
+        if (left, top) == (self.left, self.top):
+            return False
+        self.left, self.top = left, top
+        return True
+
+    def isVisible(self, boxx: int, boxy: int) -> bool:
+        # cells above the board are drawn above the border while the top of the board is in view
+        return (self.left <= boxx < self.left + self.cols and boxy < self.top + self.rows
+                and (boxy >= self.top or self.top == 0))
+
+
+def scrollTo(start: int, low: int, high: int, size: int, total: int) -> int:
+    # the start of a window of size cells (out of total) that keeps low..high SCROLLMARGIN cells from its edges
+    margin = min(SCROLLMARGIN, (size - 1) // 2)
+    if low < start + margin:
+        start = low - margin
+    elif high >= start + size - margin:
+        start = high - size + margin + 1
+    return max(0, min(start, total - size))
+
+
+class RenderCache():
+    # Surfaces that never change during a game: one pre-rendered block per colour,
+    # the background with the board border and labels already drawn on it,
+    # and rendered text keyed by (font, text, colour).
+
+    def __init__(self, maxTexts: int = 256) -> None:
+        self.blocks: List[pygame.Surface] = []
+        for color, lightColor in zip(COLORS, LIGHTCOLORS):
+            block = pygame.Surface((BOXSIZE - 1, BOXSIZE - 1)).convert()
+            block.fill(color)
+            pygame.draw.rect(block, lightColor, (0, 0, BOXSIZE - 4, BOXSIZE - 4))
+            self.blocks.append(block)
+
+        self.maxTexts = maxTexts
+        self.texts: 'OrderedDict[Tuple[int, str, Tuple[int, int, int]], pygame.Surface]' = OrderedDict()
+
+        self.background = pygame.Surface((WINDOWWIDTH, WINDOWHEIGHT)).convert()
+        self.background.fill(BGCOLOR)
+        # draw the border around the board
+        view = VIEWPORT
+        pygame.draw.rect(self.background, BORDERCOLOR,
+                         (view.xMargin - 3, view.topMargin - 7, (view.cols * BOXSIZE) + 8, (view.rows * BOXSIZE) + 8), 5)
+        # draw the "next" text
+        self.background.blit(self.text(BASICFONT, 'Next:', TEXTCOLOR), (WINDOWWIDTH - 120, 80))
+
+    def text(self, font: pygame.font.Font, text: str, color: Tuple[int, int, int]) -> pygame.Surface:
+        key = (id(font), text, color)
+        surf = self.texts.get(key)
+        if surf is None:
+            surf = font.render(text, True, color)
+            self.texts[key] = surf
+            if len(self.texts) > self.maxTexts:
+                self.texts.popitem(last=False)
         else:
-            y -= 1  # move on to check next row up
-    return numLinesRemoved
+            self.texts.move_to_end(key)
+        return surf
+
+
+class DirtyRenderer():
+    # Draws a TetrisSim frame by frame, repainting only the board cells, falling piece,
+    # next piece and status text that changed since the previous frame. draw() returns
+    # the changed rects for pygame.display.update(), an empty list when nothing moved.
+    # Only cells in VIEWPORT are compared, scrolling it repaints everything.
+
+    def __init__(self) -> None:
+        self.boardColors: List[bytes] = []
+        self.pieceCells: Dict[Tuple[int, int], int] = {}
+        self.status: Tuple[int, int] = (-1, -1)
+        self.statusRects: List[pygame.Rect] = []
+        self.nextPiece: Opt[Tuple[str, int, int]] = None
+        self.overlayAge = 0  # frames since the profiler overlay was drawn
+        self.fullRedraw = True
+
+    def invalidate(self) -> None:
+        # repaint everything on the next draw(), e.g. after something else drew over the screen
+        self.fullRedraw = True
+
+    def draw(self, sim: TetrisSim) -> List[pygame.Rect]:
+        board = sim.board
+        view = VIEWPORT
+        prof = PROFILER
+        if view.follow(sim.fallingPiece):
+            self.fullRedraw = True
+        pieceCells = getPieceCells(sim.fallingPiece)
+        if view.scrolls:
+            pieceCells = {k: c for k, c in pieceCells.items() if view.isVisible(*k)}
+        left, top = view.left, view.top
+        right = left + view.cols
+        visibleRows = range(top, top + view.rows)
+        status = (sim.score, sim.level)
+        nextPiece = (sim.nextPiece['shape'], sim.nextPiece['rotation'], sim.nextPiece['color'])
+        if self.fullRedraw:
+            DISPLAYSURF.blit(RENDERCACHE.background, (0, 0))
+            drawBoard(board)
+            if sim.fallingPiece is not None:
+                drawPiece(sim.fallingPiece)
+            if prof:
+                prof.lap('board')
+            self.statusRects = drawStatus(*status)
+            if prof:
+                prof.lap('text')
+            drawNextPiece(sim.nextPiece)
+            self.boardColors = [bytes(board.colors[y][left:right]) for y in visibleRows]
+            self.pieceCells = pieceCells
+            self.status = status
+            self.nextPiece = nextPiece
+            self.fullRedraw = False
+            if prof:
+                prof.lap('next')
+                if prof.showOverlay:
+                    drawProfileOverlay(prof)
+                    self.overlayAge = 0
+                    prof.lap('overlay')
+            return [DISPLAYSURF.get_rect()]
+
+        background = RENDERCACHE.background
+        dirty: List[pygame.Rect] = []
+
+        changed: Set[Tuple[int, int]] = set()
+        colors = board.colors
+        sliced = view.cols < board.width
+        for i, y in enumerate(visibleRows):
+            row = colors[y][left:right] if sliced else colors[y]
+            old = self.boardColors[i]
+            if row != old:
+                changed.update((left + x, y) for x in range(view.cols) if row[x] != old[x])
+                self.boardColors[i] = bytes(row)
+        if pieceCells != self.pieceCells:
+            changed.update(pieceCells.keys() ^ self.pieceCells.keys())
+            changed.update(k for k in pieceCells.keys() & self.pieceCells.keys() if pieceCells[k] != self.pieceCells[k])
+            self.pieceCells = pieceCells
+        blocks = RENDERCACHE.blocks
+        for x, y in changed:
+            rect = pygame.Rect(*convertToPixelCoords(x, y), BOXSIZE, BOXSIZE)
+            DISPLAYSURF.blit(background, rect, rect)
+            color = pieceCells.get((x, y))
+            if color is None and y >= 0:
+                color = board.colors[y][x] - 1
+            if color is not None and color >= 0:
+                DISPLAYSURF.blit(blocks[color], (rect.x + 1, rect.y + 1))
+            dirty.append(rect)
+        if prof:
+            prof.lap('board')
+
+        if status != self.status:
+            for rect in self.statusRects:
+                DISPLAYSURF.blit(background, rect, rect)
+            dirty += self.statusRects
+            self.statusRects = drawStatus(*status)
+            dirty += self.statusRects
+            self.status = status
+        if prof:
+            prof.lap('text')
+
+        if nextPiece != self.nextPiece:
+            rect = pygame.Rect(WINDOWWIDTH - 120, 100, TEMPLATEWIDTH * BOXSIZE, TEMPLATEHEIGHT * BOXSIZE)
+            DISPLAYSURF.blit(background, rect, rect)
+            drawPiece(sim.nextPiece, pixelx=rect.x, pixely=rect.y)
+            dirty.append(rect)
+            self.nextPiece = nextPiece
+        if prof:
+            prof.lap('next')
+            if prof.showOverlay:
+                self.overlayAge += 1
+                if self.overlayAge >= OVERLAYREFRESH:
+                    dirty.append(drawProfileOverlay(prof))
+                    self.overlayAge = 0
+                prof.lap('overlay')
+        return dirty
+
+
+def drawProfileOverlay(prof: FrameProfiler) -> pygame.Rect:
+    # p50/p95/p99 milliseconds of each phase over the profiler's recent frames, drawn over the background
+    rect = pygame.Rect(OVERLAYRECT)
+    DISPLAYSURF.blit(RENDERCACHE.background, rect, rect)
+    lines = ['%-8s %5s %5s %5s' % ('ms', 'p50', 'p95', 'p99')]
+    for phase in prof.phases + [FRAME]:
+        p50, p95, p99 = prof.percentiles(phase)
+        lines.append('%-8s %5.2f %5.2f %5.2f' % (phase, p50 / 1e6, p95 / 1e6, p99 / 1e6))
+    y = rect.y
+    for line in lines:
+        surf = SMALLFONT.render(line, True, TEXTCOLOR)  # changes every refresh, so not worth caching
+        DISPLAYSURF.blit(surf, (rect.x, y), (0, 0, rect.width, rect.bottom - y))
+        y += SMALLFONT.get_linesize()
+    return rect
+
+
+def getPieceCells(piece: Opt[pieceType]) -> Dict[Tuple[int, int], int]:
+    # board (x, y) of each box of the piece, mapped to its colour
+    if piece is None:
+        return {}
+    px, py, color = piece['x'], piece['y'], piece['color']
+    return {(px + x, py + y): color for x, y in SHAPES[piece['shape']][piece['rotation']].cells}
 
 
 def convertToPixelCoords(boxx: int, boxy: int) -> Tuple[int, int]:
     # Convert the given xy coordinates of the board to xy
     # coordinates of the location on the screen.
-    return (XMARGIN + (boxx * BOXSIZE)), (TOPMARGIN + (boxy * BOXSIZE))
+    view = VIEWPORT
+    return (view.xMargin + ((boxx - view.left) * BOXSIZE)), (view.topMargin + ((boxy - view.top) * BOXSIZE))
 
 
 def drawBox(boxx: Opt[int], boxy: Opt[int], color: Union[str, int], pixelx: Opt[int] = None, pixely: Opt[int] = None) -> None:
@@ -474,58 +544,75 @@ def drawBox(boxx: Opt[int], boxy: Opt[int], color: Union[str, int], pixelx: Opt[
             pixelx, pixely = convertToPixelCoords(boxx, boxy)
 
     if pixelx is not None and pixely is not None and isinstance(color, int):
-        pygame.draw.rect(DISPLAYSURF, COLORS[color], (pixelx + 1, pixely + 1, BOXSIZE - 1, BOXSIZE - 1))
-        pygame.draw.rect(DISPLAYSURF, LIGHTCOLORS[color], (pixelx + 1, pixely + 1, BOXSIZE - 4, BOXSIZE - 4))
+        DISPLAYSURF.blit(RENDERCACHE.blocks[color], (pixelx + 1, pixely + 1))
 
 
 def drawBoard(board: boardType) -> None:
-    # draw the border around the board
-    pygame.draw.rect(DISPLAYSURF, BORDERCOLOR, (XMARGIN - 3, TOPMARGIN - 7, (BOARDWIDTH * BOXSIZE) + 8, (BOARDHEIGHT * BOXSIZE) + 8), 5)
-
-    # fill the background of the board
-    pygame.draw.rect(DISPLAYSURF, BGCOLOR, (XMARGIN, TOPMARGIN, BOXSIZE * BOARDWIDTH, BOXSIZE * BOARDHEIGHT))
-    # draw the individual boxes on the board
-    for x in range(BOARDWIDTH):
-        for y in range(BOARDHEIGHT):
-            drawBox(x, y, board[x][y])
+    # draw the individual boxes of the board in VIEWPORT, skipping rows with nothing in them.
+    # The border and the board background are part of RENDERCACHE.background.
+    blocks = RENDERCACHE.blocks
+    view = VIEWPORT
+    left = view.left
+    blits = []
+    for y in range(view.top, view.top + view.rows):
+        if board.rows[y] == board.emptyRow:
+            continue
+        pixely = view.topMargin + ((y - view.top) * BOXSIZE) + 1
+        for x, c in enumerate(board.colors[y][left:left + view.cols]):
+            if c:
+                blits.append((blocks[c - 1], (view.xMargin + (x * BOXSIZE) + 1, pixely)))
+    DISPLAYSURF.blits(blits, doreturn=False)
 
 
-def drawStatus(score: int, level: int) -> None:
+def drawStatus(score: int, level: int) -> List[pygame.Rect]:
     # draw the score text
-    scoreSurf = BASICFONT.render('Score: %s' % score, True, TEXTCOLOR)
+    scoreSurf = RENDERCACHE.text(BASICFONT, 'Score: %s' % score, TEXTCOLOR)
     scoreRect = scoreSurf.get_rect()
     scoreRect.topleft = (WINDOWWIDTH - 150, 20)
     DISPLAYSURF.blit(scoreSurf, scoreRect)
 
     # draw the level text
-    levelSurf = BASICFONT.render('Level: %s' % level, True, TEXTCOLOR)
+    levelSurf = RENDERCACHE.text(BASICFONT, 'Level: %s' % level, TEXTCOLOR)
     levelRect = levelSurf.get_rect()
     levelRect.topleft = (WINDOWWIDTH - 150, 50)
     DISPLAYSURF.blit(levelSurf, levelRect)
+    return [scoreRect, levelRect]
 
 
 def drawPiece(piece: pieceType, pixelx: int = None, pixely: int = None) -> None:
-    shapeToDraw = PIECES[piece['shape']][piece['rotation']]
+    shapeToDraw = SHAPES[piece['shape']][piece['rotation']]
+    cells = shapeToDraw.cells
     if pixelx is None and pixely is None:
         # if pixelx & pixely hasn't been specified, use the location stored in the piece data structure
         pixelx, pixely = convertToPixelCoords(piece['x'], piece['y'])
+        if VIEWPORT.scrolls:
+            cells = tuple((x, y) for x, y in cells if VIEWPORT.isVisible(piece['x'] + x, piece['y'] + y))
     # draw each of the boxes that make up the piece
     if pixelx is not None and pixely is not None:
-        for x in range(TEMPLATEWIDTH):
-            for y in range(TEMPLATEHEIGHT):
-                if shapeToDraw[y][x] != BLANK:
-                    drawBox(None, None, piece['color'], pixelx + (x * BOXSIZE), pixely + (y * BOXSIZE))
+        for x, y in cells:
+            drawBox(None, None, piece['color'], pixelx + (x * BOXSIZE), pixely + (y * BOXSIZE))
 
 
 def drawNextPiece(piece: pieceType) -> None:
-    # draw the "next" text
-    nextSurf = BASICFONT.render('Next:', True, TEXTCOLOR)
-    nextRect = nextSurf.get_rect()
-    nextRect.topleft = (WINDOWWIDTH - 120, 80)
-    DISPLAYSURF.blit(nextSurf, nextRect)
-    # draw the "next" piece
+    # draw the "next" piece, the "next" text is part of RENDERCACHE.background
     drawPiece(piece, pixelx=WINDOWWIDTH - 120, pixely=100)
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Tetromino')
+    parser.add_argument('--bot', action='store_true', help='let the built-in bot play')
+    parser.add_argument('--record', type=Path, metavar='DIR', help='save a replay of every game in DIR')
+    parser.add_argument('--replay', type=Path, metavar='FILE', help='watch a recorded game instead of playing')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 1 is real time')
+    parser.add_argument('--width', type=int, default=BOARDWIDTH, help='board width in cells (up to 1000)')
+    parser.add_argument('--height', type=int, default=BOARDHEIGHT, help='board height in cells (up to 10000)')
+    parser.add_argument('--bag', action='store_true', help='deal pieces from shuffled bags of all seven shapes')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='time every phase of the game loop (F3 shows them) and save the trace to FILE (.csv or .json) on exit')
+    args = parser.parse_args()
+    if args.profile:
+        PROFILER = FrameProfiler(tracePath=args.profile)
+    if args.replay is not None:
+        watchReplay(args.replay, args.speed)
+    else:
+        main(TetrisBot() if args.bot else None, args.record, args.width, args.height, 'bag' if args.bag else 'uniform')
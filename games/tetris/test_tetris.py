@@ -0,0 +1,466 @@
+import json
+import os
+import random
+import tempfile
+import numpy as np
+import pygame
+from pathlib import Path
+from typing import List, Tuple
+from unittest import TestCase
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+from games.tetris.bitboard import BitBoard, BLANK, PAD
+from games.tetris.shapes import SHAPES, SHAPENAMES, TEMPLATEWIDTH
+from games.tetris.batchenv import BatchTetrisEnv
+from games.tetris.bot import TetrisBot, BotController, findPlacements
+from games.tetris.tournament import playGame, summarize
+from games.tetris.replay import HEADER, ReplayReader, ReplayWriter, replayHeadless
+from games.tetris import terisgame as tg
+from games.tetris.benchmark import compare, makeBoard, runBenchmarks
+from games.tetris.profiler import FrameProfiler, FRAME
+from games.tetris.state import GameState
+from games.tetris.generator import PieceGenerator
+from games.tetris.scheduler import FixedTimestep, TimerQueue, ticksFor
+from games.tetris.simulation import (TetrisSim, KEY_LEFT, KEY_DOWN, KEY_DROP,
+                                     getNewPiece, isValidPosition, removeCompleteLines)
+
+
+class TestCaseBitBoard(TestCase):
+    """"""
+
+    def test_walls_and_floor(self) -> None:
+        board = tg.getBlankBoard()
+        piece: tg.pieceType = {'shape': 'I', 'rotation': 1, 'x': 0, 'y': 0, 'color': 0}  # 'OOOO.' on template row 2
+        assert tg.isValidPosition(board, piece)
+        assert not tg.isValidPosition(board, piece, adjX=-1)
+        assert tg.isValidPosition(board, piece, adjX=tg.BOARDWIDTH - 4)
+        assert not tg.isValidPosition(board, piece, adjX=tg.BOARDWIDTH - 3)
+        assert tg.isValidPosition(board, piece, adjY=tg.BOARDHEIGHT - 3)
+        assert not tg.isValidPosition(board, piece, adjY=tg.BOARDHEIGHT - 2)
+        assert tg.isValidPosition(board, piece, adjY=-10)  # rows above the board are not checked
+
+    def test_add_and_clear(self) -> None:
+        board = tg.getBlankBoard()
+        bottom = tg.BOARDHEIGHT - 1
+        for x in range(0, tg.BOARDWIDTH, 2):
+            tg.addToBoard(board, {'shape': 'O', 'rotation': 0, 'x': x - 1, 'y': bottom - 3, 'color': x % 4})
+        assert tg.isCompleteLine(board, bottom) and tg.isCompleteLine(board, bottom - 1)
+        board.place(((0, 1),), ((0, 0),), 3, 0, bottom - 2)  # single box on top of the stack
+        assert not tg.isValidPosition(board, {'shape': 'O', 'rotation': 0, 'x': -1, 'y': bottom - 5, 'color': 0})
+
+        assert tg.removeCompleteLines(board) == 2
+        assert board.colorAt(0, bottom) == 3
+        assert board.colorAt(1, bottom) == BLANK
+        assert all(board.rows[y] == board.emptyRow for y in range(bottom))
+
+    def test_copy_is_independent(self) -> None:
+        board = BitBoard(4, 3)
+        board.place(((0, 0b11),), ((0, 0), (1, 0)), 1, 0, 2)
+        clone = board.copy()
+        clone.place(((0, 0b11),), ((0, 0), (1, 0)), 2, 2, 2)
+        assert clone.isCompleteLine(2) and not board.isCompleteLine(2)
+        assert board.colorAt(2, 2) == BLANK and clone.colorAt(2, 2) == 2
+
+
+class TestCaseShapes(TestCase):
+    """"""
+
+    def test_compiled_tables(self) -> None:
+        for rotations in SHAPES.values():
+            for rot in rotations:
+                assert len(rot.cells) == 4
+                assert sum(bin(m).count('1') for _, m in rot.rowMasks) == 4
+                minX, minY, maxX, maxY = rot.bbox
+                assert (rot.width, rot.height) == (maxX - minX + 1, maxY - minY + 1)
+        t = SHAPES['T'][2]  # '.OOO.' over '..O..'
+        assert t.rowMasks == ((2, 0b01110), (3, 0b00100))
+        assert t.bottoms == ((1, 2), (2, 3), (3, 2))
+
+
+class TestCaseSimulation(TestCase):
+    """"""
+
+    def test_gravity_and_drop(self) -> None:
+        sim = TetrisSim(seed=1)
+        piece = sim.fallingPiece
+        assert piece is not None
+        startY = piece['y']
+        ticks = int(sim.fallFreq / sim.tickSeconds) + 2
+        for _ in range(ticks):
+            sim.step()
+        assert piece['y'] == startY + 1
+
+        assert sim.step(KEY_DROP) == 0
+        assert sim.fallingPiece is piece and not isValidPosition(sim.board, piece, adjY=1)
+        for _ in range(ticks):
+            sim.step(KEY_DROP)  # held, so no second drop
+        assert sim.pieces == 1 and sim.fallingPiece is not piece
+
+    def test_seed_reproduces_game(self) -> None:
+        results = []
+        for _ in range(2):
+            sim = TetrisSim(seed=42)
+            for tick in range(5000):
+                sim.step((KEY_LEFT if tick % 50 < 10 else 0) | (KEY_DROP if tick % 7 == 0 else 0))
+            results.append((sim.pieces, sim.score, sim.gameOver, sim.board.rows))
+        assert results[0] == results[1]
+        assert results[0][0] > 0
+
+    def test_large_board(self) -> None:
+        sim = TetrisSim(seed=2, width=1000, height=10000)
+        piece = sim.fallingPiece
+        assert piece is not None and piece['x'] == 498
+        board = sim.board
+        board.rows[-1] = board.fullRow & ~(1 << PAD)
+        board.rows[-2] = board.fullRow
+        board.rows[-3] = board.fullRow & ~(1 << (PAD + 1))
+        assert removeCompleteLines(board, board.height - 3, board.height - 2) == 0  # only checks the row given
+        assert removeCompleteLines(board, board.height - 4, board.height) == 1
+        assert board.rows[-1] == board.fullRow & ~(1 << PAD) and board.rows[-2] == board.fullRow & ~(1 << (PAD + 1))
+        assert board.rows[0] == board.emptyRow and len(board.rows) == len(board.colors) == 10000
+        sim.step(KEY_DROP)
+        sim.run(maxTicks=100)
+        assert sim.pieces > 0
+
+    def test_snapshot_and_restore(self) -> None:
+        keys = []
+        sim = TetrisSim(seed=8, lockDelay=0.2)
+        controller = BotController(TetrisBot())
+        for _ in range(1200):
+            keys.append(controller.nextKeys(sim))
+            sim.step(keys[-1])
+        sim = TetrisSim(seed=8, lockDelay=0.2)
+        for k in keys[:400]:
+            sim.step(k)
+        state = sim.snapshot()
+        for k in keys[400:]:
+            sim.step(k)
+        final = sim.snapshot()
+        assert final != state and sim.pieces > 10
+
+        for restored in (sim, TetrisSim.fromSnapshot(GameState.fromBytes(state.toBytes()))):
+            restored.restore(state)
+            assert restored.snapshot() == state
+            for k in keys[400:]:
+                restored.step(k)
+            assert restored.snapshot() == final and hash(restored.snapshot()) == hash(final)
+        assert len({state, final, GameState.fromBytes(final.toBytes())}) == 2
+
+    def test_piece_generator(self) -> None:
+        rng = random.Random(5)
+        generator = PieceGenerator(5)
+        for _ in range(200):  # same rng calls as getNewPiece, so seeded games and old replays are unchanged
+            piece = getNewPiece(rng)
+            assert generator.next() == (piece['shape'], piece['rotation'], piece['color'])
+
+        bags = PieceGenerator(9, 'bag', preview=6).sequence(70)
+        assert all(sorted(spec[0] for spec in bags[i:i + 7]) == sorted(SHAPENAMES) for i in range(0, 70, 7))
+        assert PieceGenerator(9, 'bag', batch=1).sequence(70) == bags
+
+        sim = TetrisSim(seed=9, policy='bag', preview=4)
+        preview = [(p['shape'], p['rotation'], p['color']) for p in sim.previewPieces(4)]
+        spawned: List[Tuple[str, int, int]] = []
+        while len(spawned) < 4:
+            sim.step(KEY_DROP if sim.ticks % 2 == 0 else 0)
+            falling = sim.fallingPiece
+            if falling is not None and sim.pieces == len(spawned):
+                spawned.append((falling['shape'], falling['rotation'], falling['color']))
+        assert spawned[1:] == preview[:3]
+
+
+class TestCaseScheduler(TestCase):
+    """"""
+
+    def test_timer_queue(self) -> None:
+        timers = TimerQueue()
+        timers.schedule('fall', 5)
+        timers.schedule('shift', 3)
+        timers.schedule('lock', 3)
+        timers.cancel('lock')
+        timers.schedule('fall', 8)  # replaces the pending fall
+        assert timers.popDue(2) == []
+        assert timers.popDue(5) == ['shift']
+        assert timers.isPending('fall') and not timers.isPending('shift')
+        assert timers.popDue(100) == ['fall']
+        assert ticksFor(0.1, 0.1) == 2 and ticksFor(0.0, 0.04) == 1
+
+    def test_fixed_timestep(self) -> None:
+        now = [0.0]
+        timestep = FixedTimestep(0.01, 0.04, maxTicksPerUpdate=50, clock=lambda: now[0])
+        assert timestep.frameDue() and not timestep.frameDue()
+        now[0] = 0.035
+        assert timestep.ticksDue() == 3 and not timestep.frameDue()
+        now[0] = 0.045
+        assert timestep.ticksDue() == 1 and timestep.frameDue()
+        now[0] = 10.0
+        assert timestep.ticksDue() == 50  # a stall doesn't replay every missed tick
+
+    def test_tick_rate_and_lock_delay(self) -> None:
+        # the same game at 25 and 250 ticks a second
+        sims = [TetrisSim(seed=3, tickSeconds=1 / 25), TetrisSim(seed=3, tickSeconds=1 / 250)]
+        for sim in sims:
+            for _ in range(round(30 / sim.tickSeconds)):
+                sim.step()
+        assert sims[0].pieces == sims[1].pieces > 0
+        assert sims[0].board.rows == sims[1].board.rows
+
+        sim = TetrisSim(seed=1, lockDelay=0.5)
+        piece = sim.fallingPiece
+        sim.step(KEY_DROP)
+        for _ in range(ticksFor(0.5, sim.tickSeconds) - 1):
+            sim.step()
+        assert sim.fallingPiece is piece
+        for _ in range(ticksFor(sim.fallFreq, sim.tickSeconds) + 1):
+            sim.step()
+        assert sim.fallingPiece is not piece and sim.pieces == 1
+
+
+class TestCaseBatchEnv(TestCase):
+    """"""
+
+    def test_matches_bitboard(self) -> None:
+        env = BatchTetrisEnv(16, seed=3)
+        boards = [BitBoard(env.width, env.height) for _ in range(env.numEnvs)]
+        rng = np.random.default_rng(4)
+        for _ in range(30):
+            shapes = env.shapes.copy()
+            valid = env.validActions()
+            actions = np.array([rng.choice(np.flatnonzero(v)) for v in valid])
+            _, lines, dones, _ = env.step(actions)
+            for i, board in enumerate(boards):
+                rotations = SHAPES[SHAPENAMES[shapes[i]]]
+                rotation, column = divmod(int(actions[i]), env.numColumns)
+                rot = rotations[rotation % len(rotations)]
+                x = column - (TEMPLATEWIDTH - 1)
+                y = -2
+                while board.fits(rot.rowMasks, x, y + 1):
+                    y += 1
+                board.place(rot.rowMasks, rot.cells, 0, x, y)
+                assert board.clearLines() == lines[i]
+                if dones[i]:
+                    boards[i] = BitBoard(env.width, env.height)
+                else:
+                    assert env.boards[i, 2:2 + env.height].tolist() == board.rows
+
+
+class TestCaseBot(TestCase):
+    """"""
+
+    def test_finds_tuck(self) -> None:
+        board = BitBoard(4, 4)
+        board.place(((0, 0b0001),), ((0, 0),), 0, 0, 1)  # roof over the bottom left corner
+        placements = findPlacements(tuple(board.rows), 'O', 0, 0, -2, withPaths=True)
+        # the O (template columns 1-2, rows 2-3) can only get under the roof by sliding in from the right
+        assert placements[(0, -1, 0)] == ['down', 'left']
+        assert placements[(0, 0, 0)] == ['down']
+        assert (0, -1, -3) not in placements
+
+    def test_plays_headless_and_by_keys(self) -> None:
+        sim = TetrisSim(seed=5)
+        bot = TetrisBot()
+        assert bot.playHeadless(sim, maxPieces=100) > 0
+        assert sim.pieces == 100 and sim.score > 20 and not sim.gameOver
+        assert bot.cache.hits > 0
+
+        sim = TetrisSim(seed=5)
+        controller = BotController(TetrisBot())
+        while sim.pieces < 30:
+            sim.step(controller.nextKeys(sim))
+        assert not sim.gameOver and sim.score > 0
+
+    def test_tournament_game_is_reproducible(self) -> None:
+        first = playGame(7, maxPieces=20)
+        second = playGame(7, maxPieces=20)
+        assert (first.score, first.pieces, first.level) == (second.score, second.pieces, second.level)
+        assert summarize([first, second])['pieces']['mean'] == 20
+
+
+class TestCaseReplay(TestCase):
+    """"""
+
+    def test_record_and_replay(self) -> None:
+        sim = TetrisSim(seed=11)
+        controller = BotController(TetrisBot())
+        with tempfile.TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / 'game.ttr')
+            with ReplayWriter(path, 11, sim.tickSeconds) as writer:
+                while sim.pieces < 25:
+                    keys = controller.nextKeys(sim)
+                    sim.step(keys)
+                    writer.record(keys)
+            # the bot changes keys nearly every tick, so there is up to one two byte run per tick
+            assert Path(path).stat().st_size <= HEADER.size + 2 * writer.ticks
+            replayed = replayHeadless(path)
+            assert replayed.ticks == sim.ticks == writer.ticks
+            assert (replayed.board.rows, replayed.score, replayed.pieces) == (sim.board.rows, sim.score, sim.pieces)
+            assert replayed.board.colors == sim.board.colors
+
+    def test_varint_runs(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / 'runs.ttr')
+            runs = [(0, 1), (KEY_LEFT, 300), (0, 100000), (KEY_DROP, 2)]
+            with ReplayWriter(path, -5, 0.01) as writer:
+                for keys, count in runs:
+                    for _ in range(count):
+                        writer.record(keys)
+            reader = ReplayReader(path)
+            assert (reader.seed, reader.tickSeconds) == (-5, 0.01)
+            assert [(k, c) for k, c in reader.runs()] == runs
+
+
+class TestCaseBenchmark(TestCase):
+    """"""
+
+    def test_boards_and_regressions(self) -> None:
+        assert makeBoard('empty').rows == BitBoard(10, 20).rows
+        assert removeCompleteLines(makeBoard('nearlyFull')) == 0
+        assert removeCompleteLines(makeBoard('completeLines')) == 8
+        results = runBenchmarks(('engine', ), minSeconds=0.001, repeat=1, match='[tallStack]', out=None)
+        assert set(results) == {'isValidPosition[tallStack]', 'addToBoard[tallStack]', 'removeCompleteLines[tallStack]'}
+        slower = {name: {'opsPerSec': r['opsPerSec'] / 2, 'usPerOp': r['usPerOp'] * 2} for name, r in results.items()}
+        assert compare(slower, results, 0.2) and not compare(results, slower, 0.2)
+
+
+class TestCaseProfiler(TestCase):
+    """"""
+
+    def test_laps_and_export(self) -> None:
+        now = [0]
+        prof = FrameProfiler(window=3)
+        prof.clock = lambda: now[0]
+        prof.skip()
+        for frame in range(5):
+            now[0] += 1000
+            prof.lap('events')
+            if frame >= 2:
+                now[0] += 5000 * frame
+                prof.lap('draw')
+            prof.endFrame()
+        assert prof.phases == ['events', 'draw'] and prof.frames == 5
+        assert list(prof.trace['draw']) == [0, 0, 10000, 15000, 20000]
+        assert prof.percentiles('draw') == (15000, 20000, 20000)
+        assert prof.percentiles(FRAME, recent=False) == (11000, 21000, 21000)
+        with tempfile.TemporaryDirectory() as tmp:
+            prof.export(str(Path(tmp) / 'trace.csv'))
+            lines = (Path(tmp) / 'trace.csv').read_text().splitlines()
+            assert lines[0] == 'frame,events_us,draw_us,frame_us' and lines[3] == '2,1.0,10.0,11.0'
+            prof.export(str(Path(tmp) / 'trace.json'))
+            data = json.loads((Path(tmp) / 'trace.json').read_text())
+            assert data['summaryMicroseconds']['draw']['max'] == 20.0
+
+
+class TestCaseRendering(TestCase):
+    """"""
+
+    def test_dirty_frames_match_full_redraw(self) -> None:
+        tg.initDisplay()
+        sim = TetrisSim(seed=1)
+        controller = BotController(TetrisBot())
+        renderer = tg.DirtyRenderer()
+        idleFrames = 0
+        while sim.pieces < 15:
+            sim.step(controller.nextKeys(sim))
+            idleFrames += not renderer.draw(sim)
+            dirtyFrame = pygame.image.tostring(tg.DISPLAYSURF, 'RGB')
+            tg.drawGame(sim)
+            assert dirtyFrame == pygame.image.tostring(tg.DISPLAYSURF, 'RGB')
+        assert idleFrames > 0
+
+    def test_cached_blocks_match_draw_rect(self) -> None:
+        tg.initDisplay()
+        sim = TetrisSim(seed=2)
+        controller = BotController(TetrisBot())
+        while sim.pieces < 20:
+            sim.step(controller.nextKeys(sim))
+        board = sim.board
+        nextPiece = sim.nextPiece
+        assert nextPiece is not None
+        view = tg.VIEWPORT
+        surf = tg.DISPLAYSURF
+
+        def drawRectBox(color: int, pixelx: int, pixely: int) -> None:
+            # the blocks as drawn before RenderCache
+            pygame.draw.rect(surf, tg.COLORS[color], (pixelx + 1, pixely + 1, tg.BOXSIZE - 1, tg.BOXSIZE - 1))
+            pygame.draw.rect(surf, tg.LIGHTCOLORS[color], (pixelx + 1, pixely + 1, tg.BOXSIZE - 4, tg.BOXSIZE - 4))
+
+        # cached: the prebuilt background and blocks
+        surf.blit(tg.RENDERCACHE.background, (0, 0))
+        tg.drawBoard(board)
+        tg.drawNextPiece(nextPiece)
+        cached = pygame.image.tostring(surf, 'RGB')
+
+        # plain draw.rect and font rendering
+        surf.fill(tg.BGCOLOR)
+        pygame.draw.rect(surf, tg.BORDERCOLOR,
+                         (view.xMargin - 3, view.topMargin - 7, (view.cols * tg.BOXSIZE) + 8, (view.rows * tg.BOXSIZE) + 8), 5)
+        surf.blit(tg.BASICFONT.render('Next:', True, tg.TEXTCOLOR), (tg.WINDOWWIDTH - 120, 80))
+        filled = 0
+        for y in range(view.top, view.top + view.rows):
+            for x in range(view.left, view.left + view.cols):
+                color = board.colorAt(x, y)
+                if isinstance(color, int):
+                    drawRectBox(color, *tg.convertToPixelCoords(x, y))
+                    filled += 1
+        for x, y in SHAPES[nextPiece['shape']][nextPiece['rotation']].cells:
+            drawRectBox(nextPiece['color'], tg.WINDOWWIDTH - 120 + x * tg.BOXSIZE, 100 + y * tg.BOXSIZE)
+        assert filled > 0
+        assert cached == pygame.image.tostring(surf, 'RGB')
+
+    def test_profiler_overlay(self) -> None:
+        tg.initDisplay()
+        tg.PROFILER = prof = FrameProfiler()
+        prof.showOverlay = True
+        try:
+            sim = TetrisSim(seed=1)
+            renderer = tg.DirtyRenderer()
+            for _ in range(2 * tg.OVERLAYREFRESH):
+                sim.step(KEY_DOWN)
+                renderer.draw(sim)
+                prof.endFrame()
+        finally:
+            tg.PROFILER = None
+        assert prof.phases == ['board', 'text', 'next', 'overlay']
+        overlay = tg.DISPLAYSURF.subsurface(tg.OVERLAYRECT)
+        assert pygame.transform.average_color(overlay)[:3] != tg.BGCOLOR
+
+    def test_replay_is_profiled(self) -> None:
+        sim = TetrisSim(seed=5)
+        controller = BotController(TetrisBot())
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'game.ttr'
+            with ReplayWriter(str(path), 5, sim.tickSeconds) as writer:
+                while sim.pieces < 5:
+                    keys = controller.nextKeys(sim)
+                    sim.step(keys)
+                    writer.record(keys)
+            trace = str(Path(tmp) / 'trace.csv')
+            tg.PROFILER = prof = FrameProfiler(tracePath=trace)
+            try:
+                tg.initDisplay()
+                tg.playReplay(path, speed=20)
+                assert prof.frames > 0 and {'sim', 'events', 'display'} <= set(prof.phases)
+                # --replay exports the trace however playback ends
+                with self.assertRaises(FileNotFoundError):
+                    tg.watchReplay(Path(tmp) / 'missing.ttr')
+            finally:
+                tg.PROFILER = None
+            with open(trace) as f:
+                assert len(f.readlines()) == prof.frames + 1
+
+    def test_scrolling_viewport(self) -> None:
+        tg.initDisplay()
+        sim = TetrisSim(seed=4, width=24, height=60)
+        tg.setBoardSize(24, 60)
+        controller = BotController(TetrisBot())
+        renderer = tg.DirtyRenderer()
+        tops = set()
+        while sim.pieces < 6:
+            sim.step(controller.nextKeys(sim))
+            renderer.draw(sim)
+            tops.add(tg.VIEWPORT.top)
+            dirtyFrame = pygame.image.tostring(tg.DISPLAYSURF, 'RGB')
+            tg.drawGame(sim)
+            assert dirtyFrame == pygame.image.tostring(tg.DISPLAYSURF, 'RGB')
+        assert len(tops) > 1 and max(tops) == 60 - tg.MAXVIEWROWS
@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, asdict, fields
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional as Opt
+
+from .bot import Heuristic, TetrisBot
+from .simulation import TetrisSim
+
+# Self-play tournament runner. Seeded headless games are spread over a process
+# pool and their results streamed back as they finish. Each game gets a fresh
+# bot, so a seed always replays the same game whatever worker it lands on.
+
+
+@dataclass(frozen=True)
+class GameResult():
+    seed: int
+    score: int
+    lines: int
+    pieces: int
+    level: int
+    gameOver: bool
+    seconds: float
+    secondsPerMove: float
+
+
+def playGame(seed: int, heuristic: Opt[Heuristic] = None, lookahead: bool = True, maxPieces: Opt[int] = None) -> GameResult:
+    sim = TetrisSim(seed=seed)
+    bot = TetrisBot(heuristic, lookahead=lookahead)
+    start = time.perf_counter()
+    bot.playHeadless(sim, maxPieces)
+    seconds = time.perf_counter() - start
+    return GameResult(seed=seed,
+                      score=sim.score,
+                      lines=sim.score,  # one point per line
+                      pieces=sim.pieces,
+                      level=sim.level,
+                      gameOver=sim.gameOver,
+                      seconds=seconds,
+                      secondsPerMove=seconds / sim.pieces if sim.pieces else 0.0)
+
+
+def runTournament(seeds: Iterable[int], heuristic: Opt[Heuristic] = None, lookahead: bool = True,
+                  maxPieces: Opt[int] = None, workers: Opt[int] = None) -> Iterator[GameResult]:
+    # yield the result of every seeded game as soon as it finishes (not in seed order)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(playGame, seed, heuristic, lookahead, maxPieces) for seed in seeds]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def summarize(results: List[GameResult]) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {'games': len(results),
+                               'gameOvers': sum(r.gameOver for r in results)}
+    for field in ('score', 'lines', 'pieces', 'level', 'secondsPerMove'):
+        values = [getattr(r, field) for r in results]
+        summary[field] = {'mean': statistics.mean(values),
+                          'median': statistics.median(values),
+                          'stdev': statistics.stdev(values) if len(values) > 1 else 0.0,
+                          'min': min(values),
+                          'max': max(values)}
+    return summary
+
+
+def main(argv: Opt[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Play seeded headless tetris games with the bot on every core.')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--max-pieces', type=int, default=1000, help='stop a game after this many pieces (0 for no limit)')
+    parser.add_argument('--no-lookahead', action='store_true')
+    parser.add_argument('--heuristic', type=json.loads, default={},
+                        help='JSON object of Heuristic weights, e.g. \'{"holes": -0.5}\'')
+    parser.add_argument('--results', help='write one JSON line per game here as they finish')
+    parser.add_argument('--stats', help='write the aggregated statistics here as JSON')
+    args = parser.parse_args(argv)
+
+    heuristic = Heuristic(**{f.name: float(args.heuristic[f.name]) for f in fields(Heuristic) if f.name in args.heuristic})
+    seeds = range(args.first_seed, args.first_seed + args.games)
+    results: List[GameResult] = []
+    resultsFile = open(args.results, 'w') if args.results else None
+    start = time.perf_counter()
+    try:
+        for result in runTournament(seeds, heuristic, not args.no_lookahead, args.max_pieces or None, args.workers):
+            results.append(result)
+            line = json.dumps(asdict(result))
+            print(line)
+            if resultsFile is not None:
+                resultsFile.write(line + '\n')
+                resultsFile.flush()
+    finally:
+        if resultsFile is not None:
+            resultsFile.close()
+
+    summary = summarize(results)
+    summary['heuristic'] = asdict(heuristic)
+    summary['wallSeconds'] = time.perf_counter() - start
+    summary['workers'] = args.workers
+    if args.stats:
+        with open(args.stats, 'w') as f:
+            json.dump(summary, f, indent=4)
+    json.dump(summary, sys.stderr, indent=4)
+
+
+if __name__ == '__main__':
+    main()